@@ -0,0 +1,765 @@
+"""
+A local LSF simulator, used to test and benchmark the LSF batch system.
+
+`install` writes `bsub`, `bjobs`, `bacct`, `bhist`, `bkill`, `bmod`,
+`brequeue`, `bgdel`, `bparams` and `bqueues` executables to a directory that
+can be put on PATH. Jobs are kept in a SQLite database in `FAKE_LSF_DIR`, and
+are scheduled against `FAKE_LSF_SLOTS` slots every time one of the commands
+is called.
+
+By default jobs are simulated and not executed: a job runs for
+`FAKE_LSF_TIME=<seconds>` and uses `FAKE_LSF_MEM=<bytes>`, both read from its
+command or environment, and is killed with TERM_MEMLIMIT or TERM_RUNLIMIT if
+it goes over its `-M` or `-W` limits. With `FAKE_LSF_EXECUTE=Y` the commands
+are executed in the background instead, and only the run limit is enforced.
+
+A job with `FAKE_LSF_STAT=<state>` in its command is put in that state, e.g.
+`UNKWN` or `SSUSP`, instead of running, until it's requeued with `brequeue`.
+
+`bqueues` reports the slots of the jobs submitted to each queue with `-q`,
+plus the load of other users set with `FAKE_LSF_QUEUES`, as
+`queue:max slots:pending slots:running slots` entries, e.g. `short:10:40:10`.
+Queues share the `FAKE_LSF_SLOTS` slots when scheduling. `bparams` reports
+per core reservation if `FAKE_LSF_PER_CORE=Y`. `bjobs` exits with
+`FAKE_LSF_EMPTY_EXIT` when there are no unfinished jobs, as some LSF versions
+exit with 255.
+"""
+
+import os
+import re
+import shlex
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = [
+    "bsub",
+    "bjobs",
+    "bacct",
+    "bhist",
+    "bkill",
+    "bmod",
+    "brequeue",
+    "bgdel",
+    "bparams",
+    "bqueues",
+]
+
+_STUCK = re.compile(r"FAKE_LSF_STAT=([A-Z]+)")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    jobid INTEGER NOT NULL,
+    jobindex INTEGER NOT NULL,
+    name TEXT,
+    grp TEXT,
+    queue TEXT,
+    command TEXT,
+    stdout TEXT,
+    stderr TEXT,
+    slots INTEGER NOT NULL,
+    mem_limit REAL,
+    run_limit REAL,
+    mem REAL NOT NULL,
+    duration REAL NOT NULL,
+    stat TEXT NOT NULL,
+    exit_code INTEGER,
+    exit_reason TEXT,
+    pid INTEGER,
+    submit REAL NOT NULL,
+    start REAL,
+    end REAL,
+    PRIMARY KEY (jobid, jobindex)
+);
+CREATE INDEX IF NOT EXISTS jobs_stat ON jobs (stat);
+CREATE INDEX IF NOT EXISTS jobs_grp ON jobs (grp);
+CREATE TABLE IF NOT EXISTS calls (command TEXT NOT NULL);
+"""
+
+# bsub options that take a value, the rest are flags
+_BSUB_OPTIONS = {
+    "-app", "-b", "-c", "-cwd", "-E", "-e", "-eo", "-G", "-g", "-J", "-m",
+    "-M", "-n", "-o", "-oo", "-P", "-pack", "-q", "-R", "-sla", "-u", "-W",
+    "-We",
+}  # fmt: skip
+
+_REASONS = {
+    "TERM_MEMLIMIT": "job killed after reaching LSF memory usage limit",
+    "TERM_RUNLIMIT": "job killed after reaching LSF run time limit",
+    "TERM_OWNER": "job killed by owner",
+}
+
+_UNITS = {"": 1e6, "K": 1e3, "KB": 1e3, "M": 1e6, "MB": 1e6, "G": 1e9, "GB": 1e9}
+
+
+def install(directory, state=None):
+    """
+    Write the fake LSF executables to `directory`.
+
+    Arguments:
+        directory (str): where to write the executables, to be put on PATH.
+        state (str): default `FAKE_LSF_DIR` of the executables.
+    """
+    os.makedirs(directory, exist_ok=True)
+    state = state or os.path.join(directory, "state")
+
+    for command in COMMANDS:
+        path = os.path.join(directory, command)
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(
+                "#!/bin/sh\n"
+                f'FAKE_LSF_DIR="${{FAKE_LSF_DIR:-{state}}}" '
+                f"exec {shlex.quote(sys.executable)} "
+                f'{shlex.quote(os.path.abspath(__file__))} {command} "$@"\n'
+            )
+
+        os.chmod(path, 0o755)
+
+
+def connect():
+    """Open the simulator database, creating it if needed."""
+    directory = os.getenv("FAKE_LSF_DIR") or os.path.join(
+        tempfile.gettempdir(), "fake_lsf"
+    )
+    os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(
+        os.path.join(directory, "lsf.db"), timeout=60, isolation_level=None
+    )
+    db.row_factory = sqlite3.Row
+    db.executescript(_SCHEMA)
+    return db
+
+
+def call_counts():
+    """Get the number of times each command was called."""
+    db = connect()
+    counts = dict(db.execute("SELECT command, COUNT(*) FROM calls GROUP BY command"))
+    db.close()
+    return counts
+
+
+def schedule(db, now=None):
+    """Finish the jobs that are over and start pending jobs on free slots."""
+    now = now or time.time()
+    execute = os.getenv("FAKE_LSF_EXECUTE") == "Y"
+    slots = int(os.getenv("FAKE_LSF_SLOTS", "100"))
+    db.execute("BEGIN IMMEDIATE")
+    started = True
+
+    # jobs that finish instantly free their slots within the same call
+    while started:
+        started = False
+
+        for job in db.execute("SELECT * FROM jobs WHERE stat = 'RUN'").fetchall():
+            if execute:
+                _check_process(db, job, now)
+            elif now >= job["end"]:
+                _finish(db, job, job["end"])
+
+        used = db.execute("SELECT TOTAL(slots) FROM jobs WHERE stat = 'RUN'")
+        free = slots - int(used.fetchone()[0])
+
+        for job in db.execute(
+            "SELECT * FROM jobs WHERE stat = 'PEND' "
+            "ORDER BY submit, jobid, jobindex LIMIT ?",
+            [max(free, 0)],
+        ).fetchall():
+            if free < job["slots"]:
+                break
+
+            free -= job["slots"]
+            started = started or (not execute and job["duration"] == 0)
+            _start(db, job, now, execute)
+
+    db.execute("COMMIT")
+
+
+def _where(job):
+    return "WHERE jobid = ? AND jobindex = ?", [job["jobid"], job["jobindex"]]
+
+
+def _start(db, job, now, execute):
+    where, params = _where(job)
+    duration = job["duration"]
+
+    if job["run_limit"]:
+        duration = min(duration, job["run_limit"])
+
+    pid = None
+    stuck = _STUCK.search(job["command"] or "")
+
+    if execute and not stuck:
+        pid = _spawn(job)
+
+    db.execute(
+        f"UPDATE jobs SET stat = ?, start = ?, end = ?, pid = ? {where}",
+        [stuck.group(1) if stuck else "RUN", now, now + duration, pid] + params,
+    )
+
+
+def _finish(db, job, end, exit_code=None):
+    where, params = _where(job)
+    reason = None
+
+    if exit_code is None:
+        exit_code = 0
+
+        if job["mem_limit"] and job["mem"] > job["mem_limit"]:
+            exit_code, reason = 130, "TERM_MEMLIMIT"
+        elif job["run_limit"] and job["duration"] > job["run_limit"]:
+            exit_code, reason = 140, "TERM_RUNLIMIT"
+
+    db.execute(
+        "UPDATE jobs SET stat = ?, exit_code = ?, exit_reason = ?, end = ? " + where,
+        ["DONE" if exit_code == 0 else "EXIT", exit_code, reason, end] + params,
+    )
+
+
+def _status_file(job):
+    return os.path.join(
+        os.getenv("FAKE_LSF_DIR", ""), f"{job['jobid']}.{job['jobindex']}.exit"
+    )
+
+
+def _spawn(job):
+    env = dict(os.environ, LSB_JOBID=str(job["jobid"]))
+    env["LSB_JOBINDEX"] = str(job["jobindex"])
+    status = shlex.quote(_status_file(job))
+    command = f"( {job['command']} ); echo $? > {status}.tmp; mv {status}.tmp {status}"
+    outputs = []
+
+    for path in (job["stdout"], job["stderr"]):
+        path = (path or os.devnull).replace("%J", str(job["jobid"]))
+        outputs.append(open(path.replace("%I", str(job["jobindex"])), "ab"))
+
+    process = subprocess.Popen(
+        ["sh", "-c", command],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=outputs[0],
+        stderr=outputs[1],
+        start_new_session=True,
+    )
+
+    for i in outputs:
+        i.close()
+
+    return process.pid
+
+
+def _check_process(db, job, now):
+    path = _status_file(job)
+
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            exit_code = int(f.read().strip() or 1)
+
+        os.remove(path)
+        _finish(db, job, now, exit_code)
+
+    elif job["run_limit"] and now - job["start"] > job["run_limit"]:
+        _signal(job["pid"])
+        where, params = _where(job)
+        db.execute(
+            "UPDATE jobs SET stat = 'EXIT', exit_code = 140, "
+            "exit_reason = 'TERM_RUNLIMIT', end = ? " + where,
+            [now] + params,
+        )
+
+
+def _signal(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (OSError, TypeError):
+        pass
+
+
+def parse_memory(value):
+    """Parse a bsub -M value such as `1000MB` to bytes, MB if no unit is set."""
+    match = re.match(r"^([\d.]+)\s*([A-Za-z]*)$", value.strip())
+    return float(match.group(1)) * _UNITS.get(match.group(2).upper(), 1e6)
+
+
+def parse_runtime(value):
+    """Parse a bsub -W value such as `90` or `1:30` to seconds."""
+    parts = [int(i) for i in value.split(":")]
+    return (parts[0] * 60 + parts[1] if len(parts) == 2 else parts[0]) * 60
+
+
+def _parse_bsub_args(args):
+    options = {}
+    i = 0
+
+    while i < len(args) and args[i].startswith("-"):
+        if args[i] in _BSUB_OPTIONS:
+            options.setdefault(args[i], []).append(args[i + 1])
+            i += 2
+        else:
+            options.setdefault(args[i], []).append(True)
+            i += 1
+
+    return options, " ".join(args[i:])
+
+
+def _submit(db, args):
+    options, command = _parse_bsub_args(args)
+    name = options.get("-J", [""])[-1].strip("'\"")
+    indexes = [0]
+    match = re.search(r"\[(\d+)-(\d+)\]$", name)
+
+    if match:
+        indexes = range(int(match.group(1)), int(match.group(2)) + 1)
+        name = name[: match.start()]
+
+    source = command + " " + " ".join(f"{k}={v}" for k, v in os.environ.items())
+    mem = re.search(r"FAKE_LSF_MEM=([\d.]+(?:e\d+)?)", source)
+    duration = re.search(r"FAKE_LSF_TIME=([\d.]+(?:e\d+)?)", source)
+    jobid = db.execute("SELECT COALESCE(MAX(jobid), 0) + 1 FROM jobs").fetchone()[0]
+    now = time.time()
+
+    db.executemany(
+        "INSERT INTO jobs (jobid, jobindex, name, grp, queue, command, stdout, "
+        "stderr, slots, mem_limit, run_limit, mem, duration, stat, submit) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'PEND', ?)",
+        [
+            (
+                jobid,
+                index,
+                name,
+                options.get("-g", [None])[-1],
+                options.get("-q", ["normal"])[-1],
+                command,
+                options.get("-o", options.get("-oo", [None]))[-1],
+                options.get("-e", options.get("-eo", [None]))[-1],
+                int(options.get("-n", ["1"])[-1]),
+                parse_memory(options["-M"][-1]) if "-M" in options else None,
+                parse_runtime(options["-W"][-1]) if "-W" in options else None,
+                float(mem.group(1)) if mem else 1e8,
+                float(duration.group(1)) if duration else 0.0,
+                now,
+            )
+            for index in indexes
+        ],
+    )
+
+    return jobid, "-K" in options
+
+
+def bsub(db, args):
+    """Submit a job, job array or `-pack` file."""
+    if args[:1] == ["-pack"]:
+        with open(args[1], encoding="utf-8") as f:
+            lines = [shlex.split(i) for i in f if i.strip()]
+    else:
+        lines = [args]
+
+    for line in lines:
+        db.execute("BEGIN IMMEDIATE")
+        jobid, wait = _submit(db, line)
+        db.execute("COMMIT")
+        print(f"Job <{jobid}> is submitted to default queue <normal>.")
+
+    schedule(db)
+
+    while wait:
+        time.sleep(0.05)
+        schedule(db)
+        jobs = _select(db, [str(jobid)], finished=True)
+
+        # bsub -K exits with the job's exit code once it's finished
+        if all(i["stat"] in ("DONE", "EXIT") for i in jobs):
+            return max(i["exit_code"] or 0 for i in jobs)
+
+    return 0
+
+
+def _select(db, ids=None, group=None, finished=False, clean=False):
+    """Get jobs by LSF ID, `id` or `id[index]`, or all unfinished jobs."""
+    query = "SELECT * FROM jobs"
+    where, params = [], []
+
+    if ids:
+        clauses = []
+
+        for i in ids:
+            match = re.match(r"^(\d+)(?:\[(\d+)\])?$", i)
+
+            if not match:
+                continue
+
+            if match.group(2):
+                clauses.append("(jobid = ? AND jobindex = ?)")
+                params += [int(match.group(1)), int(match.group(2))]
+            else:
+                clauses.append("jobid = ?")
+                params.append(int(match.group(1)))
+
+        where.append("(" + (" OR ".join(clauses) or "0") + ")")
+
+    if group:
+        where.append("grp = ?")
+        params.append(group)
+
+    if not finished and not ids:
+        where.append("stat NOT IN ('DONE', 'EXIT')")
+
+    if clean:
+        period = float(os.getenv("FAKE_LSF_CLEAN_PERIOD", "3600"))
+        where.append("(end IS NULL OR end >= ?)")
+        params.append(time.time() - period)
+
+    if where:
+        query += " WHERE " + " AND ".join(where)
+
+    return db.execute(query + " ORDER BY jobid, jobindex", params).fetchall()
+
+
+def _lsf_id(job):
+    return str(job["jobid"]) + (f"[{job['jobindex']}]" if job["jobindex"] else "")
+
+
+def _usage(job, now=None):
+    now = now or time.time()
+    run_time = None
+
+    if job["start"]:
+        end = job["end"] if job["stat"] in ("DONE", "EXIT") else now
+        run_time = int(max(end - job["start"], 0))
+
+    pend_time = int((job["start"] or now) - job["submit"])
+    return run_time, pend_time
+
+
+def _memory(value, short=False):
+    if value >= 1e9:
+        return f"{value / 1e9:.1f}G" if short else f"{value / 1e9:.1f} Gbytes"
+    return f"{value / 1e6:.0f}M" if short else f"{value / 1e6:.0f} Mbytes"
+
+
+def _field(job, field):
+    run_time, pend_time = _usage(job)
+    used = job["start"] is not None
+    values = {
+        "jobid": job["jobid"],
+        "jobindex": job["jobindex"],
+        "stat": job["stat"],
+        "job_name": job["name"],
+        "exit_code": job["exit_code"] or None,
+        "exit_reason": job["exit_reason"]
+        and f"{job['exit_reason']}: {_REASONS[job['exit_reason']]}",
+        "max_mem": _memory(job["mem"]) if used else None,
+        "run_time": f"{run_time} second(s)" if used else None,
+        "cpu_used": f"{run_time} second(s)" if used else None,
+        "pend_time": pend_time,
+    }
+    value = values.get(field)
+    return "-" if value is None else str(value)
+
+
+def bjobs(db, args):
+    """Show jobs in the default, `-o` or `-l` formats."""
+    fields, delimiter, group = ["jobid", "stat", "job_name"], " ", None
+    header, long, every, running, ids = True, False, False, False, []
+    args = list(args)
+
+    while args:
+        arg = args.pop(0)
+
+        if arg == "-o":
+            spec = args.pop(0)
+            match = re.search(r"delimiter='(.*)'", spec)
+            delimiter = match.group(1) if match else " "
+            fields = re.sub(r"delimiter='.*'", "", spec).split()
+        elif arg == "-g":
+            group = args.pop(0)
+        elif arg == "-noheader":
+            header = False
+        elif arg == "-l":
+            long = True
+        elif arg == "-a":
+            every = True
+        elif arg == "-r":
+            running = True
+        elif arg in ("-json", "-u", "-q"):
+            print(f"bjobs: unsupported option {arg}", file=sys.stderr)
+            return 255
+        else:
+            ids.append(arg)
+
+    jobs = _select(db, ids, group, finished=every, clean=True)
+    _not_found(ids, jobs)
+
+    if running:
+        jobs = [i for i in jobs if i["stat"] == "RUN"]
+
+    if not jobs and not ids:
+        print("No unfinished job found", file=sys.stderr)
+
+        if not every and not long:
+            return int(os.getenv("FAKE_LSF_EMPTY_EXIT", "0"))
+
+    if long:
+        print("\n".join(_long(job, "bjobs") for job in jobs))
+        return 0
+
+    if header and jobs:
+        print(delimiter.join(i.upper() for i in fields))
+
+    for job in jobs:
+        print(delimiter.join(_field(job, i) for i in fields))
+
+    return 255 if ids and not jobs else 0
+
+
+def _not_found(ids, jobs):
+    found = {str(i["jobid"]) for i in jobs} | {_lsf_id(i) for i in jobs}
+
+    for i in ids:
+        if i not in found:
+            print(f"Job <{i}> is not found", file=sys.stderr)
+
+
+def _time(value):
+    return time.strftime("%a %b %d %H:%M:%S", time.localtime(value))
+
+
+def _long(job, command):
+    """Format a job like `bjobs -l`, `bacct -l` or `bhist -l`."""
+    run_time, pend_time = _usage(job)
+    lines = [
+        "",
+        f"Job <{_lsf_id(job)}>, Job Name <{job['name']}>, User <{os.getenv('USER', 'toil')}>, "
+        f"Status <{job['stat']}>, Queue <normal>, Command <{job['command']}>",
+        f"{_time(job['submit'])}: Submitted from host <localhost>, CWD <{os.getcwd()}>;",
+    ]
+
+    if job["start"]:
+        lines.append(
+            f"{_time(job['start'])}: Dispatched 1 Task(s) on Host(s) <localhost>, "
+            f"Allocated {job['slots']} Slot(s) on Host(s) <localhost>;"
+        )
+
+    if job["stat"] == "DONE":
+        lines.append(f"{_time(job['end'])}: Done successfully.")
+        lines.append(f"{_time(job['end'])}: Completed <done>.")
+
+    elif job["stat"] == "EXIT":
+        lines.append(f"{_time(job['end'])}: Exited with exit code {job['exit_code']}.")
+        reason = job["exit_reason"]
+        reason = f"; {reason}: {_REASONS[reason]}" if reason else ""
+        lines.append(f"{_time(job['end'])}: Completed <exit>{reason}.")
+
+    if command == "bacct":
+        turnaround = (run_time or 0) + pend_time
+        lines += [
+            "",
+            "Accounting information about this job:",
+            "     CPU_T     WAIT     TURNAROUND   STATUS     HOG_FACTOR    MEM    SWAP",
+            f"  {run_time or 0:8.2f} {pend_time:8d} {turnaround:14d} "
+            f"{job['stat'].lower():>8} {1:14.4f} {_memory(job['mem'], True):>6}"
+            "      0M",
+            "-" * 78,
+        ]
+
+    elif job["start"]:
+        lines += ["", "MEMORY USAGE:", f"MAX MEM: {_memory(job['mem'])};"]
+
+    if command == "bhist":
+        lines += [
+            "",
+            f"Summary of time in seconds spent in various states by  {_time(time.time())}",
+            "  PEND     PSUSP    RUN      USUSP    SSUSP    UNKWN    TOTAL",
+            f"  {pend_time:<8d} 0        {run_time or 0:<8d} 0        0        0"
+            f"        {pend_time + (run_time or 0)}",
+        ]
+
+    return "\n".join(lines)
+
+
+def bacct(db, args):
+    """Show the accounting of finished jobs, only `-l` is supported."""
+    ids = [i for i in args if not i.startswith("-")]
+    jobs = [i for i in _select(db, ids, finished=True) if i["end"]]
+
+    if not jobs:
+        print("No matching job found", file=sys.stderr)
+        return 0
+
+    print("\n".join(_long(job, "bacct") for job in jobs))
+    return 0
+
+
+def bhist(db, args):
+    """Show the history of jobs, only `-l` is supported."""
+    args = list(args)
+
+    if "-n" in args:
+        del args[args.index("-n") : args.index("-n") + 2]
+
+    ids = [i for i in args if not i.startswith("-")]
+    jobs = _select(db, ids, finished=True)
+
+    if not jobs:
+        print("No matching job found", file=sys.stderr)
+        return 0
+
+    print("\n".join(_long(job, "bhist") for job in jobs))
+    return 0
+
+
+def bkill(db, args):
+    """Kill jobs by ID, or all jobs of a group with `-g <group> 0`."""
+    group = args[args.index("-g") + 1] if "-g" in args else None
+    ids = [i for i in args if not i.startswith("-") and i not in (group, "0")]
+    jobs = _select(db, ids, group)
+    now = time.time()
+    db.execute("BEGIN IMMEDIATE")
+
+    for job in jobs:
+        if job["stat"] in ("DONE", "EXIT"):
+            print(f"Job <{_lsf_id(job)}>: Job has already finished", file=sys.stderr)
+            continue
+
+        _signal(job["pid"])
+        where, params = _where(job)
+        db.execute(
+            "UPDATE jobs SET stat = 'EXIT', exit_code = 130, "
+            "exit_reason = 'TERM_OWNER', end = ? " + where,
+            [now] + params,
+        )
+        print(f"Job <{_lsf_id(job)}> is being terminated")
+
+    db.execute("COMMIT")
+    _not_found(ids, jobs)
+    return 0
+
+
+def bmod(db, args):
+    """Change the run limit of a job with `-W <minutes> <jobid>`."""
+    if len(args) != 3 or args[0] != "-W":
+        print(f"bmod: unsupported arguments {args}", file=sys.stderr)
+        return 255
+
+    jobs = _select(db, [args[2]])
+
+    if not jobs:
+        _not_found([args[2]], jobs)
+        return 255
+
+    run_limit = parse_runtime(args[1])
+    db.execute("BEGIN IMMEDIATE")
+
+    for job in jobs:
+        where, params = _where(job)
+        end = job["end"]
+
+        if job["stat"] == "RUN":
+            end = job["start"] + min(job["duration"], run_limit)
+
+        db.execute(
+            f"UPDATE jobs SET run_limit = ?, end = ? {where}",
+            [run_limit, end] + params,
+        )
+
+    db.execute("COMMIT")
+    print(f"Parameters of job <{args[2]}> are being changed")
+    return 0
+
+
+def brequeue(db, args):
+    """Requeue a job as pending, except UNKWN or ZOMBI jobs."""
+    jobs = _select(db, args[-1:])
+
+    if not jobs:
+        _not_found(args[-1:], jobs)
+        return 255
+
+    db.execute("BEGIN IMMEDIATE")
+
+    for job in jobs:
+        if job["stat"] in ("UNKWN", "ZOMBI"):
+            db.execute("ROLLBACK")
+            print(f"Job <{args[-1]}>: Job has unknown status", file=sys.stderr)
+            return 255
+
+        where, params = _where(job)
+        db.execute(
+            "UPDATE jobs SET stat = 'PEND', command = ?, start = NULL, end = NULL, "
+            "exit_code = NULL, exit_reason = NULL, pid = NULL " + where,
+            [_STUCK.sub("", job["command"] or "")] + params,
+        )
+
+    db.execute("COMMIT")
+    print(f"Job <{args[-1]}> is being requeued")
+    return 0
+
+
+def bgdel(db, args):
+    """Delete a job group."""
+    print(f"Job group {args[-1]} is deleted.")
+    return 0
+
+
+def bparams(db, args):
+    """Show the cluster parameters used by the batch system."""
+    print(f"RESOURCE_RESERVE_PER_TASK = {os.getenv('FAKE_LSF_PER_CORE', 'N')}")
+    return 0
+
+
+def bqueues(db, args):
+    """Show the job slots of the queues in `bqueues -w` format."""
+    queues = {}
+
+    for entry in filter(None, os.getenv("FAKE_LSF_QUEUES", "normal").split(",")):
+        name, maximum, pend, run = (entry.split(":") + ["", "", ""])[:4]
+        queues[name] = [maximum or "-", int(pend or 0), int(run or 0)]
+
+    for queue, stat, slots in db.execute(
+        "SELECT queue, stat, TOTAL(slots) FROM jobs "
+        "WHERE stat IN ('PEND', 'RUN') GROUP BY queue, stat"
+    ):
+        load = queues.setdefault(queue, ["-", 0, 0])
+        load[1 if stat == "PEND" else 2] += int(slots)
+
+    names = [i for i in args if not i.startswith("-")] or list(queues)
+    print(
+        "QUEUE_NAME      PRIO STATUS          MAX JL/U JL/P JL/H "
+        "NJOBS  PEND   RUN  SUSP"
+    )
+
+    for name in names:
+        if name not in queues:
+            print(f"{name}: No such queue", file=sys.stderr)
+            return 255
+
+        maximum, pend, run = queues[name]
+        print(
+            f"{name:<15} 30  Open:Active {maximum:>7}    -    -    - "
+            f"{pend + run:>5} {pend:>5} {run:>5}     0"
+        )
+
+    return 0
+
+
+def main(argv=None):
+    """Run a fake LSF command, e.g. `main(["bjobs", "-a"])`."""
+    argv = sys.argv[1:] if argv is None else argv
+    command = globals()[argv[0]]
+    db = connect()
+
+    try:
+        db.execute("INSERT INTO calls VALUES (?)", [argv[0]])
+
+        if argv[0] != "bsub":
+            schedule(db)
+        return command(db, argv[1:])
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
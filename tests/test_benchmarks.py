@@ -0,0 +1,180 @@
+"""toil_container benchmarks, run with TOIL_CONTAINER_BENCHMARK=1 pytest -s."""
+
+import base64
+import json
+import os
+import re
+import statistics
+import time
+import timeit
+import tracemalloc
+
+import pytest
+from toil.job import JobDescription
+
+from toil_container import lsf_helper
+from toil_container import lsf_output
+
+from . import lsf_simulator
+from .test_lsf import get_worker
+from .test_lsf import run_fake_lsf_worker
+from .utils import SKIP_BENCHMARK
+from .utils import install_fake_lsf
+from .utils import read_lsf_data
+
+
+def report(name, seconds, number):
+    """Print the cost per operation of a benchmark."""
+    print(f"\n{name}: {seconds / number * 1e6:.2f} us per op ({number} ops)")
+
+
+def _renumber(output, copies):
+    """Replicate a fixture `copies` times with unique job IDs of equal length."""
+    chunks = []
+
+    # a fixed width prefix without leading zeros, so that no ID is a prefix
+    # of another or parses to the same number
+    for i in range(copies):
+        chunks.append(re.sub(r"\b48100(\d\d)\b", rf"{10 ** 5 + i}\1", output))
+
+    return "\n".join(chunks)
+
+
+@SKIP_BENCHMARK
+def test_benchmark_status_parsers():
+    bjobs = _renumber(read_lsf_data("bjobs_delimited.txt"), 1000)
+    bacct = _renumber(read_lsf_data("bacct_l_multi.txt"), 1000)
+    bhist = _renumber(read_lsf_data("bhist_l_done.txt"), 1000)
+
+    for name, parser, output, expected in [
+        ("bjobs -o", lsf_output.parse_bjobs_output, bjobs, 8000),
+        ("bacct -l", lsf_output.parse_long_output, bacct, 2000),
+        ("bhist -l", lsf_output.parse_long_output, bhist, 1000),
+    ]:
+        assert len(parser(output)) == expected
+        report(
+            f"parse {name} per job",
+            timeit.timeit(lambda: parser(output), number=5),
+            expected * 5,
+        )
+
+
+@SKIP_BENCHMARK
+def test_benchmark_job_bookkeeping_memory():
+    requirements = {
+        "cores": 1,
+        "memory": 10**9,
+        "disk": 10**9,
+        "preemptable": False,
+    }
+    unitName = lsf_helper.encode_dict({"runtime": 60})
+
+    for name, build in [
+        (
+            "JobDescription",
+            lambda i: JobDescription(
+                requirements=requirements, jobName=f"job{i}", unitName=unitName
+            ),
+        ),
+        ("LSFJob", lambda i: lsf_helper.LSFJob(1, 10**9, 60, f"job{i}", "echo")),
+    ]:
+        tracemalloc.start()
+        jobs = [build(i) for i in range(100000)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert len(jobs) == 100000
+        print(f"\n{name}: {size / len(jobs):.0f} bytes per job")
+
+
+@SKIP_BENCHMARK
+def test_benchmark_decode_resources():
+    number = 100000
+    kinds = [{"runtime": 10 * i, "queue": f"queue{i % 3}"} for i in range(1, 21)]
+    compact = [
+        f"job {i}" + lsf_helper.encode_dict(kinds[i % 20]) for i in range(number)
+    ]
+    legacy = [
+        f"job {i}"
+        + lsf_helper._RESOURCES_START_TAG
+        + base64.b64encode(json.dumps(kinds[i % 20]).encode()).decode()
+        + lsf_helper._RESOURCES_CLOSE_TAG
+        for i in range(number)
+    ]
+
+    def uncached(unitName):
+        lsf_helper._decode_spec.cache_clear()
+        return lsf_helper.decode_resources(unitName)
+
+    for name, decode, unitNames in [
+        ("decode_dict base64 json", lsf_helper.decode_dict, legacy),
+        ("decode_dict compact", lsf_helper.decode_dict, compact),
+        ("decode_resources uncached", uncached, compact),
+        ("decode_resources cached", lsf_helper.decode_resources, compact),
+    ]:
+        report(
+            f"{name} per submission",
+            timeit.timeit(lambda: [decode(i) for i in unitNames], number=1),
+            number,
+        )
+
+
+@SKIP_BENCHMARK
+@pytest.mark.parametrize("mode", ["array", "pack", "single"])
+def test_benchmark_fake_lsf_scaling(tmpdir, monkeypatch, mode):
+    # e.g. TOIL_CONTAINER_BENCHMARK_JOBS=1000,10000,50000
+    sizes = os.getenv("TOIL_CONTAINER_BENCHMARK_JOBS", "1000").split(",")
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "SUBMIT_MODE", mode)
+    monkeypatch.setattr(lsf_helper, "FLUSH_INTERVAL", 0)
+
+    for size in map(int, sizes):
+        workdir = tmpdir.mkdir(f"{mode}_{size}")
+        install_fake_lsf(workdir, monkeypatch, slots=size)
+        worker = get_worker(workdir)
+        worker.boss.config.maxLocalJobs = size
+        newJobs = [(i, 1, 1e9, f"echo {i}", "job", None) for i in range(size)]
+        polls = []
+        check_on_jobs = worker.checkOnJobs
+
+        def timed_check_on_jobs():
+            started = time.perf_counter()
+            result = check_on_jobs()
+            polls.append(time.perf_counter() - started)
+            return result
+
+        worker.checkOnJobs = timed_check_on_jobs
+        started = time.perf_counter()
+        statuses = run_fake_lsf_worker(worker, newJobs)
+        seconds = time.perf_counter() - started - sum(polls)
+
+        assert len(statuses) == size and not any(statuses.values())
+        print(
+            f"\n{mode} {size} jobs: {size / seconds:.0f} submissions/s, "
+            f"{statistics.median(polls) * 1e3:.0f} ms median poll, "
+            f"{max(polls) * 1e3:.0f} ms max poll, "
+            f"subprocesses {lsf_simulator.call_counts()}"
+        )
+
+
+@SKIP_BENCHMARK
+def test_benchmark_build_bsub_line(tmpdir, monkeypatch):
+    # per_core_reservation calls bparams when TOIL_CONTAINER_LSF_PER_CORE is unset
+    install_fake_lsf(tmpdir, monkeypatch)
+    monkeypatch.delenv("TOIL_CONTAINER_LSF_PER_CORE", raising=False)
+    monkeypatch.setenv("TOIL_LSF_ARGS", "-q general")
+    settings = lsf_helper.get_lsf_settings()
+    number = 100
+
+    def uncached(i):
+        lsf_helper._bsub_resources.cache_clear()
+        lsf_helper.build_bsub_line(1, 1e9, 60, f"job {i}")
+
+    def cached(i):
+        lsf_helper.build_bsub_line(1, 1e9, 60, f"job {i}", settings=settings)
+
+    for name, build in [("per call settings", uncached), ("cached", cached)]:
+        report(
+            f"build_bsub_line with {name}",
+            timeit.timeit(lambda: [build(i) for i in range(number)], number=1),
+            number,
+        )
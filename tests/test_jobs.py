@@ -42,6 +42,13 @@ def test_resources_are_encoded():
     assert lsf_helper._RESOURCES_START_TAG in job.description.unitName
     assert lsf_helper._RESOURCES_CLOSE_TAG in job.description.unitName
 
+    job = jobs.ContainerJob(options, 5, queue="short", exclusive=True)
+    spec = lsf_helper.decode_resources(job.description.unitName)
+    assert spec == lsf_helper.ResourceSpec(5, "short", None, True)
+
+    with pytest.raises(exceptions.ValidationError):
+        jobs.ContainerJob(options, runtime=-1)
+
 
 def assert_image_call(image_attribute, image, tmpdir):
     """Get options namespace."""
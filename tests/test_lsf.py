@@ -1,16 +1,31 @@
 """toil_container jobs tests."""
 
+from queue import Queue
+from types import SimpleNamespace
+import datetime
 import os
 import subprocess
+import threading
 import time
 
+import pytest
 from toil.batchSystems.lsfHelper import per_core_reservation
+from toil.job import JobDescription
 
+from toil_container import exceptions
 from toil_container import parsers
 from toil_container import jobs
+from toil_container import lsf
+from toil_container import lsf_executor
 from toil_container import lsf_helper
+from toil_container import lsf_monitor
+from toil_container import lsf_output
+from toil_container import lsf_queues
+from toil_container import lsf_retry
 
+from . import lsf_simulator
 from .utils import SKIP_LSF
+from .utils import install_fake_lsf
 
 
 TEST_QUEUE = "general"
@@ -21,16 +36,733 @@ class testJobRuntimeRetry(jobs.ContainerJob):
         time.sleep(70)
 
 
-def test_with_retries(tmpdir):
-    test_path = tmpdir.join("test")
+class FakeLSF:
+
+    """Replace `subprocess.run` with canned LSF outputs, recording the calls."""
+
+    def __init__(self, monkeypatch, outputs):
+        self.outputs = outputs
+        self.calls = []
+        monkeypatch.setattr(lsf.subprocess, "run", self)
+
+    def __call__(self, command, **kwargs):
+        self.calls.append(command)
+        joined = " ".join(command)
+        keys = [i for i in self.outputs if joined.startswith(i)]
+        stdout = self.outputs[max(keys, key=len)] if keys else ""
+        return SimpleNamespace(stdout=stdout, stderr="", returncode=0)
+
+
+BJOBS_STATUS = "bjobs -noheader -o jobid jobindex stat"
+BJOBS_NOT_FINISHED = "bjobs -noheader -o jobid jobindex -g"
+
+
+def get_worker(tmpdir=None):
+    """Get a custom LSF worker attached to a minimal boss."""
+    boss = SimpleNamespace(
+        config=SimpleNamespace(
+            statePollingWait=0,
+            maxLocalJobs=1000,
+            workDir=tmpdir and tmpdir.strpath,
+            workflowID="test",
+        ),
+        getWaitDuration=lambda: 0,
+        sleepSeconds=lambda: 0,
+        formatStdOutErrPath=lambda *args: os.devnull,
+        with_retries=lsf_retry.with_retries,
+        Id2Node={},
+        jobGroup="/toil/test",
+        history=None,
+        lifecycle=None,
+        trace=None,
+        replay=None,
+        environment={},
+        settings=None,
+    )
+    args = [Queue() for _ in range(4)] + [boss]
+    return lsf.CustomLSFBatchSystem.Worker(*args)
+
+
+def run_fake_lsf_worker(worker, newJobs):
+    """Submit `newJobs` and poll the fake LSF until they are all finished."""
+    worker._poller = lsf_helper.AdaptivePoller(0, floor=0, ceiling=0)
+
+    for jobID, cpu, memory, command, jobName, _ in newJobs:
+        worker.boss.Id2Node[jobID] = lsf_helper.LSFJob(
+            cpu, memory, None, jobName, command
+        )
+
+    for newJob in newJobs:
+        worker.createJobs(newJob)
+
+    while worker.waitingJobs:
+        worker.createJobs(None)
+
+    while worker.runningJobs:
+        worker.checkOnJobs()
+
+    updated = []
+
+    while not worker.updatedJobsQueue.empty():
+        updated.append(worker.updatedJobsQueue.get())
+
+    return {i.jobID: i.exitStatus for i in updated}
+
+
+@pytest.mark.parametrize("mode", ["single", "array", "pack"])
+def test_fake_lsf_worker(tmpdir, monkeypatch, mode):
+    install_fake_lsf(tmpdir, monkeypatch, slots=2)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "SUBMIT_MODE", mode)
+    monkeypatch.setattr(lsf_helper, "FLUSH_INTERVAL", 0)
+    worker = get_worker(tmpdir)
+    newJobs = [(i, 1, 1e9, "echo", "job", None) for i in range(1, 4)]
+    newJobs.append((4, 1, 1e9, "echo FAKE_LSF_MEM=1.2e9", "big", None))
+
+    # the job over its memory limit is retried with 1.5 times its usage
+    assert run_fake_lsf_worker(worker, newJobs) == {1: 0, 2: 0, 3: 0, 4: 0}
+    assert not worker.boss.Id2Node
+    db = lsf_simulator.connect()
+    assert db.execute("SELECT MAX(mem_limit) FROM jobs").fetchone()[0] == 1.8e9
+    assert lsf_simulator.call_counts()["bjobs"] >= 2
+
+
+def test_fake_lsf_limits(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch, slots=1)
+    lsf_simulator.main(["bsub", "-W", "1", "FAKE_LSF_TIME=90"])
+    lsf_simulator.main(["bsub", "-M", "1GB", "FAKE_LSF_MEM=2e9 FAKE_LSF_TIME=10"])
+    db = lsf_simulator.connect()
+    assert [i["stat"] for i in lsf_simulator._select(db)] == ["RUN", "PEND"]
+
+    # jobs are scheduled on a single slot, one after the other
+    lsf_simulator.schedule(db, time.time() + 100)
+    assert [i["stat"] for i in lsf_simulator._select(db)] == ["RUN"]
+    lsf_simulator.schedule(db, time.time() + 200)
+    records = lsf_output.parse_bjobs_output(
+        subprocess.check_output(
+            ["bjobs", "-noheader", "-o", lsf_output.BJOBS_FORMAT, "1", "2"],
+            encoding="utf-8",
+        )
+    )
+    assert records["1"].exit_reason == "TERM_RUNLIMIT"
+    assert records["2"].exit_reason == "TERM_MEMLIMIT"
+    assert records["2"].max_mem == 2e9
+
+    bacct = subprocess.check_output(["bacct", "-l", "1"], encoding="utf-8")
+    assert lsf_output.parse_long_output(bacct)["1"].run_time == 60
+
+
+def test_fake_lsf_run_limit_extension(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "EXTEND_INTERVAL", 0)
+    monkeypatch.setattr(lsf_helper, "EXTEND_AT", 0.8)
+    worker = get_worker(tmpdir)
+    worker._poller = lsf_helper.AdaptivePoller(0, floor=0, ceiling=0)
+    jobNode = lsf_helper.LSFJob(1, 1e9, 1, "job", "echo FAKE_LSF_TIME=150")
+    worker.boss.Id2Node[1] = jobNode
+    worker.createJobs((1, 1, 1e9, jobNode.command, "job", None))
+    db = lsf_simulator.connect()
+
+    def run_for(seconds):
+        db.execute("UPDATE jobs SET start = start - ?, end = end - ?", [seconds] * 2)
+        db.commit()
+        worker.checkOnJobs()
+
+    # the job is extended past 80% of its limit, to 1.5 times its run time
+    run_for(0)
+    assert jobNode.runtime == 1
+    run_for(55)
+    assert jobNode.runtime == 2
+    run_for(45)
+    assert jobNode.runtime == 3
+    run_for(60)
+
+    assert not worker.runningJobs
+    assert worker.updatedJobsQueue.get().exitStatus == 0
+    assert worker.metrics["extensions"] == 2
+    assert tuple(db.execute("SELECT run_limit, stat FROM jobs").fetchone()) == (
+        180,
+        "DONE",
+    )
+    assert lsf_simulator.call_counts()["bsub"] == 1
+
+
+def test_extend_run_limit_failure(monkeypatch):
+    monkeypatch.setattr(lsf_helper, "EXTEND_INTERVAL", 0)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "EXTEND_AT", 0.8)
+    worker = get_worker()
+    worker.boss.Id2Node[1] = jobNode = lsf_helper.LSFJob(1, 1e9, 10, "job", "echo")
+    worker.batchJobIDs[1] = (7, None)
+    worker.runningJobs.add(1)
+    calls = []
+
+    def call_lsf(command, **kwargs):
+        calls.append(command[0])
+
+        if command[0] == "bmod":
+            raise subprocess.CalledProcessError(255, command, "", "not allowed")
+
+        return "7||RUN|-|-|-|590 second(s)|-\n"
+
+    monkeypatch.setattr(worker, "_callLSF", call_lsf)
+
+    # a denied extension counts against the budget and keeps the limit
+    for _ in range(3):
+        worker._extendRunLimits()
+
+    assert jobNode.runtime == 10
+    assert jobNode.runtime_extensions == lsf_helper.EXTEND_STEPS
+    assert worker.metrics["extension_failures"] == lsf_helper.EXTEND_STEPS
+    assert calls.count("bmod") == lsf_helper.EXTEND_STEPS
+
+
+def test_fake_lsf_stuck_jobs(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "STUCK_POLICY", "requeue")
+    monkeypatch.setattr(lsf_helper, "STUCK_AFTER", 0)
+    monkeypatch.setattr(lsf_helper, "STUCK_INTERVAL", 0)
+    worker = get_worker(tmpdir)
+    worker._poller = lsf_helper.AdaptivePoller(0, floor=0, ceiling=0)
+
+    for jobID, state in [(1, "UNKWN"), (2, "SSUSP")]:
+        command = f"echo FAKE_LSF_STAT={state}"
+        worker.boss.Id2Node[jobID] = lsf_helper.LSFJob(1, 1e9, None, "job", command)
+        worker.createJobs((jobID, 1, 1e9, command, "job", None))
+
+    # stuck jobs are detected first, then reclaimed if still stuck
+    worker.checkOnJobs()
+    assert worker.metrics["stuck_detected"] == 2
+    assert (
+        worker._processRecord(
+            lsf_output.LSFJobRecord("1", "UNKWN", None, None, None, None, None), 1, ""
+        )
+        is None
+    )
+
+    # the UNKWN job can't be requeued, so it's killed and resubmitted
+    worker.boss.Id2Node[1].command = "echo"
+    worker.checkOnJobs()
+    assert worker.metrics["stuck_requeued"] == 1
+    assert worker.metrics["stuck_requeue_failures"] == 1
+    assert worker.metrics["stuck_resubmitted"] == 1
+
+    while worker.runningJobs:
+        worker.checkOnJobs()
+
+    assert {worker.updatedJobsQueue.get().exitStatus for _ in range(2)} == {0}
+    db = lsf_simulator.connect()
+    assert [tuple(i) for i in db.execute("SELECT jobid, stat FROM jobs")] == [
+        (1, "EXIT"),
+        (2, "DONE"),
+        (3, "DONE"),
+    ]
+
+
+def test_stuck_job_fails_after_retries(monkeypatch):
+    monkeypatch.setattr(lsf_helper, "STUCK_AFTER", 0)
+    monkeypatch.setattr(lsf_helper, "STUCK_INTERVAL", 0)
+    monkeypatch.setattr(lsf_helper, "STUCK_RETRIES", 0)
+    worker = get_worker()
+    worker.boss.Id2Node[1] = lsf_helper.LSFJob(1, 1e9, None, "job", "echo")
+    worker.batchJobIDs[1] = (7, None)
+    worker.runningJobs.add(1)
+    calls = []
+
+    def call_lsf(command, **kwargs):
+        calls.append(command)
+        return "7|0|ZOMBI|-|-|-|-|-\n"
+
+    monkeypatch.setattr(worker, "_callLSF", call_lsf)
+
+    # jobs are only detected without a policy
+    monkeypatch.setattr(lsf_helper, "STUCK_POLICY", "none")
+    assert worker._reclaimStuckJobs() == {}
+    assert worker._reclaimStuckJobs() == {}
+    assert worker.metrics["stuck_detected"] == 1
+
+    monkeypatch.setattr(lsf_helper, "STUCK_POLICY", "resubmit")
+    assert worker._reclaimStuckJobs() == {1: 1}
+    assert calls[-1] == ["bkill", "-r", "7"]
+    assert worker.metrics["stuck_failed"] == 1
+
+
+def test_get_job_statuses_in_bulk(monkeypatch):
+    worker = get_worker()
+    fake = FakeLSF(
+        monkeypatch,
+        {
+            BJOBS_STATUS: "1|0|DONE|-|-|-|-|-\n2|0|EXIT|2|-|-|-|-\n"
+            "3|0|RUN|-|-|-|-|-\n",
+            "bacct -l": "Job <4>, User <me>\n    Completed <done>.\n"
+            "Job <5>, User <me>\n    Completed <exit>.\n",
+        },
+    )
+    statuses = worker._getJobStatuses({str(i): i * 10 for i in range(1, 7)})
+
+    assert statuses == {10: 0, 20: 1, 30: None, 40: 0, 50: 1, 60: None}
+    assert [i[:2] for i in fake.calls] == [
+        ["bjobs", "-noheader"],
+        ["bacct", "-l"],
+        ["bhist", "-l"],
+        ["bhist", "-l"],
+    ]
+    assert fake.calls[1][2:] == ["4", "5", "6"]
+    assert fake.calls[2][4:] == ["6"]
+    assert worker.metrics["subprocesses"] == 4
+
+
+def test_fake_lsf_no_unfinished_jobs(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch, empty_exit=255)
+    worker = get_worker(tmpdir)
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        subprocess.run(["bjobs"], capture_output=True, check=True, text=True)
+    assert "No unfinished job found" in error.value.stderr
+
+    assert worker._getNotFinishedIDs() == set()
+
+
+def test_running_jobs_and_kills_go_through_call_lsf(monkeypatch):
+    worker = get_worker()
+    fake = FakeLSF(
+        monkeypatch,
+        {"bjobs -r": "7|0|RUN|-|-|-|90 second(s)|-\n8|0|RUN|-|-|-|-|-\n"},
+    )
 
-    def _test():
-        if not os.path.isfile(test_path.strpath):
-            test_path.write("hello")
-            subprocess.check_call(["rm", "/florentino-ariza-volume"])
-        return
+    for jobID, lsfID in [(1, 7), (2, 9)]:
+        worker.batchJobIDs[jobID] = (lsfID, None)
+        worker.runningJobs.add(jobID)
 
-    lsf_helper.with_retries(_test)
+    assert worker.getRunningJobIDs() == {1: datetime.timedelta(seconds=90)}
+    assert fake.calls[-1][:2] == ["bjobs", "-r"]
+
+    worker.killJob(1)
+    assert fake.calls[-1] == ["bkill", "7"]
+
+
+def test_get_job_statuses_chunks_queries(monkeypatch):
+    worker = get_worker()
+    monkeypatch.setattr(lsf, "STATUS_QUERY_CHUNK", 2)
+    fake = FakeLSF(
+        monkeypatch, {BJOBS_STATUS: "1|0|DONE|-|-|-|-|-\n2|0|DONE|-|-|-|-|-\n"}
+    )
+    statuses = worker._getJobStatuses({"1": 1, "2": 2, "3": 3})
+
+    assert statuses == {1: 0, 2: 0, 3: None}
+    assert len(fake.calls) == 2 + 3
+
+
+def test_not_finished_ids_scoped_to_job_group(monkeypatch):
+    worker = get_worker()
+    fake = FakeLSF(monkeypatch, {BJOBS_NOT_FINISHED: "1 0\n2 0\n3 1\n3 2\n"})
+
+    assert worker._getNotFinishedIDs() == {"1", "2", "3[1]", "3[2]"}
+    assert fake.calls == [
+        ["bjobs", "-noheader", "-o", "jobid jobindex", "-g", "/toil/test"]
+    ]
+
+
+def test_kill_jobs_in_bulk(monkeypatch):
+    worker = get_worker()
+    monkeypatch.setattr(lsf, "STATUS_QUERY_CHUNK", 2)
+    fake = FakeLSF(monkeypatch, {BJOBS_NOT_FINISHED: "104 0\n"})
+
+    for jobID in range(1, 5):
+        worker.boss.Id2Node[jobID] = lsf_helper.LSFJob(1, 1e9, None, "job", "echo")
+        worker._addBatchJobIDs([jobID], 100 + jobID)
+
+    worker.waitingJobs.append((5, 1, 1e9, "echo", "job", None))
+
+    for jobID in (1, 2, 3, 5):
+        worker.killQueue.put(jobID)
+
+    # one bkill per chunk of jobs and one bjobs to confirm the kills
+    assert worker.killJobs()
+    assert {worker.killedJobsQueue.get() for _ in range(4)} == {1, 2, 3, 5}
+    assert worker.runningJobs == {4}
+    assert list(worker.boss.Id2Node) == [4]
+    assert not worker.waitingJobs
+    assert fake.calls[:2] == [["bkill", "101", "102"], ["bkill", "103"]]
+    assert fake.calls[2][:2] == ["bjobs", "-noheader"]
+    assert len(fake.calls) == 3
+
+
+def test_kill_jobs_confirmed_after_bkill(monkeypatch):
+    worker = get_worker()
+    fake = FakeLSF(monkeypatch, {BJOBS_NOT_FINISHED: "101 0\n"})
+    worker.boss.Id2Node[1] = lsf_helper.LSFJob(1, 1e9, None, "job", "echo")
+    worker._addBatchJobIDs([1], 101)
+    worker.killQueue.put(1)
+
+    # bkill is asynchronous, the job is still listed on the first round
+    worker.boss.sleepSeconds = lambda: fake.outputs.clear() or 0
+    assert worker.killJobs()
+    assert worker.killedJobsQueue.get(block=False) == 1
+    assert not worker.runningJobs
+    assert [i[0] for i in fake.calls] == ["bkill", "bjobs", "bjobs"]
+
+
+def test_fake_lsf_kill_jobs(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    worker = get_worker(tmpdir)
+
+    for jobID in range(1, 4):
+        worker.boss.Id2Node[jobID] = lsf_helper.LSFJob(1, 1e9, None, "job", "echo")
+        worker.createJobs((jobID, 1, 1e9, "echo FAKE_LSF_TIME=100", "job", None))
+
+    while worker.waitingJobs:
+        worker.createJobs(None)
+
+    calls = []
+    callLSF = worker._callLSF
+    monkeypatch.setattr(
+        worker,
+        "_callLSF",
+        lambda command, **kw: calls.append(command) or callLSF(command, **kw),
+    )
+
+    # a job is killed by ID, the rest with the workflow's job group
+    worker.killQueue.put(1)
+    assert worker.killJobs()
+    assert worker.killedJobsQueue.get() == 1
+    worker.killQueue.put(2)
+    worker.killQueue.put(3)
+    assert worker.killJobs()
+
+    assert not worker.runningJobs and not worker.boss.Id2Node
+    assert worker.killedJobsQueue.qsize() == 2
+    assert [i[1:] for i in calls if i[0] == "bkill"] == [
+        ["1"],
+        ["-g", "/toil/test", "0"],
+    ]
+    db = lsf_simulator.connect()
+    assert {i[0] for i in db.execute("SELECT stat FROM jobs")} == {"EXIT"}
+
+
+def test_array_submission(tmpdir, monkeypatch):
+    worker = get_worker(tmpdir)
+    submitted = []
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "SUBMIT_MODE", "array")
+    monkeypatch.setattr(lsf_helper, "FLUSH_INTERVAL", 0)
+    monkeypatch.setattr(worker, "submitJob", lambda i: submitted.append(i) or 77)
+
+    for i in range(3):
+        worker.waitingJobs.append((i, 1, 1e9, f"echo {i}", "job", None))
+    worker.createJobs((3, 2, 1e9, "echo 3", "job", None))
+
+    assert len(submitted) == 2
+    assert "'Toil Job 0 array'[1-3]" in submitted[0][0]
+    assert worker.getBatchSystemID(0) == "77[1]"
+    assert worker.getBatchSystemID(2) == "77[3]"
+    assert worker.getBatchSystemID(3) == "77"
+    assert worker.runningJobs == {0, 1, 2, 3}
+
+    path = submitted[0][0][-1].split()[-1][:-2]
+    assert open(path, encoding="utf-8").read() == "echo 0\necho 1\necho 2\n"
+
+    for i in range(3):
+        worker.forgetJob(i)
+    assert not os.path.exists(path)
+
+
+def test_get_job_group(monkeypatch):
+    assert lsf_helper.get_job_group("abc") == "/toil/abc"
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_JOB_GROUP", "N")
+    assert lsf_helper.get_job_group("abc") is None
+
+
+def test_pack_submission_retries(tmpdir, monkeypatch):
+    worker = get_worker(tmpdir)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "SUBMIT_MODE", "pack")
+    monkeypatch.setattr(lsf_helper, "BATCH_SIZE", 2)
+    breaker = lsf_retry.CircuitBreaker(threshold=100, cooldown=0)
+    policy = lsf_retry.RetryPolicy(attempts=3, base=0, cap=0, breaker=breaker)
+    worker.boss.with_retries = policy.call
+    results = [
+        ("", "LSF is down. Please wait ...\n", 255),
+        (
+            "Job <11> is submitted to queue <general>.\n",
+            "Bad resource requirement syntax. Job not submitted.\n",
+            255,
+        ),
+    ]
+    calls = []
+
+    def run(command, **kwargs):
+        calls.append(command)
+        stdout, stderr, returncode = results.pop(0)
+        return SimpleNamespace(stdout=stdout, stderr=stderr, returncode=returncode)
+
+    monkeypatch.setattr(lsf.subprocess, "run", run)
+
+    for i in range(2):
+        worker.createJobs((i, 1, 1e9, f"echo {i}", "job", None))
+
+    # the failed call is retried, the partially submitted pack is not
+    assert len(calls) == 2 and not results
+    assert worker.getBatchSystemID(0) == "11"
+    assert worker.getBatchSystemID(1).startswith("NOT_SUBMITTED")
+    assert not os.listdir(tmpdir.strpath)
+
+
+def test_pack_submission(tmpdir, monkeypatch):
+    worker = get_worker(tmpdir)
+    worker.boss.environment = {}
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "SUBMIT_MODE", "pack")
+    monkeypatch.setattr(lsf_helper, "BATCH_SIZE", 3)
+    packs = []
+
+    class FakeBsub(FakeLSF):
+        def __call__(self, command, **kwargs):
+            with open(command[-1], encoding="utf-8") as f:
+                packs.append(f.read().splitlines())
+            return super().__call__(command, **kwargs)
+
+    fake = FakeBsub(
+        monkeypatch,
+        {
+            "bsub -pack": "Job <11> is submitted to queue <general>.\n"
+            "Bad resource requirement syntax. Job not submitted.\n"
+            "Job <13> is submitted to queue <general>.\n"
+        },
+    )
+
+    for i in range(3):
+        worker.createJobs((i, 1, 1e9, f"echo {i}", "job", None))
+
+    assert len(fake.calls) == 1
+    assert packs[0][0].startswith("-cwd . -o /dev/null -e /dev/null -J 'Toil Job 0'")
+    assert "-R 'select[mem>1000MB]'" in packs[0][0]
+    assert packs[0][0].endswith("-M 1000MB -n 1 echo 0")
+    assert worker.getBatchSystemID(0) == "11"
+    assert worker.getBatchSystemID(1).startswith("NOT_SUBMITTED")
+    assert worker.getBatchSystemID(2) == "13"
+    assert worker._getJobStatuses({worker.getBatchSystemID(1): 1}) == {1: 1}
+    assert not os.listdir(tmpdir.strpath)
+
+
+def test_check_on_jobs_from_status_snapshot(monkeypatch):
+    worker = get_worker()
+    fake = FakeLSF(
+        monkeypatch,
+        {
+            "bjobs -a": "1|0|DONE|-|-|-|-|-\n2|0|RUN|-|-|-|-|-\n"
+            "3|0|EXIT|1|-|-|-|-\n",
+            BJOBS_STATUS: "4|0|DONE|-|-|-|-|-\n",
+        },
+    )
+
+    for i in range(1, 6):
+        worker.batchJobIDs[i] = (i, None)
+        worker.runningJobs.add(i)
+
+    monkeypatch.setattr(lsf_helper, "BACKGROUND_POLL", True)
+    worker._components.status_poller = lsf_monitor.StatusPoller(worker)
+    assert worker.checkOnJobs() is None
+
+    # jobs 4 and 5 were submitted before the snapshot, but aren't in it
+    worker._components.status_poller.poll()
+    worker.batchJobIDs[6] = (6, None)
+    worker.runningJobs.add(6)
+    assert worker.checkOnJobs()
+    assert fake.calls[0] == [
+        "bjobs",
+        "-a",
+        "-noheader",
+        "-o",
+        lsf_output.BJOBS_FORMAT,
+        "-g",
+        "/toil/test",
+    ]
+    assert worker.runningJobs == {2, 5, 6}
+    updated = [worker.updatedJobsQueue.get() for _ in range(3)]
+    assert {(i.jobID, i.exitStatus) for i in updated} == {(1, 0), (3, 1), (4, 0)}
+
+    # the same snapshot is only processed once
+    assert worker.checkOnJobs()
+    assert len(fake.calls) == 5
+
+
+def test_status_poller_never_spins():
+    worker = get_worker()
+    poller = lsf_monitor.StatusPoller(worker)
+    poller.poller = lsf_helper.AdaptivePoller(0, floor=0, ceiling=0)
+    timeouts = []
+
+    def wait(timeout):
+        timeouts.append(timeout)
+        return True
+
+    poller.stopped = SimpleNamespace(wait=wait)
+    poller.run()
+    assert timeouts == [0.1]
+
+
+def test_resource_retry_escalation(monkeypatch):
+    worker = get_worker()
+    submitted = []
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(worker, "submitJob", lambda i: submitted.append(i) or 9)
+    worker.boss.Id2Node[1] = lsf_helper.LSFJob(1, 4e9, 10, "job", "echo")
+    memlimit = lsf_output.LSFJobRecord("8", "EXIT", 1, "TERM_MEMLIMIT", 5e9, 1, 1)
+    runlimit = memlimit._replace(exit_reason="TERM_RUNLIMIT", run_time=601)
+
+    # memory escalates from the observed peak, up to MAX_MEMORY
+    assert worker._processRecord(memlimit, 1, "") is None
+    assert worker.batchJobIDs[1] == (9, None)
+    assert worker.boss.Id2Node[1].memory == 7.5e9
+    assert worker._processRecord(memlimit, 1, "") is None
+    assert worker.boss.Id2Node[1].memory == 7.5e9 * 1.5
+    assert worker._processRecord(memlimit, 1, "") is None
+    assert worker.boss.Id2Node[1].memory_retries == lsf_helper.RETRY_STEPS
+    assert worker._processRecord(memlimit, 1, "") == 1
+
+    # runtime escalates from the observed run time in minutes
+    assert worker._processRecord(runlimit, 1, "") is None
+    assert worker.boss.Id2Node[1].runtime == 16
+    assert worker.boss.Id2Node[1].runtime_retries == 1
+    assert len(submitted) == 4
+    assert " ".join(submitted[0][0]).endswith("-M 7500MB -n 1 -W 10 echo")
+    assert " ".join(submitted[3][0]).endswith("-n 1 -W 16 echo")
+
+    # a job is only retried for the limit that killed it
+    assert worker._customRetry(1, runlimit) == 1
+    assert len(submitted) == 4
+
+
+def test_escalate_resource():
+    assert lsf_helper.escalate_resource(4, 5, 100) == 7.5
+    assert lsf_helper.escalate_resource(4, None, 100) == 6
+    assert lsf_helper.escalate_resource(None, None, 100) == 100
+    assert lsf_helper.escalate_resource(80, 80, 100) == 100
+    assert lsf_helper.escalate_resource(100, 100, 100) is None
+
+
+def test_lsf_job_from_job_description():
+    jobDesc = JobDescription(
+        requirements={
+            "cores": 2,
+            "memory": 10**9,
+            "disk": 10**9,
+            "preemptable": False,
+        },
+        jobName="job",
+        unitName=lsf_helper.encode_dict({"runtime": 5}),
+        command="echo",
+    )
+    job = lsf_helper.LSFJob.from_job_description(jobDesc)
+
+    assert (job.cores, job.memory, job.runtime) == (2, 1e9, 5)
+    assert (job.jobName, job.command, job.memory_retries) == ("job", "echo", 0)
+    assert not hasattr(job, "__dict__")
+
+
+def test_issue_batch_job_maps_before_queueing():
+    boss = SimpleNamespace(
+        Id2Node={},
+        currentJobs=set(),
+        history=None,
+        lifecycle=None,
+        handleLocalJob=lambda jobDesc: None,
+        checkResourceRequest=lambda *args: None,
+        getNextJobID=lambda: 7,
+    )
+
+    def put(item):
+        assert boss.Id2Node[item[0]].runtime == 5
+
+    boss.newJobsQueue = SimpleNamespace(put=put)
+    jobDesc = JobDescription(
+        requirements={
+            "cores": 2,
+            "memory": 10**9,
+            "disk": 10**9,
+            "preemptable": False,
+        },
+        jobName="job",
+        unitName=lsf_helper.encode_dict({"runtime": 5}),
+        command="echo",
+    )
+
+    assert lsf.CustomLSFBatchSystem.issueBatchJob(boss, jobDesc) == 7
+    assert boss.currentJobs == {7}
+
+
+def test_adaptive_poller(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(lsf_helper.time, "monotonic", lambda: clock[0])
+    poller = lsf_helper.AdaptivePoller(60, floor=10, ceiling=100)
+
+    assert poller.due()
+    assert poller.update(finished=5, running=10, latency=1) == 30
+    assert not poller.due()
+    clock[0] += 30
+    assert poller.due()
+    assert poller.update(finished=5, running=10, latency=1) == 15
+    assert poller.update(finished=5, running=10, latency=1) == 10
+    assert poller.update(finished=0, running=10, latency=1) == 15
+    assert poller.update(finished=5, running=10, latency=9) == 30
+    assert poller.update(finished=0, running=10, latency=90) == 60
+    assert poller.update(finished=0, running=10, latency=90) == 100
+    assert lsf_helper.AdaptivePoller(1000, floor=10, ceiling=100).interval == 100
+
+    # polls can be up to four times more or less frequent than toil's wait
+    assert lsf_helper.AdaptivePoller(8).floor == 2
+    assert lsf_helper.AdaptivePoller(8).ceiling == 32
+    monkeypatch.setattr(lsf_helper, "POLL_FLOOR", 10)
+    assert lsf_helper.AdaptivePoller(2).interval == 10
+
+
+def test_concurrent_submission(monkeypatch):
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_executor, "SUBMIT_THREADS", 4)
+    monkeypatch.setattr(lsf_executor, "BACKPRESSURE_WAIT", 0)
+    worker = get_worker()
+    lock = threading.Lock()
+    active, peak, rejected = [0], [0], []
+
+    def submit(subLine):
+        jobID = int(subLine[0][-1].split()[-1])
+
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+
+        time.sleep(0.05)
+
+        with lock:
+            active[0] -= 1
+
+        if jobID == 3 and not rejected:
+            rejected.append(jobID)
+            error = "Pending job threshold reached. Retrying in 60 seconds..."
+            raise subprocess.CalledProcessError(255, subLine[0], "", error)
+
+        return 1000 + jobID
+
+    monkeypatch.setattr(worker, "submitJob", submit)
+
+    for jobID in range(1, 9):
+        worker.createJobs((jobID, 1, 1e9, f"echo {jobID}", "job", None))
+
+    while worker.waitingJobs or worker._components.submitter.inflight:
+        worker.createJobs(None)
+        time.sleep(0.01)
+
+    # the rejected job was resubmitted and every job kept its own LSF ID
+    assert worker.batchJobIDs == {i: (1000 + i, None) for i in range(1, 9)}
+    assert worker.runningJobs == set(range(1, 9))
+    assert 1 < peak[0] <= 4
+    assert worker._components.submitter.rejected == 1
+    assert worker.metrics["submit_rate"] > 0
+    worker._components.submitter.shutdown()
 
 
 def test_encode_decode_resources():
@@ -42,6 +774,57 @@ def test_encode_decode_resources():
     assert expected == obtained
 
 
+def test_encode_resource_spec():
+    resources = {"runtime": "90", "queue": "short", "host_type": "x86_64"}
+    encoded = lsf_helper.encode_dict(dict(resources, exclusive=True))
+    assert encoded == "__rsrcW90.qshort.Hx86_64.Xrsrc__"
+
+    spec = lsf_helper.decode_resources(f"job{encoded}")
+    assert spec == lsf_helper.ResourceSpec(90, "short", "x86_64", True)
+    assert lsf_helper.decode_resources(f"other{encoded}") is spec
+    assert lsf_helper.decode_resources("job") == lsf_helper.ResourceSpec()
+    assert lsf_helper.encode_dict({"runtime": None, "exclusive": False}) == ""
+
+    # resources encoded as base64 json by earlier versions are still decoded
+    legacy = "__rsrceyJydW50aW1lIjogNjB9rsrc__"
+    assert lsf_helper.decode_dict(legacy) == {"runtime": 60}
+    assert lsf_helper.decode_resources(legacy).runtime == 60
+
+    for invalid in [{"runtime": 0}, {"queue": "a b"}, {"memory": 1}]:
+        with pytest.raises(exceptions.ValidationError):
+            lsf_helper.encode_dict(invalid)
+
+
+def test_route_queue(monkeypatch):
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_QUEUES", "short:60:8, bigmem::512,long")
+    monkeypatch.setenv("TOIL_LSF_ARGS", "-q general -P project")
+    settings = lsf_helper.get_lsf_settings()
+    queues = settings.queues
+    assert queues[:2] == (("short", 60, 8e9), ("bigmem", None, 512e9))
+
+    assert lsf_queues.route_queue(30, 1e9, queues) == "short"
+    assert lsf_queues.route_queue(None, 1e9, queues) == "bigmem"
+    assert lsf_queues.route_queue(90, 600e9, queues) == "long"
+    assert lsf_queues.route_queue(90, 1e9, queues[:1]) is None
+
+    def bsub(**kwargs):
+        line = lsf_helper.build_bsub_line(
+            1, 1e9, 30, "job", settings=settings, **kwargs
+        )
+        return " ".join(line[line.index("-M") :])
+
+    # the routed or requested queue replaces the one in TOIL_LSF_ARGS
+    assert bsub() == "-M 1000MB -n 1 -W 30 -q short -P project"
+    spec = lsf_helper.ResourceSpec(queue="other", host_type="x86_64", exclusive=True)
+    assert bsub(spec=spec) == (
+        "-M 1000MB -n 1 -W 30 -q other -R select[type==x86_64] -x -P project"
+    )
+
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_QUEUES", "short:soon")
+    assert lsf_helper.get_lsf_settings().queues == ()
+
+
 def test_build_bsub_line():
     os.environ["TOIL_LSF_ARGS"] = f"-q {TEST_QUEUE}"
     os.environ["TOIL_CONTAINER_LSF_PER_CORE"] = "N"
@@ -49,7 +832,7 @@ def test_build_bsub_line():
     cpu = 1
 
     obtained = lsf_helper.build_bsub_line(
-        cpu=cpu, mem=mem, runtime=1, jobname="Test Job"
+        cpu=cpu, mem=mem, runtime=1, jobname="Test Job", jobgroup="/toil/test"
     )
     mem_resource = lsf_helper._parse_memory(mem)
     mem_limit = lsf_helper._parse_memory(mem)
@@ -64,6 +847,8 @@ def test_build_bsub_line():
         "/dev/null",
         "-J",
         "'Test Job'",
+        "-g",
+        "/toil/test",
         "-R",
         f"select[mem>{mem_resource}]",
         "-R",
@@ -83,6 +868,22 @@ def test_build_bsub_line():
     del os.environ["TOIL_CONTAINER_LSF_PER_CORE"]
 
 
+def test_build_bsub_line_settings(monkeypatch):
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "Y")
+    monkeypatch.setenv("TOIL_CONTAINER_RUNTIME_FLAG", "-We")
+    settings = lsf_helper.get_lsf_settings()
+    assert settings == lsf_helper.LSFSettings(True, "-We", ())
+
+    # the environment is only read when resolving the settings
+    monkeypatch.setenv("TOIL_LSF_ARGS", "-q other")
+    first = lsf_helper.build_bsub_line(2, 4e9, 5, "one", settings=settings)
+    second = lsf_helper.build_bsub_line(2, 4e9, 5, "two", settings=settings)
+
+    assert first[first.index("-R") :] == second[second.index("-R") :]
+    assert " ".join(first).endswith("-M 2000MB -n 2 -We 5")
+    assert "-q other" in " ".join(lsf_helper.build_bsub_line(1, 1e9, 5, "three"))
+
+
 @SKIP_LSF
 def test_build_bsub_line_zero_cpus():
     command = lsf_helper.build_bsub_line(
@@ -0,0 +1,109 @@
+"""toil_container lsf_accounting tests."""
+
+import os
+
+from toil_container import lsf_accounting
+from toil_container import lsf_output
+
+from .test_lsf import FakeLSF
+from .test_lsf import get_worker
+
+
+def acct_line(jobid, status=64, exit_status=0, exit_info=0, index=0, max_mem=1024):
+    """Format a synthetic JOB_FINISH record of lsb.acct."""
+    fields = ['"JOB_FINISH"', '"10.1"', 170, jobid, 1000, 33554450, 1, 100, 0, 170]
+    fields += [110, '"svc_toil"', '"normal"', '""', '""', '""', '"lilac-ln01"']
+    fields += ['"/home/svc_toil"', '""', '"/dev/null"', '"/dev/null"', '"1.1"']
+    fields += [0, 1, '"lt01"', status, 1.0, '"Toil Job"', '"echo ""hi"""']
+    fields += [1.5, 0.5] + [-1] * 17 + ['""', '"default"', exit_status, 1, '""']
+    fields += [0, index, max_mem, 0, '""', '""', '""', '""', 0, '""', exit_info]
+    return " ".join(map(str, fields)) + "\n"
+
+
+def test_parse_acct_line():
+    assert lsf_accounting.parse_acct_line('"JOB_NEW" "10.1" 1') is None
+    assert lsf_accounting.parse_acct_line(acct_line(7)) == lsf_output.LSFJobRecord(
+        "7", "DONE", 0, None, 1024 * 1024, 60, 10, 2.0
+    )
+
+    record = lsf_accounting.parse_acct_line(acct_line(8, 32, 130 << 8, 16, 3))
+    assert record.lsfID == "8[3]"
+    assert (record.state, record.exit_code) == ("EXIT", 130)
+    assert record.exit_reason == "TERM_MEMLIMIT"
+
+
+def test_accounting_reader(tmpdir):
+    path = tmpdir.join("lsb.acct").strpath
+    state = tmpdir.join("state.json").strpath
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(acct_line(1))
+
+    # records written before the first read are from other runs
+    reader = lsf_accounting.AccountingReader(path, state)
+    assert reader.read() == {}
+
+    # partially written records are read once complete
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(acct_line(2) + acct_line(3)[:50])
+
+    assert reader.read().keys() == {"2"}
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(acct_line(3)[50:] + "garbage\n")
+
+    assert reader.read().keys() == {"3"}
+
+    # a restarted reader resumes from the saved offset
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(acct_line(4))
+
+    reader = lsf_accounting.AccountingReader(path, state)
+    assert reader.read().keys() == {"4"}
+
+    # the end of the rotated file is read before the new file
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(acct_line(5))
+
+    os.rename(path, path + ".1")
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(acct_line(6))
+
+    assert reader.read().keys() == {"5", "6"}
+    assert reader.read() == {}
+
+
+def test_worker_reads_accounting_instead_of_bacct(tmpdir, monkeypatch):
+    path = tmpdir.join("lsb.acct").strpath
+    open(path, "w", encoding="utf-8").close()
+    worker = get_worker(tmpdir)
+    worker._accounting = lsf_accounting.AccountingReader(
+        path, tmpdir.join("state.json").strpath
+    )
+    worker._accounting.read()
+    fake = FakeLSF(monkeypatch, {})
+
+    for i in range(1, 4):
+        worker.batchJobIDs[i] = (i, None)
+        worker.runningJobs.add(i)
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(acct_line(1) + acct_line(2, 32, 1 << 8) + acct_line(3) + acct_line(9))
+
+    statuses = worker._getJobStatuses({"1": 1, "2": 2})
+    assert statuses == {1: 0, 2: 1}
+    assert [i[0] for i in fake.calls] == ["bjobs"]
+
+    # records of running jobs are kept until they are asked for
+    assert worker._accountingRecords.keys() == {"3"}
+    assert worker._getJobStatuses({"3": 3}) == {3: 0}
+
+    # or until their jobs are forgotten
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(acct_line(3))
+
+    assert worker._readAccounting([]) == {}
+    assert worker._accountingRecords.keys() == {"3"}
+    worker.forgetJob(3)
+    assert not worker._accountingRecords
@@ -0,0 +1,34 @@
+"""toil_container lsf_executor tests."""
+
+import time
+
+from toil_container import exceptions
+from toil_container import lsf_executor
+
+
+def test_submission_executor(monkeypatch):
+    executor = lsf_executor.SubmissionExecutor(threads=4, backoff=30)
+
+    def reject():
+        raise exceptions.PendingLimitError("Pending job threshold reached.")
+
+    for i in range(4):
+        executor.submit(i, lambda i=i: 100 + i)
+
+    assert executor.capacity() == 0
+    assert sorted(executor.collect(block=True)) == [(i, 100 + i) for i in range(4)]
+    assert executor.throughput() > 0
+
+    # a rejected submission halves the concurrency and pauses submissions
+    executor.submit("rejected", reject)
+    key, error = executor.collect(block=True)[0]
+    assert key == "rejected" and isinstance(error, exceptions.PendingLimitError)
+    assert executor.limit == 2 and executor.capacity() == 0
+
+    now = time.monotonic() + 30
+    monkeypatch.setattr(lsf_executor.time, "monotonic", lambda: now)
+    assert executor.capacity() == 2
+    executor.submit(5, lambda: 105)
+    assert executor.collect(block=True) == [(5, 105)]
+    assert executor.limit == 3
+    executor.shutdown()
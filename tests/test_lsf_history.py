@@ -0,0 +1,66 @@
+"""toil_container lsf_history tests."""
+
+from toil_container import lsf_helper
+from toil_container import lsf_history
+from toil_container import lsf_output
+
+from .test_lsf import get_worker
+
+
+def get_record(max_mem, run_time):
+    return lsf_output.LSFJobRecord("1", "DONE", 0, None, max_mem, run_time, 0, 1.0)
+
+
+def test_percentile():
+    assert lsf_history.percentile([], 95) is None
+    assert lsf_history.percentile([3, None, 1, 2], 50) == 2
+    assert lsf_history.percentile(range(1, 101), 95) == 95
+    assert lsf_history.percentile([7], 0) == 7
+
+
+def test_history_resize_and_report(tmpdir):
+    path = tmpdir.join("history.db").strpath
+    history = lsf_history.ResourceHistory(path, pct=100, headroom=1.5, min_samples=3)
+    job = lsf_helper.LSFJob(1, 8e9, 120, "Call Variants", "echo", disk=2**30)
+
+    for i in range(1, 3):
+        history.record(job, get_record(i * 1e9, i * 600))
+
+    assert job.job_type == "call_variants"
+    assert job.size_bucket == 30
+    assert not history.resize(job)
+
+    history.record(job, get_record(2e9, 1200))
+    assert history.resize(job)
+    assert job.declared == (8e9, 120)
+    assert (job.memory, job.runtime) == (3e9, 30)
+
+    # other input sizes have their own history
+    other = lsf_helper.LSFJob(1, 8e9, 120, "Call Variants", "echo", disk=2**40)
+    assert not history.resize(other)
+
+    history.record(job, get_record(2e9, 1200))
+    history.close()
+
+    report = lsf_history.ResourceHistory(path).report()
+    assert len(report) == 1
+    assert report[0]["jobs"] == 4
+    assert report[0]["requested_mem"] == (3 * 8e9 + 3e9) / 4
+    assert report[0]["saved_mem_gb_hours"] == 5 / 3
+    assert report[0]["saved_runtime_hours"] == 1.5
+    assert "call_variants\t4\t" in lsf_history.format_report(report)
+
+
+def test_history_recorded_on_done(tmpdir):
+    worker = get_worker()
+    worker.boss.history = lsf_history.ResourceHistory(tmpdir.join("h.db").strpath)
+    worker.boss.Id2Node[1] = lsf_helper.LSFJob(1, 1e9, 10, "job", "echo")
+
+    assert worker._processRecord(get_record(5e8, 60), 1, "") == 0
+    assert worker.boss.history.report()[0]["used_mem"] == 5e8
+
+
+def test_history_main(tmpdir, capsys):
+    path = tmpdir.join("history.db").strpath
+    lsf_history.main([path])
+    assert capsys.readouterr().out.startswith("job_type\tjobs")
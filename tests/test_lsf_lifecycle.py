@@ -0,0 +1,86 @@
+"""toil_container lsf_lifecycle tests."""
+
+import json
+
+from toil_container import lsf_lifecycle
+from toil_container import lsf_output
+
+from .test_lsf import get_worker
+from .test_lsf import run_fake_lsf_worker
+from .utils import install_fake_lsf
+
+
+def test_lifecycle_recorder(tmpdir, monkeypatch, capsys):
+    now = [100.0]
+    monkeypatch.setattr(lsf_lifecycle.time, "time", lambda: now[0])
+    recorder = lsf_lifecycle.LifecycleRecorder(tmpdir.join("lifecycle").strpath)
+    recorder.issued(1, "align")
+    now[0] = 101
+    recorder.submitted(1, "7")
+    now[0] = 110
+    recorder.pending(1)
+
+    # start and end times are derived from the times reported by LSF
+    now[0] = 160
+    record = lsf_output.LSFJobRecord("7", "DONE", 0, None, None, 30, 20)
+    recorder.observe(1, record)
+    now[0] = 165
+    recorder.resolved(1, 0)
+
+    row = recorder.rows()[0]
+    assert [row[i] for i in lsf_lifecycle.EVENTS] == [100, 101, 110, 121, 151, 165]
+    assert row["attempts"] == 1 and row["exit_status"] == 0
+
+    # a job that is never resolved has no overhead
+    recorder.issued(2, "align")
+    summary = recorder.export()
+    assert summary == [
+        {
+            "job_type": "align",
+            "jobs": 2,
+            "pending_p50": 20,
+            "overhead_p50": 35,
+            "pending_p90": 20,
+            "overhead_p90": 35,
+            "pending_p99": 20,
+            "overhead_p99": 35,
+        }
+    ]
+
+    with open(tmpdir.join("lifecycle.json").strpath, encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+
+    spans = [(i["name"], i["ts"], i["dur"]) for i in events if i["ph"] == "X"]
+    assert spans == [
+        ("submit", 0, 1e6),
+        ("pending", 1e6, 20e6),
+        ("running", 21e6, 30e6),
+        ("resolve", 51e6, 14e6),
+    ]
+
+    path = tmpdir.join("lifecycle.csv").strpath
+    assert lsf_lifecycle.summarize(lsf_lifecycle.read_csv(path)) == summary
+    lsf_lifecycle.main([path])
+    assert "align\t2\t20.0\t20.0\t20.0\t35.0\t35.0\t35.0" in capsys.readouterr().out
+
+
+def test_fake_lsf_lifecycle(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    worker = get_worker(tmpdir)
+    worker.boss.lifecycle = lsf_lifecycle.LifecycleRecorder(tmpdir.strpath)
+    newJobs = [
+        (1, 1, 1e9, "echo FAKE_LSF_TIME=1", "job", None),
+        (2, 1, 1e9, "echo FAKE_LSF_MEM=1.2e9", "big", None),
+    ]
+
+    assert run_fake_lsf_worker(worker, newJobs) == {1: 0, 2: 0}
+    rows = worker.boss.lifecycle.rows()
+
+    # the job retried for its memory limit was submitted twice
+    assert [i["attempts"] for i in rows] == [1, 2]
+
+    for row in rows:
+        assert row["pending"]
+        times = [row[i] for i in ("submitted", "started", "finished", "resolved")]
+        assert times == sorted(times)
@@ -0,0 +1,79 @@
+"""toil_container lsf_logs tests."""
+
+import os
+
+from toil_container import lsf_helper
+from toil_container import lsf_logs
+
+from .test_lsf import get_worker
+from .test_lsf import run_fake_lsf_worker
+from .utils import ROOT
+from .utils import install_fake_lsf
+
+
+def test_capture_outputs(tmpdir, monkeypatch, capsys):
+    monkeypatch.setenv("LSB_JOBID", "42")
+    monkeypatch.setenv("LSB_JOBINDEX", "0")
+    out = tmpdir.join("job.%J.out").strpath
+    err = tmpdir.join("job.%J.err").strpath
+    scratch = tmpdir.mkdir("scratch").strpath
+
+    # empty outputs are dropped, the others are copied to their paths
+    assert lsf_logs.capture("echo hi; exit 3", out, err, scratch=scratch) == 3
+    assert tmpdir.join("job.42.out").read() == "hi\n"
+    assert not tmpdir.join("job.42.err").exists()
+    assert not os.listdir(scratch)
+
+    # in segments mode the outputs are appended to the job's segment
+    aggregator = lsf_logs.LogAggregator(tmpdir.join("logs").strpath, "segments", 2)
+    segment = aggregator.segment(3)
+    assert segment == aggregator.segment(5) != aggregator.segment(4)
+    tmpdir.join("job.42.out").remove()
+
+    for job in (3, 5):
+        command = f"echo out {job}; echo err {job} >&2"
+        lsf_logs.capture(command, out, err, segment, str(job), scratch)
+
+    assert not tmpdir.join("job.42.out").exists()
+    assert [i["std"] for i in aggregator.entries(5)] == ["out", "err"]
+    assert aggregator.extract(5) == [
+        tmpdir.join(f"job.42.{i}").strpath for i in ("out", "err")
+    ]
+    assert tmpdir.join("job.42.err").read() == "err 5\n"
+    assert not aggregator.entries(7)
+
+    # a partially written index line is ignored
+    with open(lsf_logs.index_path(segment), "a", encoding="utf-8") as f:
+        f.write('{"job": "3"')
+
+    assert len(lsf_logs.read_index(segment)) == 4
+    lsf_logs.main(["show", aggregator.directory, "3", "--segments", "2"])
+    assert "out 3\n" in capsys.readouterr().out
+
+
+def test_fake_lsf_segment_logs(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch, execute="Y")
+    monkeypatch.setenv("PYTHONPATH", ROOT)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "SUBMIT_MODE", "array")
+    monkeypatch.setattr(lsf_helper, "BATCH_SIZE", 3)
+    monkeypatch.setattr(lsf_logs, "LOG_MODE", "segments")
+    worker = get_worker(tmpdir)
+    worker.boss.formatStdOutErrPath = lambda jobID, clusterID, std: tmpdir.join(
+        f"toil_test.{jobID}.{clusterID}.{std}.log"
+    ).strpath
+    newJobs = [
+        (1, 1, 1e9, "echo ok", "job", None),
+        (2, 1, 1e9, "echo failed >&2; exit 4", "job", None),
+        (3, 1, 1e9, "true", "job", None),
+    ]
+
+    assert run_fake_lsf_worker(worker, newJobs) == {1: 0, 2: 1, 3: 0}
+
+    # only the outputs of the failed job are written to the work directory
+    logs = sorted(i.basename for i in tmpdir.listdir("toil_test.*.log"))
+    assert logs == ["toil_test.2.1.2.err.log"]
+    assert tmpdir.join(logs[0]).read() == "failed\n"
+    assert worker._components.logs.entries(1)[0]["path"] == tmpdir.join(
+        "toil_test.1.1.1.out.log"
+    )
@@ -0,0 +1,64 @@
+"""toil_container lsf_output tests."""
+
+from toil_container import lsf_output
+
+from .utils import read_lsf_data
+
+
+def test_parse_bjobs_output():
+    records = lsf_output.parse_bjobs_output(read_lsf_data("bjobs_delimited.txt"))
+
+    assert len(records) == 8
+    assert records["4810009[3]"].state == "DONE"
+    assert records["4810001"] == lsf_output.LSFJobRecord(
+        "4810001", "DONE", None, None, 12e6, 65, 3
+    )
+    assert records["4810002"].exit_code == 130
+    assert records["4810002"].exit_reason == "TERM_MEMLIMIT"
+    assert records["4810002"].max_mem == 4.2e9
+    assert records["4810003"].exit_reason == "TERM_RUNLIMIT"
+    assert records["4810004"].exit_reason is None
+    assert records["4810006"].max_mem is None
+    assert records["4810006"].pend_time == 120
+    assert records["4810007"].state == "UNKWN"
+
+
+def test_parse_long_output_bjobs():
+    records = lsf_output.parse_long_output(read_lsf_data("bjobs_l_memlimit.txt"))
+    assert records["4810002"] == lsf_output.LSFJobRecord(
+        "4810002", "EXIT", 130, "TERM_MEMLIMIT", 4.2e9, None, None
+    )
+
+
+def test_parse_long_output_bacct():
+    records = lsf_output.parse_long_output(read_lsf_data("bacct_l_multi.txt"))
+    assert records == {
+        "4810001": lsf_output.LSFJobRecord(
+            "4810001", "DONE", 0, None, 12e6, 65, 3, 0.85
+        ),
+        "4810003": lsf_output.LSFJobRecord(
+            "4810003", "EXIT", 1, "TERM_RUNLIMIT", 1.1e9, 3612, 45, 3580.12
+        ),
+    }
+
+
+def test_parse_long_output_bhist():
+    done = lsf_output.parse_long_output(read_lsf_data("bhist_l_done.txt"))
+    running = lsf_output.parse_long_output(read_lsf_data("bhist_l_running.txt"))
+
+    # a finished job's history also says it was dispatched
+    assert done["4810008"] == lsf_output.LSFJobRecord(
+        "4810008", "DONE", 0, None, 800e6, 123, 7
+    )
+    assert running["4810005"].state == "RUN"
+    assert running["4810005"].run_time == 301
+
+
+def test_parse_long_output_leading_noise():
+    records = lsf_output.parse_long_output(read_lsf_data("bacct_l_noise.txt"))
+
+    # the lines before the first job header are not attributed to any job
+    assert records == {
+        "4810010": lsf_output.LSFJobRecord("4810010", "DONE", 0, None, 20e6, 60, 2, 0.5)
+    }
+    assert lsf_output.parse_long_output("Exited with exit code 2\nTERM_OWNER") == {}
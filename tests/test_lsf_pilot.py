@@ -0,0 +1,125 @@
+"""toil_container lsf_pilot tests."""
+
+import os
+import time
+
+from toil_container import lsf_helper
+from toil_container import lsf_pilot
+
+from . import lsf_simulator
+from .test_lsf import get_worker
+from .utils import ROOT
+from .utils import install_fake_lsf
+
+
+def run_pilot(pilot, pool, jobIDs, timeout=10):
+    """Run the pilot's loop until `jobIDs` are collected by the pool."""
+    started = time.monotonic()
+
+    while not set(jobIDs) <= pool.exits.keys():
+        assert time.monotonic() - started < timeout
+        pilot.reap()
+        pilot.claim()
+        pool.collect()
+        time.sleep(0.01)
+
+    return {i: pool.exits.pop(i) for i in jobIDs}
+
+
+def test_pilot_bin_packs_jobs(tmpdir):
+    pool = lsf_pilot.PilotPool(tmpdir.strpath, cores=2, memory=2e9, job_runtime=5)
+    pilot = lsf_pilot.Pilot(tmpdir.strpath, "1", 2, 2e9, 10, idle=0, interval=0)
+
+    assert pool.fits(2, 2e9, 5)
+    assert not pool.fits(2, 2e9, None)
+    assert not pool.fits(2, 2e9, 6)
+    assert not pool.fits(3, 1e9, 1)
+
+    pool.submit(1, 1, 1e9, 1, "exit 0")
+    pool.submit(2, 2, 1e9, 1, "exit 3")
+    pool.submit(3, 1, 1.5e9, 1, 'test "$FOO" = bar', {"FOO": "bar"})
+    pool.submit(4, 1, 1e9, 20, "exit 0")  # longer than the pilot's runtime
+    assert pool.needed() == 3
+
+    # the largest job that fits is started first
+    assert pilot.claim()
+    assert list(pilot.processes) == [2]
+    assert run_pilot(pilot, pool, [2, 3, 1]) == {1: 0, 2: 3, 3: 0}
+    assert os.listdir(tmpdir.join("tasks").strpath) == [
+        lsf_pilot.task_name(4, 1, 1e9, 20)
+    ]
+
+    # queued jobs are removed, running jobs are killed by their pilot
+    pool.submit(5, 1, 1e9, 1, "sleep 30")
+    assert pilot.claim()
+    assert 5 in pool.running()
+    pool.kill(5)
+    pool.kill(4)
+    assert run_pilot(pilot, pool, [4, 5]) == {4: 1, 5: 137}
+    assert not os.listdir(tmpdir.join("tasks").strpath)
+
+
+def test_pilot_pool_tracks_pilots(tmpdir, monkeypatch):
+    pool = lsf_pilot.PilotPool(tmpdir.strpath, cores=2, memory=4e9, count=2)
+
+    for i in range(1, 6):
+        pool.submit(i, 1, 1e9, 1, "exit 0")
+
+    assert pool.needed() == 2
+    pool.add(10)
+    pool.add(11)
+    assert pool.needed() == 0
+
+    # pilots are active once they beat and lost when they stop
+    pilot = lsf_pilot.Pilot(tmpdir.strpath, "10", 2, 4e9, 10, idle=0, interval=0)
+    open(pilot.heartbeat, "w", encoding="utf-8").close()
+    assert pilot.claim()
+    assert not pool.collect()
+    assert pool.active == {"10"} and pool.pending == {"11"}
+
+    pool.drop(["10"])
+    assert not pool.pending
+    assert pool.needed() == 1
+
+    now = time.time()
+    monkeypatch.setattr(lsf_pilot.time, "time", lambda: now + 1e9)
+    assert pool.collect() == {1: 1, 2: 1}
+    assert not pool.active
+    assert not pilot.beat()
+    pilot.retire()
+
+
+def test_fake_lsf_pilot_worker(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch, execute="Y")
+    monkeypatch.setenv("PYTHONPATH", ROOT)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setattr(lsf_helper, "SUBMIT_MODE", "pilot")
+    monkeypatch.setattr(lsf_pilot, "PILOT_POLL", 0)
+    monkeypatch.setattr(lsf_pilot, "PILOT_CORES", 2)
+    monkeypatch.setattr(lsf_pilot, "PILOT_IDLE", 1)
+    worker = get_worker(tmpdir)
+    started = time.monotonic()
+
+    for jobID in range(1, 6):
+        runtime = 60 if jobID == 5 else 1  # too long for a pilot
+        command = "exit 0" if jobID != 4 else "exit 2"
+        worker.boss.Id2Node[jobID] = lsf_helper.LSFJob(1, 1e9, runtime, "job", command)
+        worker.createJobs((jobID, 1, 1e9, command, "job", None))
+
+    while worker.runningJobs:
+        assert time.monotonic() - started < 30
+        worker.checkOnJobs()
+        time.sleep(0.05)
+
+    updated = []
+
+    while not worker.updatedJobsQueue.empty():
+        updated.append(worker.updatedJobsQueue.get())
+
+    assert {i.jobID: i.exitStatus for i in updated} == {1: 0, 2: 0, 3: 0, 4: 2, 5: 0}
+    assert worker.metrics["pilots"] == 2
+
+    # only the pilots and the long job were submitted to LSF
+    db = lsf_simulator.connect()
+    names = [i[0] for i in db.execute("SELECT name FROM jobs ORDER BY jobid")]
+    assert names == ["Toil Job job 5", "Toil Job pilot", "Toil Job pilot"]
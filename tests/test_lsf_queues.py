@@ -0,0 +1,79 @@
+"""toil_container lsf_queues tests."""
+
+import logging
+import math
+import subprocess
+
+import pytest
+
+from toil_container import lsf_queues
+from toil_container.lsf_helper import LSFJob
+
+from . import lsf_simulator
+from .test_lsf import get_worker
+from .utils import install_fake_lsf
+
+
+BQUEUES_OUTPUT = """\
+QUEUE_NAME      PRIO STATUS          MAX JL/U JL/P JL/H NJOBS  PEND   RUN  SUSP
+short            40  Open:Active      10    -    -    -    50    40    10     0
+medium           30  Open:Active     100    -    -    -    80     0    80     0
+long             20  Open:Active       -    -    -    -   200   100   100     0
+closed           10  Closed:Active     -    -    -    -     0     0     0     0
+"""
+
+
+def test_queue_balancer(caplog):
+    queues = lsf_queues.parse_queues("short:60,medium:480,closed:600,long")
+    calls = []
+
+    def query(names):
+        calls.append(names)
+        return BQUEUES_OUTPUT
+
+    loads = lsf_queues.parse_bqueues_output(BQUEUES_OUTPUT)
+    assert loads["long"] == ("long", "Open:Active", None, 100, 100, 0)
+    assert lsf_queues.expected_wait(loads["short"], 1, 30, 60) == pytest.approx(246)
+    assert lsf_queues.expected_wait(loads["medium"], 1, 30, 480) == 0
+    assert lsf_queues.expected_wait(loads["closed"], 1, 30, 600) == math.inf
+
+    # jobs routed to a queue count as pending there until the next snapshot
+    balancer = lsf_queues.QueueBalancer(query, interval=300)
+
+    with caplog.at_level(logging.INFO):
+        routes = [balancer.route(i, 1, 1e9, 30, queues) for i in range(7)]
+
+    assert routes == ["medium"] * 6 + ["long"]
+    assert calls == [["closed", "long", "medium", "short"]]
+    assert "Routed job 6 (cpu=1, mem=1000000000.0, runtime=30) to queue long" in (
+        caplog.text
+    )
+
+    # a single eligible queue doesn't need a snapshot
+    assert balancer.route(7, 1, 1e9, 500, queues) == "long"
+    assert balancer.route(8, 1, 1e9, None, queues) == "long"
+
+    # without a snapshot jobs are routed by thresholds
+    def failing(names):
+        raise subprocess.CalledProcessError(255, ["bqueues"])
+
+    assert lsf_queues.QueueBalancer(failing).route(1, 1, 1e9, 30, queues) == "short"
+
+
+def test_fake_lsf_queue_balancing(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch, queues="short:100,long")
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_QUEUES", "short:60,long")
+    monkeypatch.setattr(lsf_queues, "BALANCE_QUEUES", True)
+    worker = get_worker(tmpdir)
+    newJobs = [(i, 1, 1e9, "echo FAKE_LSF_TIME=60", "job", None) for i in (1, 2, 3)]
+
+    for jobID, cpu, memory, command, jobName, _ in newJobs:
+        worker.boss.Id2Node[jobID] = LSFJob(cpu, memory, 10, jobName, command)
+        worker.createJobs(newJobs[jobID - 1])
+
+    # the routed jobs are added to the snapshot, spreading them across queues
+    db = lsf_simulator.connect()
+    queues = [i[0] for i in db.execute("SELECT queue FROM jobs ORDER BY jobid")]
+    assert queues == ["short", "long", "short"]
+    assert lsf_simulator.call_counts()["bqueues"] == 1
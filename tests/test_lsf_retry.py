@@ -0,0 +1,83 @@
+"""toil_container lsf_retry tests."""
+
+import os
+import subprocess
+
+import pytest
+
+from toil_container import exceptions
+from toil_container import lsf_retry
+
+
+def test_with_retries(tmpdir):
+    test_path = tmpdir.join("test")
+
+    def _test():
+        if not os.path.isfile(test_path.strpath):
+            test_path.write("hello")
+            subprocess.check_call(["rm", "/florentino-ariza-volume"])
+        return
+
+    lsf_retry.with_retries(_test)
+
+
+def test_retry_policy_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(lsf_retry.time, "sleep", sleeps.append)
+    breaker = lsf_retry.CircuitBreaker(threshold=100, cooldown=0)
+    policy = lsf_retry.RetryPolicy(
+        attempts=5, base=1, cap=4, max_delay=100, breaker=breaker
+    )
+    error = subprocess.CalledProcessError(1, "bjobs")
+
+    def _fail():
+        raise error
+
+    with pytest.raises(subprocess.CalledProcessError):
+        policy.call(_fail)
+
+    assert len(sleeps) == 4
+    assert all(1 <= i <= 4 for i in sleeps)
+    assert policy.metrics["attempts"] == 5
+    assert policy.metrics["failures"] == 5
+    assert policy.metrics["sleep_seconds"] == sum(sleeps)
+
+    # the total delay is capped
+    policy.max_delay = 0
+    with pytest.raises(subprocess.CalledProcessError):
+        policy.call(_fail)
+    assert policy.metrics["attempts"] == 6
+
+
+def test_circuit_breaker(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(lsf_retry.time, "sleep", sleeps.append)
+    breaker = lsf_retry.CircuitBreaker(threshold=2, cooldown=30)
+
+    breaker.failure()
+    assert breaker.wait() == 0
+    breaker.failure()
+    assert 29 < breaker.wait() <= 30
+    assert len(sleeps) == 1
+    breaker.success()
+    assert breaker.wait() == 0
+
+
+def test_retry_policy_breaker_counts_daemon_errors(monkeypatch):
+    monkeypatch.setattr(lsf_retry.time, "sleep", lambda seconds: None)
+    breaker = lsf_retry.CircuitBreaker(threshold=2, cooldown=30)
+    policy = lsf_retry.RetryPolicy(attempts=3, base=0, cap=0, breaker=breaker)
+    errors = [subprocess.CalledProcessError(255, "bsub")] * 3
+
+    def _fail():
+        raise errors.pop()
+
+    # plain command failures are retried without opening the breaker
+    with pytest.raises(subprocess.CalledProcessError):
+        policy.call(_fail)
+    assert breaker.failures == 0 and breaker.opened is None
+
+    errors = [exceptions.LSFDaemonError(255, "bsub", "", "LSF is down.")] * 3
+    with pytest.raises(exceptions.LSFDaemonError):
+        policy.call(_fail)
+    assert breaker.failures == 3 and breaker.opened is not None
@@ -0,0 +1,128 @@
+"""toil_container lsf_trace tests."""
+
+import pytest
+
+from toil_container import lsf
+from toil_container import lsf_helper
+from toil_container import lsf_output
+from toil_container import lsf_trace
+
+from .test_lsf import get_worker
+from .test_lsf import run_fake_lsf_worker
+from .utils import install_fake_lsf
+from .utils import read_lsf_data
+
+
+def get_call(command, out, t=0, lat=0):
+    return {"t": t, "cmd": command, "rc": 0, "out": out, "err": "", "lat": lat}
+
+
+def test_record_and_replay(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch, slots=2)
+    monkeypatch.setenv("TOIL_CONTAINER_LSF_PER_CORE", "N")
+    path = tmpdir.join("trace.gz").strpath
+    newJobs = [(i, 1, 1e9, "echo", "job", None) for i in range(1, 4)]
+    newJobs.append((4, 1, 1e9, "echo FAKE_LSF_MEM=1.2e9", "big", None))
+
+    worker = get_worker(tmpdir)
+    worker.boss.trace = lsf_trace.TraceRecorder(path)
+    recorded = run_fake_lsf_worker(worker, newJobs)
+    worker.boss.trace.close()
+    calls = lsf_trace.read_trace(path)
+
+    assert calls[0]["cmd"][0] == "bsub" and calls[0]["t"] == 0
+    assert sum(i["cmd"][0] == "bsub" for i in calls) == 5
+
+    # the replay doesn't need LSF
+    monkeypatch.setattr(lsf.subprocess, "run", None)
+    worker = get_worker(tmpdir)
+    worker.boss.replay = lsf_trace.TraceReplayer(path, speed=0)
+
+    assert run_fake_lsf_worker(worker, newJobs) == recorded
+    assert worker.boss.replay.served == len(calls)
+    assert worker.boss.replay.missed == 0
+
+
+def test_replay_matching_and_speed(tmpdir, monkeypatch):
+    path = tmpdir.join("trace.gz").strpath
+    lsf_trace.write_trace(
+        path,
+        [
+            get_call(["bjobs", "1"], "first", t=0, lat=1),
+            get_call(["bjobs", "1"], "second", t=10, lat=1),
+            get_call(["bjobs", "2"], "other", t=20, lat=1),
+        ],
+    )
+    clock = [0.0]
+    sleeps = []
+    monkeypatch.setattr(lsf_trace.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(lsf_trace.time, "sleep", sleeps.append)
+    replayer = lsf_trace.TraceReplayer(path, speed=10)
+
+    assert replayer.run(["bjobs", "1"]).stdout == "first"
+    assert replayer.run(["bjobs", "3"]).stdout == "second"
+    assert replayer.run(["bjobs", "2"]).stdout == "other"
+    assert replayer.run(["bjobs", "1"]).stdout == "first"
+    assert replayer.run(["bacct", "1"]).returncode == 1
+    assert sleeps == pytest.approx([0.1, 1.1, 2.1, 0.1])
+    assert (replayer.served, replayer.missed) == (4, 1)
+
+
+def test_truncated_trace(tmpdir):
+    path = tmpdir.join("trace.gz").strpath
+    lsf_trace.write_trace(path, [get_call(["bjobs"], "x" * 1000)] * 10)
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    with open(path, "wb") as f:
+        f.write(data[: len(data) // 2])
+
+    assert len(lsf_trace.read_trace(path)) < 10
+
+
+def test_scrub(tmpdir):
+    calls = [
+        get_call(["bacct", "-l", "4810001"], read_lsf_data("bacct_l_multi.txt")),
+        get_call(["bjobs", "-l"], read_lsf_data("bjobs_l_memlimit.txt")),
+    ]
+    scrubbed = lsf_trace.scrub(calls, names=["lilac"])
+    text = str(scrubbed)
+
+    for name in ["svc_toil", "lilac-ln01", "lt03", "lt04", "lt05"]:
+        assert name not in text
+
+    assert "User <user1>" in scrubbed[0]["out"]
+    assert "/home/user1" in scrubbed[1]["out"]
+    assert lsf_output.parse_long_output(scrubbed[0]["out"]).keys() == {
+        "4810001",
+        "4810003",
+    }
+
+    path = tmpdir.join("trace.gz").strpath
+    lsf_trace.write_trace(path, calls)
+    lsf_trace.main([path, path + ".scrubbed", "--name", "lilac"])
+    assert lsf_trace.read_trace(path + ".scrubbed") == scrubbed
+
+
+def test_settings_are_traced(tmpdir, monkeypatch):
+    install_fake_lsf(tmpdir, monkeypatch, per_core="Y")
+    monkeypatch.delenv("TOIL_CONTAINER_LSF_PER_CORE", raising=False)
+    path = tmpdir.join("trace.gz").strpath
+    trace = lsf_trace.TraceRecorder(path)
+    settings = lsf_helper.get_lsf_settings(
+        lambda command: lsf.call_lsf(command, True, trace=trace)
+    )
+    trace.close()
+
+    assert settings.per_core
+    assert lsf_trace.read_trace(path)[0]["cmd"] == ["bparams", "-a"]
+
+    # the settings are resolved from the trace when replaying
+    monkeypatch.setattr(lsf.subprocess, "run", None)
+    replay = lsf_trace.TraceReplayer(path, speed=0)
+    settings = lsf_helper.get_lsf_settings(
+        lambda command: lsf.call_lsf(command, True, replay=replay)
+    )
+
+    assert settings.per_core and replay.served == 1
@@ -11,9 +11,16 @@ import pytest
 
 from toil_container import utils
 
+from . import lsf_simulator
+
 ROOT = abspath(join(dirname(__file__), ".."))
+LSF_DATA = join(ROOT, "tests", "data", "lsf")
 DOCKER_IMAGE = "ubuntu:latest"
 SKIP_LSF = pytest.mark.skipif(not utils.which("bsub"), reason="bsub is not available.")
+SKIP_BENCHMARK = pytest.mark.skipif(
+    not os.getenv("TOIL_CONTAINER_BENCHMARK"),
+    reason="set TOIL_CONTAINER_BENCHMARK to run benchmarks.",
+)
 SKIP_DOCKER = pytest.mark.skipif(
     not utils.is_docker_available(), reason="docker is not available."
 )
@@ -28,6 +35,23 @@ else:
     SINGULARITY_IMAGE = "docker://" + DOCKER_IMAGE
 
 
+def install_fake_lsf(tmpdir, monkeypatch, **settings):
+    """Put the LSF simulator on PATH, `settings` are FAKE_LSF_* variables."""
+    bindir = tmpdir.join("fake_lsf").strpath
+    lsf_simulator.install(bindir)
+    monkeypatch.setenv("PATH", bindir + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_LSF_DIR", tmpdir.join("fake_lsf_state").strpath)
+
+    for key, value in settings.items():
+        monkeypatch.setenv(f"FAKE_LSF_{key.upper()}", str(value))
+
+
+def read_lsf_data(name):
+    """Read a fixture from the LSF outputs corpus."""
+    with open(join(LSF_DATA, name), encoding="utf-8") as f:
+        return f.read()
+
+
 class Capturing(list):
 
     """
@@ -1,5 +1,7 @@
 """toil_container specific exceptions."""
 
+import subprocess
+
 
 class ToilContainerException(Exception):
 
@@ -26,6 +28,16 @@ class ValidationError(ToilContainerException):
     """A class to raise for validation errors."""
 
 
+class PendingLimitError(SystemCallError):
+
+    """A class to raise when LSF rejects a job over its pending job limit."""
+
+
+class LSFDaemonError(SystemCallError, subprocess.CalledProcessError):
+
+    """A class to raise when the LSF daemons are down or not answering."""
+
+
 class ToolNotAvailableError(ToilContainerException):
 
     """A base exception to raise when tools are not available."""
@@ -57,14 +57,24 @@ class ContainerJob(Job):
 
     """A job class with a `call` method for containerized system calls."""
 
-    def __init__(self, options, runtime=None, *args, **kwargs):
+    def __init__(
+        self,
+        options,
+        runtime=None,
+        *args,
+        queue=None,
+        host_type=None,
+        exclusive=False,
+        **kwargs,
+    ):
         """
         Set toil's namespace `options` as an attribute.
 
-        Note that `runtime (-W)` is custom LSF solutions that is ignored unless
-        toil is run with `--batchSystem custom_lsf`. Please note that this hack
-        encodes the requirements in the job's `unitName` resulting in longer
-        log files names.
+        Note that `runtime (-W)`, `queue (-q)`, `host_type` and `exclusive
+        (-x)` are custom LSF solutions that are ignored unless toil is run
+        with `--batchSystem custom_lsf`. Please note that this hack encodes
+        the requirements in the job's `unitName` resulting in longer log files
+        names, although a compact encoding is used.
 
         Let us know if you need more custom parameters, e.g. `runtime_limit`,
         or if you know of a better solution (see: BD2KGenomics/toil#2065).
@@ -74,7 +84,15 @@ class ContainerJob(Job):
                 ignored unless batchSystem is set to custom_lsf (-W).
             options (object): an `argparse.Namespace` object with toil options.
             args (list): positional arguments to be passed to `toil.job.Job`.
+            queue (str): LSF queue, if not set the queue is routed by runtime
+                and memory with `TOIL_CONTAINER_LSF_QUEUES` (-q).
+            host_type (str): LSF host type to run the job on (select[type]).
+            exclusive (bool): run the job exclusively on its host (-x).
             kwargs (dict): key word arguments to be passed to `toil.job.Job`.
+
+        Raises:
+            toil_container.ValidationError: if a custom LSF resource is not
+                valid, e.g. a non positive runtime.
         """
         self.options = options
 
@@ -82,7 +100,12 @@ class ContainerJob(Job):
             kwargs["displayName"] = self.__class__.__name__
 
         if getattr(options, "batchSystem", None) == "custom_lsf":
-            data = {"runtime": runtime or os.getenv("TOIL_CONTAINER_RUNTIME")}
+            data = {
+                "runtime": runtime or os.getenv("TOIL_CONTAINER_RUNTIME"),
+                "queue": queue,
+                "host_type": host_type,
+                "exclusive": exclusive,
+            }
             kwargs["unitName"] = str(kwargs.get("unitName", "") or "")
             kwargs["unitName"] += encode_dict(data)
 
@@ -1,80 +1,422 @@
 """A custom LSF batchsystem to process additional resources."""
 # pylint: disable=C0103, W0223
 
-from collections import defaultdict
-from datetime import datetime
+from collections import Counter
+from datetime import timedelta
+from queue import Empty
+from random import randint
+from threading import Lock
 import os
+import re
 import subprocess
+import time
 
 from toil.batchSystems.lsf import LSFBatchSystem, logger
 from toil.batchSystems.abstractBatchSystem import UpdatedBatchJobInfo
+from toil.common import Toil
 
+from toil_container import exceptions
+from toil_container import lsf_executor
+from toil_container import lsf_helper
+from toil_container import lsf_accounting
+from toil_container import lsf_history
+from toil_container import lsf_lifecycle
+from toil_container import lsf_logs
+from toil_container import lsf_monitor
+from toil_container import lsf_pilot
+from toil_container import lsf_queues
+from toil_container import lsf_submit
+from toil_container import lsf_trace
+from toil_container.lsf_executor import SubmissionExecutor
 from toil_container.lsf_helper import (
     MAX_MEMORY,
     MAX_RUNTIME,
+    RETRY_STEPS,
+    STATUS_QUERY_CHUNK,
+    STUCK_STATES,
+    AdaptivePoller,
+    LSFJob,
+    ResourceSpec,
     build_bsub_line,
-    decode_dict,
-    with_retries,
+    escalate_resource,
+    get_job_group,
+    get_lsf_settings,
 )
+from toil_container.lsf_output import (
+    BJOBS_FORMAT,
+    get_lsf_id,
+    parse_bjobs_output,
+    parse_long_output,
+)
+from toil_container.lsf_queues import QueueBalancer
+from toil_container.lsf_retry import with_retries
+
+# stderr of LSF commands when mbatchd is down, overloaded or reconfiguring
+_DAEMON_ERRORS = re.compile(
+    r"not responding|cannot connect|lsf is down|daemon|timed? ?out", re.I
+)
+
+
+def call_lsf(command, check=False, env=None, trace=None, replay=None):
+    """
+    Run an LSF `command` and return its stdout.
+
+    Every LSF command of the batch system goes through this function, so
+    that it can be recorded and replayed with `lsf_trace`.
+
+    Arguments:
+        command (list): the LSF command.
+        check (bool): raise if the command fails.
+        env (dict): environment of the command.
+        trace (TraceRecorder): record the call to this trace.
+        replay (TraceReplayer): serve the call from this trace instead.
+
+    Raises:
+        exceptions.LSFDaemonError: if the scheduler is not answering.
+        subprocess.CalledProcessError: if `check` and the command failed.
+    """
+    if replay:
+        process = replay.run(command)
+    else:
+        started = time.monotonic()
+        process = subprocess.run(
+            command,
+            env=env,
+            check=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+
+        if trace:
+            trace.record(command, process, started, time.monotonic() - started)
+
+    if process.returncode and _DAEMON_ERRORS.search(process.stderr or ""):
+        raise exceptions.LSFDaemonError(
+            process.returncode, command, process.stdout, process.stderr
+        )
+
+    if process.returncode and check:
+        raise subprocess.CalledProcessError(
+            process.returncode, command, process.stdout, process.stderr
+        )
+
+    return process.stdout
+
+
+class WorkerComponents:
+
+    """
+    Optional components of the worker, None unless enabled.
+
+    Attributes:
+        submitter (SubmissionExecutor): runs concurrent bsub calls.
+        balancer (QueueBalancer): routes jobs to the least loaded queue.
+        pilots (PilotPool): runs short jobs in pilot jobs.
+        logs (LogAggregator): aggregates the outputs of the jobs.
+        status_poller (StatusPoller): polls LSF in the background.
+    """
+
+    def __init__(self):
+        """Start with every component disabled."""
+        self.submitter = None
+        self.balancer = None
+        self.pilots = None
+        self.logs = None
+        self.status_poller = None
 
 
 class CustomLSFBatchSystem(LSFBatchSystem):
 
     """A custom LSF batchsystem used to encode extra lsf resources."""
 
-    def __init__(self, *args, **kwargs):
-        """Create a mapping table for JobIDs to JobNodes."""
-        super().__init__(*args, **kwargs)
+    def __init__(self, config, *args, **kwargs):
+        """Create a mapping table for JobIDs to compact LSFJob records."""
+        # set before the worker thread is started by the parent constructor
+        self.jobGroup = get_job_group(config.workflowID)
+        self.history = None
+        self.lifecycle = None
+        self.trace = None
+        self.replay = None
+
+        if lsf_trace.REPLAY_PATH:
+            self.replay = lsf_trace.TraceReplayer(lsf_trace.REPLAY_PATH)
+        elif lsf_trace.TRACE_PATH:
+            self.trace = lsf_trace.TraceRecorder(lsf_trace.TRACE_PATH)
+
+        if lsf_history.HISTORY_PATH:
+            self.history = lsf_history.ResourceHistory(lsf_history.HISTORY_PATH)
+
+        if lsf_lifecycle.LIFECYCLE_PATH:
+            self.lifecycle = lsf_lifecycle.LifecycleRecorder(
+                lsf_lifecycle.LIFECYCLE_PATH
+            )
+
+        self.settings = get_lsf_settings(self._callLSF)
+        super().__init__(config, *args, **kwargs)
         self.Id2Node = {}
-        self.resourceRetryCount = defaultdict(set)
+
+    def reloadSettings(self):
+        """Resolve the LSF settings again, e.g. after changing the environment."""
+        self.settings = get_lsf_settings(self._callLSF)
+        logger.info("Reloaded LSF settings: %s", self.settings)
+
+    def _callLSF(self, command):
+        """Run an LSF command from the leader with `call_lsf`, raising if it fails."""
+        return call_lsf(command, True, trace=self.trace, replay=self.replay)
+
+    def shutdown(self):
+        """
+        Remove the workflow's LSF job group after the worker is stopped.
+
+        Jobs still running when the workflow shuts down are killed with a
+        single `bkill -g <group> 0`, and the jobs' lifecycle is exported if
+        `TOIL_CONTAINER_LSF_LIFECYCLE` is set.
+        """
+        super().shutdown()
+
+        if self.jobGroup and self.worker.runningJobs and not self.replay:
+            logger.info("Killing %d leftover LSF jobs", len(self.worker.runningJobs))
+            self.worker._bulkKill([], group=True)  # pylint: disable=protected-access
+
+        if self.worker._components.pilots:  # pylint: disable=protected-access
+            self.worker._components.pilots.stop()  # pylint: disable=protected-access
+
+        if self.history:
+            self.history.close()
+
+        if self.lifecycle:
+            summary = self.lifecycle.export()
+            logger.info(
+                "LSF job lifecycle summary (seconds):\n%s",
+                lsf_lifecycle.format_summary(summary),
+            )
+
+        if self.jobGroup:
+            logger.debug("Removing LSF job group %s", self.jobGroup)
+            self.worker._callLSF(["bgdel", self.jobGroup])  # pylint: disable=W0212
+
+        if self.trace:
+            self.trace.close()
 
     def issueBatchJob(self, jobDesc, job_environment=None):
-        """Load the jobDesc into the JobID mapping table."""
-        jobID = super().issueBatchJob(jobDesc, job_environment)
-        self.Id2Node[jobID] = jobDesc
+        """Load the jobDesc resources into the JobID mapping table."""
+        jobNode = LSFJob.from_job_description(jobDesc)
+
+        if self.history and lsf_history.HISTORY_SIZING:
+            self.history.resize(jobNode)
+
+        jobID = self.handleLocalJob(jobDesc)
+
+        if jobID is not None:
+            self.Id2Node[jobID] = jobNode
+        else:
+            self.checkResourceRequest(jobDesc.memory, jobDesc.cores, jobDesc.disk)
+            jobID = self.getNextJobID()
+
+            # map the job before queueing it, the worker may submit it right away
+            self.Id2Node[jobID] = jobNode
+            self.currentJobs.add(jobID)
+            self.newJobsQueue.put(
+                (
+                    jobID,
+                    jobDesc.cores,
+                    jobDesc.memory,
+                    jobDesc.command,
+                    jobDesc.jobName,
+                    job_environment,
+                )
+            )
+
+        if self.lifecycle:
+            self.lifecycle.issued(jobID, jobNode.job_type)
         return jobID
 
     @staticmethod
     def with_retries(operation, *args, **kwargs):
-        """Add a random sleep after each retry."""
+        """Retry with backoff, pausing while the LSF circuit breaker is open."""
         return with_retries(operation, *args, **kwargs)
 
-    class Worker(LSFBatchSystem.Worker):
+    class Worker(
+        lsf_monitor.RunningJobsMixin,
+        lsf_submit.BatchSubmissionMixin,
+        LSFBatchSystem.Worker,
+    ):
 
-        """Make prepareBsub a class method and parse unitName."""
+        """
+        Submit the jobs to LSF and track their status.
+
+        Jobs are submitted with the custom resources of their `LSFJob`, one
+        at a time, concurrently or in batches, and their status is resolved
+        in bulk from `bjobs`, the accounting file or the pilot jobs.
+        """
 
         _CANT_DETERMINE_JOB_STATUS = "NO STATUS FOUND"
 
+        def __init__(self, *args, **kwargs):
+            """Keep counters of the LSF calls made by the worker."""
+            super().__init__(*args, **kwargs)
+            self.metrics = Counter()
+            self._cycleSubprocesses = 0
+            self._bufferedSince = None
+            self._arrayFiles = {}
+            self._poller = AdaptivePoller(self.boss.config.statePollingWait)
+            self._metricsLock = Lock()
+            self._monitor = lsf_monitor.MonitorState()
+            self._components = WorkerComponents()
+
+            if lsf_queues.BALANCE_QUEUES:
+                self._components.balancer = QueueBalancer(self._queryQueues)
+
+            if lsf_executor.SUBMIT_THREADS > 1:
+                self._components.submitter = SubmissionExecutor()
+
+            if lsf_helper.BACKGROUND_POLL:
+                self._components.status_poller = lsf_monitor.StatusPoller(self)
+
+            self._accounting = None
+            self._accountingRecords = {}
+
+            if lsf_accounting.ACCT_FILE:
+                state = lsf_accounting.ACCT_STATE or os.path.join(
+                    Toil.getToilWorkDir(self.boss.config.workDir),
+                    f"toil_{self.boss.config.workflowID}.acct.json",
+                )
+                self._accounting = lsf_accounting.AccountingReader(
+                    lsf_accounting.ACCT_FILE, state
+                )
+                # pin the offset before any job is submitted
+                self._accounting.read()
+
+            if lsf_logs.LOG_MODE in ("drop-empty", "segments"):
+                self._components.logs = lsf_logs.LogAggregator(
+                    lsf_logs.LOG_DIR
+                    or os.path.join(
+                        Toil.getToilWorkDir(self.boss.config.workDir),
+                        f"toil_{self.boss.config.workflowID}.logs",
+                    )
+                )
+
+            self._pilotsCheckedAt = None
+
+            if lsf_helper.SUBMIT_MODE == "pilot":
+                self._components.pilots = lsf_pilot.PilotPool(
+                    lsf_pilot.PILOT_DIR
+                    or os.path.join(
+                        Toil.getToilWorkDir(self.boss.config.workDir),
+                        f"toil_{self.boss.config.workflowID}.pilots",
+                    )
+                )
+
+        def run(self):
+            """Run the worker loop, along with the status poller if enabled."""
+            if self._components.status_poller:
+                self._components.status_poller.start()
+
+            try:
+                super().run()
+            finally:
+                if self._components.status_poller:
+                    self._components.status_poller.stopped.set()
+
+                if self._components.submitter:
+                    self._collectSubmissions(block=True)
+                    self._components.submitter.shutdown()
+
         def forgetJob(self, jobID):
             """Remove jobNode from the mapping table when forgetting."""
-            self.boss.Id2Node.pop(jobID, None)
-            self.boss.resourceRetryCount.pop(jobID, None)
-            return super().forgetJob(jobID)
+            self._forgetJobs([jobID])
+
+        def _forgetJobs(self, jobIDs):
+            """
+            Forget many jobs at once.
 
-        def prepareBsub(self, cpu, mem, jobID, runtime=None):  # pylint: disable=W0221
+            Their jobNodes, which hold the resource retry counters, are
+            removed from the mapping table along with their unread accounting
+            records, and the array files left unused are deleted.
+            """
+            jobIDs = set(jobIDs)
+
+            for jobID in jobIDs:
+                if jobID in self.batchJobIDs:
+                    self._accountingRecords.pop(self.getBatchSystemID(jobID), None)
+
+                self.boss.Id2Node.pop(jobID, None)
+                self.batchJobIDs.pop(jobID, None)
+                self._monitor.stuck_since.pop(jobID, None)
+
+            with self.runningJobsLock:
+                self.runningJobs -= jobIDs
+
+            for path, arrayJobIDs in list(self._arrayFiles.items()):
+                arrayJobIDs -= jobIDs
+
+                if not arrayJobIDs:
+                    self._arrayFiles.pop(path)
+                    os.remove(path)
+
+        def getBatchSystemID(self, jobID):
+            """Get the LSF ID of a job, `jobid[index]` for job array elements."""
+            if jobID not in self.batchJobIDs:
+                raise RuntimeError("Unknown jobID, could not be converted")
+
+            return get_lsf_id(*self.batchJobIDs[jobID])
+
+        def _isPilotJob(self, jobID):
+            """Check if a job was handed to the pilots instead of LSF."""
+            lsfID = str(self.batchJobIDs[jobID][0])
+            return lsfID.startswith(lsf_pilot.PILOT_PREFIX)
+
+        def prepareBsub(
+            self, cpu, mem, jobID, runtime=None, arraysize=None
+        ):  # pylint: disable=W0221
             """
             Make a bsub commandline to execute.
 
             Arguments:
                 cpu (int): number of cores needed.
                 mem (float): number of bytes of memory needed.
-                jobID (str): ID number of the job.
+                jobID (str): ID number of the job, the first one for arrays.
                 runtime (int): total runtime.
+                arraysize (int): number of elements if submitting a job array.
 
             Returns:
                 list: a bsub line argument.
             """
             env_jobname = os.getenv("TOIL_LSF_JOBNAME", "Toil Job")
+            cluster_job_id = "%J.%I" if arraysize else "%J"
+            spec = ResourceSpec()
 
             try:  # try to update runtime if not provided
                 jobNode = self.boss.Id2Node[jobID]
-                runtime = runtime or decode_dict(jobNode.unitName).get("runtime", None)
+                runtime = runtime or jobNode.runtime
+                mem = jobNode.memory if jobNode.declared else mem
+                spec = jobNode.spec
                 jobname = f"{env_jobname} {jobNode.jobName} {jobID}"
             except KeyError:
                 jobname = f"{env_jobname} {jobID}"
 
-            stdoutfile: str = self.boss.formatStdOutErrPath(jobID, "%J", "out")
-            stderrfile: str = self.boss.formatStdOutErrPath(jobID, "%J", "err")
+            if arraysize:
+                jobname += " array"
+
+            queue = spec.queue
+
+            if not queue and self._components.balancer:
+                settings = self.boss.settings or get_lsf_settings()
+                queue = self._components.balancer.route(
+                    jobID,
+                    int(cpu) * (arraysize or 1),
+                    mem / (int(cpu) or 1) if mem and settings.per_core else mem,
+                    runtime,
+                    settings.queues,
+                )
+
+            stdoutfile = self.boss.formatStdOutErrPath(jobID, cluster_job_id, "out")
+            stderrfile = self.boss.formatStdOutErrPath(jobID, cluster_job_id, "err")
+
+            # the wrapped commands write their own outputs, see _wrapCommand
+            if self._components.logs:
+                stdoutfile = stderrfile = os.devnull
 
             return build_bsub_line(
                 cpu=cpu,
@@ -83,147 +425,761 @@ class CustomLSFBatchSystem(LSFBatchSystem):
                 jobname=jobname,
                 stdoutfile=stdoutfile,
                 stderrfile=stderrfile,
+                jobgroup=self.boss.jobGroup,
+                arraysize=arraysize,
+                settings=self.boss.settings,
+                spec=spec._replace(queue=queue),
             )
 
-        def checkOnJobs(self):
+        def prepareSubmission(
+            self, cpu, memory, jobID, command, jobName, job_environment=None
+        ):  # pylint: disable=W0221
+            """Make a bsub line for `command`, wrapped to aggregate its outputs."""
+            return super().prepareSubmission(
+                cpu,
+                memory,
+                jobID,
+                self._wrapCommand(jobID, command),
+                jobName,
+                job_environment,
+            )
+
+        def _queryQueues(self, queues):
+            """Get the `bqueues -w` output of `queues` for the queue balancer."""
+            return self._callLSF(["bqueues", "-w"] + list(queues), check=True)
+
+        def _wrapCommand(self, jobID, command, array=False):
             """
-            Check and update status of all running jobs.
+            Wrap a job's command to aggregate its outputs if enabled.
+
+            The command writes its outputs to node-local scratch, and then
+            drops them if empty or appends them to a segment, see `lsf_logs`.
+
+            Arguments:
+                jobID (int): the Toil job ID.
+                command (str): the job's shell command.
+                array (bool): the job is an element of a job array.
+
+            Returns:
+                str: the command to submit.
+            """
+            cluster_job_id = "%J.%I" if array else "%J"
+            stdoutfile = self.boss.formatStdOutErrPath(jobID, cluster_job_id, "out")
+            stderrfile = self.boss.formatStdOutErrPath(jobID, cluster_job_id, "err")
+
+            if not self._components.logs or stdoutfile == os.devnull:
+                return command
 
-            Respects statePollingWait and will return cached results if not within
-            time period to talk with the scheduler.
+            return self._components.logs.wrap(jobID, command, stdoutfile, stderrfile)
+
+        def createJobs(self, newJob):
             """
+            Buffer new jobs and submit them in batches if not in single mode.
+
+            Jobs are buffered for `FLUSH_INTERVAL` seconds since the first
+            pending job arrived, or until `BATCH_SIZE` jobs are waiting, then
+            submitted with `_submitBatch`.
+
+            In pilot mode, jobs that fit a pilot are queued for the pilots
+            and the others are submitted one by one.
+            """
+            if self._components.pilots:
+                return self._createPilotJob(newJob)
+
+            if lsf_helper.SUBMIT_MODE == "single":
+                return self._createSingleJobs(newJob)
+
+            if newJob is not None:
+                self.waitingJobs.append(newJob)
+                self._bufferedSince = self._bufferedSince or time.monotonic()
+
+            capacity = int(self.boss.config.maxLocalJobs) - len(self.runningJobs)
+
+            if not self.waitingJobs or capacity <= 0:
+                return False
+
             if (
-                self._checkOnJobsTimestamp
-                and (datetime.now() - self._checkOnJobsTimestamp).total_seconds()
-                < self.boss.config.statePollingWait
+                len(self.waitingJobs) < lsf_helper.BATCH_SIZE
+                and time.monotonic() - self._bufferedSince < lsf_helper.FLUSH_INTERVAL
             ):
-                return self._checkOnJobsCache
+                return False
+
+            capacity = min(capacity, lsf_helper.BATCH_SIZE)
+            batch = self.waitingJobs[:capacity]
+            del self.waitingJobs[:capacity]
+            self._bufferedSince = time.monotonic() if self.waitingJobs else None
+            self._submitBatch(batch)
+            return True
+
+        def _createSingleJobs(self, newJob):
+            """Submit waiting jobs one by one while below `maxLocalJobs`."""
+            if self._components.submitter:
+                return self._createConcurrentJobs(newJob)
 
             activity = False
-            not_finished = self.boss.with_retries(self._getNotFinishedIDs)  # Added
+
+            if newJob is not None:
+                self.waitingJobs.append(newJob)
+
+            while self.waitingJobs and len(self.runningJobs) < int(
+                self.boss.config.maxLocalJobs
+            ):
+                activity = True
+                (
+                    jobID,
+                    cpu,
+                    memory,
+                    command,
+                    jobName,
+                    environment,
+                ) = self.waitingJobs.pop(0)
+                subLine = self.prepareSubmission(
+                    cpu, memory, jobID, command, jobName, environment
+                )
+                lsfID = self.boss.with_retries(self.submitJob, subLine)
+                logger.debug("Submitted job %s", lsfID)
+                self._addBatchJobIDs([jobID], lsfID)
+
+            return activity
+
+        def _createPilotJob(self, newJob):
+            """Queue `newJob` for the pilots if it fits, else submit it to LSF."""
+            if newJob is None:
+                return self._createSingleJobs(newJob)
+
+            jobID, cpu, memory, command, _, environment = newJob
+            jobNode = self.boss.Id2Node.get(jobID)
+            runtime = jobNode and jobNode.runtime
+            memory = jobNode.memory if jobNode else memory
+            spec = jobNode.spec if jobNode else ResourceSpec()
+
+            # jobs that ask for a queue or host are left to LSF
+            if (
+                spec.queue
+                or spec.host_type
+                or spec.exclusive
+                or not self._components.pilots.fits(cpu, memory, runtime)
+            ):
+                return self._createSingleJobs(newJob)
+
+            self._components.pilots.submit(
+                jobID, cpu, memory, runtime, command, environment
+            )
+            self._addBatchJobIDs([jobID], f"{lsf_pilot.PILOT_PREFIX}{jobID}")
+            return True
+
+        def _addBatchJobIDs(self, jobIDs, lsfID, array=False):
+            """Map Toil `jobIDs` to their LSF ID, indexed from 1 for arrays."""
+            for index, jobID in enumerate(jobIDs, 1):
+                self.batchJobIDs[jobID] = (lsfID, index if array else None)
+
+                with self.runningJobsLock:
+                    self.runningJobs.add(jobID)
+
+                if self.boss.lifecycle:
+                    self.boss.lifecycle.submitted(jobID, self.getBatchSystemID(jobID))
+
+        def checkOnJobs(self):
+            """
+            Check and update status of all running jobs.
+
+            Starts polling every statePollingWait seconds, then adapts the
+            interval to the rate of completed jobs and the scheduler latency.
+            Cached results are returned if not within time period to talk with
+            the scheduler.
+
+            If the background status poller is enabled, the scheduler is not
+            queried here, the latest snapshot is compared with the running jobs.
+            The jobs run by pilots are checked on through the pilot queue.
+            """
+            pilotActivity = self._checkOnPilots() if self._components.pilots else False
+
+            if self._components.status_poller:
+                snapshotActivity = self._checkOnSnapshot()
+                return pilotActivity or snapshotActivity
+
+            if not self._poller.due():
+                return pilotActivity or self._checkOnJobsCache
+
+            activity = pilotActivity
+            self._cycleSubprocesses = 0
+
+            if not self.runningJobs:
+                return activity
+
+            started = time.monotonic()
+            running = len(self.runningJobs)
+            not_finished = self.boss.with_retries(self._getNotFinishedIDs)
+            finished = {}
 
             for jobID in list(self.runningJobs):
                 batchJobID = self.getBatchSystemID(jobID)
 
-                if int(batchJobID) in not_finished:
+                if batchJobID.startswith(lsf_pilot.PILOT_PREFIX):
+                    continue
+
+                if batchJobID in not_finished:
                     logger.debug("bjobs detected unfinished job %s", batchJobID)
+
+                    if self.boss.lifecycle:
+                        self.boss.lifecycle.pending(jobID)
+                else:
+                    finished[batchJobID] = jobID
+
+            if finished:
+                statuses = self._getJobStatuses(finished)
+            else:
+                statuses = {}
+
+            activity = self._updateStatuses(statuses) or activity
+            activity = self._updateStatuses(self._reclaimStuckJobs()) or activity
+            self._extendRunLimits()
+            logger.debug(
+                "Spawned %d LSF subprocesses to check on %d finished jobs",
+                self._cycleSubprocesses,
+                len(finished),
+            )
+
+            self.metrics["cycles"] += 1
+            self._poller.update(
+                sum(i is not None for i in statuses.values()),
+                running,
+                time.monotonic() - started,
+            )
+            self._checkOnJobsCache = activity
+            return activity
+
+        def _checkOnPilots(self):
+            """
+            Update the status of the jobs run by pilots and scale the pilots.
+
+            The queue is checked every `PILOT_POLL` seconds. LSF is only
+            queried while pilots are pending, to forget those that died
+            before they started.
+            """
+            now = time.monotonic()
+
+            if (
+                self._pilotsCheckedAt
+                and now - self._pilotsCheckedAt < lsf_pilot.PILOT_POLL
+            ):
+                return False
+
+            self._pilotsCheckedAt = now
+            exits = self._components.pilots.collect()
+            statuses = {}
+
+            for jobID in list(exits):
+                status = exits.pop(jobID)
+
+                if jobID in self.runningJobs:
+                    statuses[jobID] = status
+
+            if self._components.pilots.pending:
+                self._components.pilots.drop(
+                    self.boss.with_retries(self._getNotFinishedIDs)
+                )
+
+            for _ in range(self._components.pilots.needed()):
+                self._submitPilot()
+
+            return self._updateStatuses(statuses)
+
+        def _submitPilot(self):
+            """Submit a pilot job with the pool's cores, memory and runtime."""
+            env_jobname = os.getenv("TOIL_LSF_JOBNAME", "Toil Job")
+            bsubline = build_bsub_line(
+                cpu=self._components.pilots.cores,
+                mem=self._components.pilots.memory,
+                runtime=self._components.pilots.runtime,
+                jobname=f"{env_jobname} pilot",
+                stdoutfile=self.boss.formatStdOutErrPath("pilot", "%J", "out"),
+                stderrfile=self.boss.formatStdOutErrPath("pilot", "%J", "err"),
+                jobgroup=self.boss.jobGroup,
+                settings=self.boss.settings,
+            )
+            subLine = (bsubline + [self._components.pilots.command()], None)
+            lsfID = self.boss.with_retries(self.submitJob, subLine)
+
+            if not str(lsfID).startswith("NOT_SUBMITTED"):
+                self._components.pilots.add(lsfID)
+
+            self.metrics["pilots"] += 1
+            logger.debug("Submitted LSF pilot %s", lsfID)
+
+        def killJob(self, jobID):
+            """Kill a job through the pilot queue if it was run by a pilot."""
+            if self._isPilotJob(jobID):
+                self._components.pilots.kill(jobID)
+            else:
+                self._bulkKill([self.getBatchSystemID(jobID)])
+
+        def killJobs(self):
+            """
+            Kill the jobs in the kill queue with bulk LSF calls.
+
+            Jobs run by pilots are killed through the pilot queue. The others
+            are killed with `bkill` calls of up to `STATUS_QUERY_CHUNK` IDs,
+            or with a single `bkill -g <group> 0` when all the jobs of the
+            workflow's group are killed. Termination is then confirmed with
+            one `bjobs` query per round instead of one per job.
+
+            Returns:
+                bool: True if jobs were killed.
+            """
+            killList = set()
+
+            while True:
+                try:
+                    killList.add(self.killQueue.get(block=False))
+                except Empty:
+                    break
+
+            if not killList:
+                return False
+
+            # jobs being submitted are killed once they have an LSF ID
+            if self._components.submitter:
+                self._collectSubmissions(block=True)
+
+            self.waitingJobs[:] = [i for i in self.waitingJobs if i[0] not in killList]
+
+            for jobID in killList - self.runningJobs:
+                self.killedJobsQueue.put(jobID)
+
+            killList &= self.runningJobs
+            lsfIDs = {}
+
+            for jobID in killList:
+                if self._isPilotJob(jobID):
+                    self._components.pilots.kill(jobID)
                 else:
-                    status = self.boss.with_retries(
-                        self._customGetJobExitCode, batchJobID, jobID
+                    lsfIDs[self.getBatchSystemID(jobID)] = jobID
+
+            logger.debug("Killing %d jobs", len(killList))
+            # pilots run other jobs too, so their group is never killed
+            group = not self._components.pilots and killList >= self.runningJobs
+            self._bulkKill(lsfIDs, group=group)
+            self.metrics["killed"] += len(killList)
+
+            while killList:
+                killed = {i for i in killList if not self._isPilotJob(i)}
+
+                if lsfIDs:
+                    not_finished = self.boss.with_retries(self._getNotFinishedIDs)
+                    killed -= {lsfIDs[i] for i in not_finished if i in lsfIDs}
+
+                if self._components.pilots and len(killed) < len(killList):
+                    exits = self._components.pilots.collect()
+                    killed |= {i for i in killList if exits.pop(i, None) is not None}
+
+                for jobID in killed:
+                    self.killedJobsQueue.put(jobID)
+
+                self._forgetJobs(killed)
+                killList -= killed
+
+                if killList:
+                    logger.warning(
+                        "%d jobs weren't killed, trying again in %is.",
+                        len(killList),
+                        self.boss.sleepSeconds(),
                     )
-                    if status is not None:
-                        activity = True
-                        self.updatedJobsQueue.put(
-                            UpdatedBatchJobInfo(
-                                jobID=jobID,
-                                exitStatus=status,
-                                exitReason=None,
-                                wallTime=None,
-                            )
+
+            return True
+
+        def _bulkKill(self, lsfIDs, group=False):
+            """
+            Kill LSF jobs with chunked multi-ID `bkill` calls.
+
+            Arguments:
+                lsfIDs (iterable): LSF IDs of the jobs to kill.
+                group (bool): kill all the jobs of the workflow's LSF job
+                    group with `bkill -g <group> 0` instead, if there's one.
+            """
+            lsfIDs = sorted(i for i in lsfIDs if not i.startswith("NOT_SUBMITTED"))
+
+            if group and self.boss.jobGroup:
+                command = ["bkill", "-g", self.boss.jobGroup, "0"]
+                self.boss.with_retries(self._callLSF, command)
+                return
+
+            for i in range(0, len(lsfIDs), STATUS_QUERY_CHUNK):
+                chunk = lsfIDs[i : i + STATUS_QUERY_CHUNK]
+                self.boss.with_retries(self._callLSF, ["bkill"] + chunk)
+
+        def getJobExitCode(self, lsfJobID):
+            """
+            Get the exit status of a job, from the pilot queue if run by one.
+
+            Only the base `checkOnJobs` calls this, and it's replaced by the
+            bulk queries of `_getJobStatuses`, so the LSF calls of the base
+            implementation are neither traced nor replayed.
+            """
+            if str(lsfJobID).startswith(lsf_pilot.PILOT_PREFIX):
+                exits = self._components.pilots.collect()
+                return exits.pop(int(lsfJobID[len(lsf_pilot.PILOT_PREFIX) :]), None)
+
+            return super().getJobExitCode(lsfJobID)
+
+        def getRunningJobIDs(self):
+            """
+            Get the running times of the jobs, including those run by pilots.
+
+            The jobs submitted to LSF are queried with `bjobs -r` through
+            `_callLSF`, so that the query is traced like the other LSF calls.
+            """
+            with self.runningJobsLock:
+                lsfIDs = {
+                    self.getBatchSystemID(i): i
+                    for i in self.runningJobs
+                    if not self._isPilotJob(i)
+                }
+
+            lsfIDs = {
+                lsfID: jobID
+                for lsfID, jobID in lsfIDs.items()
+                if not lsfID.startswith("NOT_SUBMITTED")
+            }
+
+            records = self._getRunningRecords(lsfIDs) if lsfIDs else {}
+            times = {
+                lsfIDs[lsfID]: timedelta(seconds=record.run_time or 0)
+                for lsfID, record in records.items()
+                if lsfID in lsfIDs and record.state == "RUN"
+            }
+
+            if self._components.pilots:
+                times.update(self._components.pilots.running())
+
+            return times
+
+        def _checkOnSnapshot(self):
+            """Update the status of running jobs from the poller's snapshot."""
+            snapshot = self._components.status_poller.snapshot
+
+            if snapshot is None or snapshot.version == self._monitor.snapshot_version:
+                return self._checkOnJobsCache
+
+            statuses = {}
+            unknown = {}
+            self._cycleSubprocesses = 0
+            self._monitor.snapshot_version = snapshot.version
+
+            for jobID in list(self.runningJobs):
+                batchJobID = self.getBatchSystemID(jobID)
+                record = snapshot.records.get(batchJobID)
+
+                if record is None:
+                    # jobs submitted after the snapshot was taken are not in it
+                    if batchJobID in snapshot.queried:
+                        unknown[batchJobID] = jobID
+                elif record.state in ("DONE", "EXIT"):
+                    cmdstr = f"status snapshot {snapshot.version}"
+                    statuses[jobID] = self._processRecord(record, jobID, cmdstr)
+                elif self.boss.lifecycle:
+                    self.boss.lifecycle.observe(jobID, record)
+
+            if unknown:
+                statuses.update(self._getJobStatuses(unknown))
+
+            statuses.update(self._reclaimStuckJobs(snapshot.records))
+            self._extendRunLimits(snapshot.records)
+            self.metrics["cycles"] += 1
+            self._checkOnJobsCache = self._updateStatuses(statuses)
+            return self._checkOnJobsCache
+
+        def _updateStatuses(self, statuses):
+            """Push the updated jobs from a mapping of Toil job IDs to status."""
+            activity = False
+
+            for jobID, status in statuses.items():
+                if status is not None and status != self._CANT_DETERMINE_JOB_STATUS:
+                    activity = True
+
+                    # the leader reads the outputs of failed jobs
+                    if status != 0 and self._components.logs:
+                        self._components.logs.extract(jobID)
+
+                    self.updatedJobsQueue.put(
+                        UpdatedBatchJobInfo(
+                            jobID=jobID,
+                            exitStatus=status,
+                            exitReason=None,
+                            wallTime=None,
                         )
-                        self.forgetJob(jobID)
+                    )
+                    self.forgetJob(jobID)
+
+                    if self.boss.lifecycle:
+                        self.boss.lifecycle.resolved(jobID, status)
 
-            self._checkOnJobsCache = activity
-            self._checkOnJobsTimestamp = datetime.now()
             return activity
 
-        def _customGetJobExitCode(self, lsfID, jobID):
-            """Get LSF exit code."""
-            # the task is set as part of the job ID if using getBatchSystemID()
-            if "." in lsfID:
-                lsfID, _ = lsfID.split(".", 1)
+        def _callLSF(self, command, check=False, env=None):
+            """
+            Run an LSF `command` and return its stdout, counting the call.
+
+            Raises:
+                subprocess.CalledProcessError: if `check` and the command
+                    failed, or if the scheduler is not answering.
+            """
+            with self._metricsLock:
+                self.metrics["subprocesses"] += 1
+                self._cycleSubprocesses += 1
+
+            return call_lsf(command, check, env, self.boss.trace, self.boss.replay)
+
+        def submitJob(self, subLine):
+            """Submit a job with `_callLSF`, so that bsub calls are traced."""
+            subLine, job_environment = subLine
+            combinedEnv = dict(self.boss.environment)
+            combinedEnv.update(os.environ)
+
+            if job_environment:
+                combinedEnv.update(job_environment)
+
+            stdout = self._callLSF(subLine, check=True, env=combinedEnv)
+            result_search = re.search("Job <(.*)> is submitted", stdout)
 
+            if result_search:
+                result = int(result_search.group(1))
+                logger.debug("Got the job id: %s", result)
+            else:
+                logger.error("Could not submit job\nReason: %s", stdout)
+                result = f"NOT_SUBMITTED_{randint(10000000, 99999999)}"
+
+            return result
+
+        def _getJobStatuses(self, batchJobIDs):
+            """
+            Resolve the status of many finished jobs with bulk LSF queries.
+
+            A single `bjobs` call is made per chunk of job IDs, only the jobs
+            that `bjobs` no longer knows about are looked up with `bacct`, or
+            in the lsb.acct reader if enabled, and only those still unknown
+            are looked up with `bhist`.
+
+            Arguments:
+                batchJobIDs (dict): a mapping of LSF job IDs to Toil job IDs.
+
+            Returns:
+                dict: a mapping of Toil job IDs to exit status, None if the
+                    status couldn't be determined or the job is still running.
+            """
+            pending = dict(batchJobIDs)
+            statuses = {}
+
+            for lsfID in list(pending):
+                if lsfID.startswith("NOT_SUBMITTED"):
+                    logger.error("Detected job that failed to submit: %s", lsfID)
+                    statuses[pending.pop(lsfID)] = 1
             commands = [
-                ["bjobs", "-l", str(lsfID)],
-                ["bacct", "-l", str(lsfID)],
-                ["bhist", "-l", "-n", "1", str(lsfID)],
-                ["bhist", "-l", "-n", "2", str(lsfID)],
+                ["bjobs", "-noheader", "-o", BJOBS_FORMAT],
+                ["bacct", "-l"],
+                ["bhist", "-l", "-n", "1"],
+                ["bhist", "-l", "-n", "2"],
             ]
 
-            for i in commands:
-                logger.debug("Checking job via: %s", " ".join(i))
-                status = self._processStatusCommandLSF(i, jobID)
+            for command in commands:
+                lsfIDs = list(pending)
+
+                if command[0] == "bacct" and self._accounting:
+                    records = self._readAccounting(lsfIDs)
+                    self._applyRecords(records, lsfIDs, pending, statuses, "lsb.acct")
+                    continue
+
+                for i in range(0, len(lsfIDs), STATUS_QUERY_CHUNK):
+                    chunk = lsfIDs[i : i + STATUS_QUERY_CHUNK]
+                    logger.debug("Checking %d jobs via: %s", len(chunk), command)
+                    output = self.boss.with_retries(self._callLSF, command + chunk)
+
+                    if command[0] == "bjobs":
+                        records = parse_bjobs_output(output)
+                    else:
+                        records = parse_long_output(output)
+
+                    self._applyRecords(
+                        records, chunk, pending, statuses, " ".join(command)
+                    )
+
+                if not pending:
+                    break
+
+            for lsfID, jobID in pending.items():
+                logger.debug("Can't determine status for job: %s", lsfID)
+                statuses[jobID] = None
+
+            return statuses
+
+        def _applyRecords(self, records, lsfIDs, pending, statuses, source):
+            """Move the `pending` jobs with a final status to `statuses`."""
+            for lsfID in lsfIDs:
+                if lsfID not in records:
+                    continue
+
+                status = self._processRecord(
+                    records[lsfID], pending[lsfID], f"{source} {lsfID}"
+                )
 
                 if status != self._CANT_DETERMINE_JOB_STATUS:
-                    return status
+                    statuses[pending.pop(lsfID)] = status
 
-            logger.debug("Can't determine status for job: %s", lsfID)
-            return None
+        def _readAccounting(self, lsfIDs):
+            """
+            Get the accounting records of `lsfIDs` from the lsb.acct reader.
 
-        def _processStatusCommandLSF(self, command, jobID):
-            output = subprocess.check_output(command).decode("utf-8")
-            cmdstr = " ".join(command)
+            New records of the worker's running jobs are kept until asked for,
+            as LSF may write them before `bjobs` stops reporting the job.
+            """
+            running = {self.getBatchSystemID(i) for i in list(self.runningJobs)}
 
-            if "Done successfully" in output:
-                logger.debug("Detected completed job: %s", cmdstr)
-                status = 0
+            for lsfID, record in self._accounting.read().items():
+                if lsfID in running:
+                    self._accountingRecords[lsfID] = record
 
-            elif "Completed <done>" in output:
+            return {
+                i: self._accountingRecords.pop(i)
+                for i in lsfIDs
+                if i in self._accountingRecords
+            }
+
+        def _processRecord(self, record, jobID, cmdstr):
+            """Get the Toil exit status of a job from its `LSFJobRecord`."""
+            if self.boss.lifecycle:
+                self.boss.lifecycle.observe(jobID, record)
+
+            if record.state == "DONE":
                 logger.debug("Detected completed job: %s", cmdstr)
                 status = 0
 
-            elif "TERM_MEMLIMIT" in output:
-                status = self._customRetry(jobID, term_memlimit=True)
+                if self.boss.history and jobID in self.boss.Id2Node:
+                    self.boss.history.record(self.boss.Id2Node[jobID], record)
 
-            elif "TERM_RUNLIMIT" in output:
-                status = self._customRetry(jobID, term_runlimit=True)
+            elif record.exit_reason == "TERM_MEMLIMIT":
+                status = self._customRetry(jobID, record, term_memlimit=True)
 
-            elif "New job is waiting for scheduling" in output:
-                logger.debug("Detected job pending scheduling: %s", cmdstr)
-                status = None
+            elif record.exit_reason == "TERM_RUNLIMIT":
+                status = self._customRetry(jobID, record, term_runlimit=True)
 
-            elif "PENDING REASONS" in output:
+            elif record.state == "PEND":
                 logger.debug("Detected pending job: %s", cmdstr)
                 status = None
 
-            elif "Started on " in output:
+            elif record.state == "RUN":
                 logger.debug("Detected job started but not completed: %s", cmdstr)
                 status = None
 
-            elif "Completed <exit>" in output:
+            elif record.state == "EXIT":
                 logger.error("Detected failed job: %s", cmdstr)
                 status = 1
 
-            elif "Exited with exit code" in output:
-                logger.error("Detected failed job: %s", cmdstr)
-                status = 1
+            elif record.state in STUCK_STATES:
+                # reclaimed by _reclaimStuckJobs if it stays there
+                logger.debug("Detected job in state %s: %s", record.state, cmdstr)
+                status = None
 
             else:
                 status = self._CANT_DETERMINE_JOB_STATUS
 
             return status
 
-        def _customRetry(self, jobID, term_memlimit=False, term_runlimit=False):
-            """Retry job if killed by LSF due to runtime or memlimit problems."""
+        def _customRetry(
+            self, jobID, record=None, term_memlimit=False, term_runlimit=False
+        ):
+            """
+            Retry job if killed by LSF due to runtime or memlimit problems.
+
+            The limit is escalated from the job's observed peak memory or run
+            time, up to `RETRY_STEPS` times and capped at `MAX_MEMORY` or
+            `MAX_RUNTIME`.
+
+            Arguments:
+                jobID (int): Toil ID of the killed job.
+                record (LSFJobRecord): status of the killed job, if available.
+                term_memlimit (bool): the job was killed by TERM_MEMLIMIT.
+                term_runlimit (bool): the job was killed by TERM_RUNLIMIT.
+
+            Returns:
+                int: 1 if the job can't be retried, None if it was resubmitted.
+            """
             try:
                 jobNode = self.boss.Id2Node[jobID]
             except KeyError:
                 logger.error("Can't resource retry %s, jobNode not found", jobID)
                 return 1
 
-            retry_type = "memlimit" if term_memlimit else "runlimit"
-            jobNode.jobName = (jobNode.jobName or "") + " resource retry " + retry_type
-            memory = MAX_MEMORY if term_memlimit else jobNode.memory
-            runtime = MAX_RUNTIME if term_runlimit else None
-            bsub_line = self.prepareBsub(jobNode.cores, memory, jobID, runtime)
-
-            if retry_type not in self.boss.resourceRetryCount[jobID]:
-                lsfID = self.submitJob((bsub_line + [jobNode.command], None))
-                self.batchJobIDs[jobID] = (lsfID, None)
-                self.boss.resourceRetryCount[jobID].add(retry_type)
-                logger.info("Detected job killed by LSF, attempting retry: %s", lsfID)
+            memory, runtime = jobNode.memory, jobNode.runtime
+
+            if term_memlimit:
+                retry_type, retries = "memlimit", jobNode.memory_retries
+                observed = record.max_mem if record else None
+                memory = escalate_resource(memory, observed, MAX_MEMORY)
+                escalated = memory
+            elif term_runlimit:
+                retry_type, retries = "runlimit", jobNode.runtime_retries
+                observed = record.run_time if record else None
+                observed = -(-observed // 60) if observed else None  # minutes
+                runtime = escalate_resource(runtime, observed, MAX_RUNTIME)
+                runtime = int(runtime) if runtime else None
+                escalated = runtime
             else:
-                logger.error("Can't retry for %s twice: %s", retry_type, jobID)
+                logger.error("Can't resource retry %s without a limit reason", jobID)
                 return 1
 
+            if retries >= RETRY_STEPS or not escalated:
+                logger.error("Can't retry %s for %s again", retry_type, jobID)
+                return 1
+
+            if term_memlimit:
+                jobNode.memory_retries += 1
+                jobNode.memory = memory
+            else:
+                jobNode.runtime_retries += 1
+                jobNode.runtime = runtime
+
+            jobNode.jobName = (jobNode.jobName or "") + " resource retry " + retry_type
+            lsfID = self._resubmitJob(jobID, jobNode)
+            logger.info(
+                "Detected job killed by LSF, retrying with %s %s: %s",
+                retry_type,
+                escalated,
+                lsfID,
+            )
+
             return None
 
-        @staticmethod
-        def _getNotFinishedIDs():
-            return {
-                int(i)
-                for i in subprocess.check_output(["bjobs", "-o", "id"])
-                .decode("utf-8")
-                .strip()
-                .split("\n")[1:]
-            }
+        def _resubmitJob(self, jobID, jobNode):
+            """Submit a job again with the resources of its `jobNode`."""
+            bsub_line = self.prepareBsub(
+                jobNode.cores, jobNode.memory, jobID, jobNode.runtime
+            )
+            command = self._wrapCommand(jobID, jobNode.command)
+            lsfID = self.submitJob((bsub_line + [command], None))
+            self.batchJobIDs[jobID] = (lsfID, None)
+
+            if self.boss.lifecycle:
+                self.boss.lifecycle.submitted(jobID, lsfID)
+
+            return lsfID
+
+        def _getNotFinishedIDs(self):
+            command = ["bjobs", "-noheader", "-o", "jobid jobindex"]
+
+            if self.boss.jobGroup:
+                command += ["-g", self.boss.jobGroup]
+
+            try:
+                output = self._callLSF(command, check=True)
+            except subprocess.CalledProcessError as error:
+                stderr = (error.stderr or "").lower()
+
+                # some lsf versions fail when no jobs are left, and lsf may
+                # clean up the job group once all its jobs are done
+                if "no unfinished job found" in stderr or (
+                    self.boss.jobGroup and "group" in stderr
+                ):
+                    return set()
+                raise
+
+            return {get_lsf_id(*i.split()) for i in output.strip().split("\n") if i}
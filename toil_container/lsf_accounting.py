@@ -0,0 +1,171 @@
+"""
+Incremental reader of the LSF accounting file, `lsb.acct`.
+
+LSF appends a JOB_FINISH record to `lsb.acct` when a job finishes. Instead of
+calling `bacct`, which rescans the whole file, the reader keeps the byte
+offset it has read up to and only parses the records appended since. The
+offset is saved to a state file, so that a restarted leader resumes where
+it stopped, and rotations of the file to `lsb.acct.1` are followed.
+"""
+
+import json
+import os
+import re
+
+from toil.batchSystems.lsf import logger
+
+from toil_container.lsf_output import LSFJobRecord
+from toil_container.lsf_output import get_lsf_id
+
+# path to lsb.acct or a copy of it, bacct is used if not set
+ACCT_FILE = os.getenv("TOIL_CONTAINER_LSF_ACCT_FILE")
+
+# path to the reader's saved offset, default is in the toil work directory
+ACCT_STATE = os.getenv("TOIL_CONTAINER_LSF_ACCT_STATE")
+
+_FIELD = re.compile(r'"((?:[^"]|"")*)"|(\S+)')
+
+# JOB_FINISH jStatus values
+_JOB_STAT_EXIT = 32
+_JOB_STAT_DONE = 64
+
+# exitInfo values of the termination reasons handled by the batch system
+_TERM_REASONS = {5: "TERM_RUNLIMIT", 14: "TERM_OWNER", 16: "TERM_MEMLIMIT"}
+
+# number of rusage fields after the job's command
+_RUSAGE_FIELDS = 19
+
+
+def parse_acct_line(line):
+    """
+    Parse a JOB_FINISH record of `lsb.acct`.
+
+    Arguments:
+        line (str): a line of the accounting file.
+
+    Returns:
+        LSFJobRecord: the job's record, None if it's not a JOB_FINISH record.
+    """
+    fields = [
+        plain or quoted.replace('""', '"') for quoted, plain in _FIELD.findall(line)
+    ]
+
+    if not fields or fields[0] != "JOB_FINISH":
+        return None
+
+    submit, start, end = int(fields[7]), int(fields[10]), int(fields[9])
+    i = 23 + int(fields[22])  # skip the asked hosts
+    i += 1 + int(fields[i])  # and the execution hosts
+    status = int(fields[i])
+    i += 4  # jStatus, hostFactor, jobName and command
+    cpu_time = float(fields[i]) + float(fields[i + 1])
+    i += _RUSAGE_FIELDS + 2  # mailUser and projectName
+    exit_status, index, max_mem = int(fields[i]), fields[i + 4], fields[i + 5]
+    exit_info = int(fields[i + 13]) if len(fields) > i + 13 else 0
+
+    return LSFJobRecord(
+        lsfID=get_lsf_id(fields[3], index),
+        state={_JOB_STAT_DONE: "DONE", _JOB_STAT_EXIT: "EXIT"}.get(status),
+        exit_code=exit_status >> 8 if exit_status > 255 else exit_status,
+        exit_reason=_TERM_REASONS.get(exit_info),
+        max_mem=int(max_mem) * 1024 if int(max_mem) > 0 else None,
+        run_time=max(end - start, 0) if start else None,
+        pend_time=max((start or end) - submit, 0),
+        cpu_time=cpu_time,
+    )
+
+
+class AccountingReader:
+
+    """
+    Tail `lsb.acct`, parsing only the records appended since the last read.
+
+    The state file keeps the inode and byte offset read up to. If the file's
+    inode changed, the rest of the rotated file, `<path>.1`, is read before
+    starting the new file from its beginning. Without a state file, reading
+    starts at the end of the file, as earlier records are from other runs.
+    """
+
+    def __init__(self, path, state_path):
+        """
+        Load the saved offset, if any.
+
+        Arguments:
+            path (str): path to the accounting file.
+            state_path (str): path to the saved offset.
+        """
+        self.path = path
+        self.state_path = state_path
+        self.inode = None
+        self.offset = None
+
+        if os.path.isfile(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+                self.inode, self.offset = state["inode"], state["offset"]
+
+    def _save(self):
+        tmp = self.state_path + ".tmp"
+
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"inode": self.inode, "offset": self.offset}, f)
+
+        os.replace(tmp, self.state_path)
+
+    def _read_from(self, path, offset):
+        """Parse the complete lines of `path` after `offset`."""
+        records = {}
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        # a partially written record is read again next time
+        end = data.rfind(b"\n") + 1
+
+        for line in data[:end].decode("utf-8", "replace").splitlines():
+            try:
+                record = parse_acct_line(line)
+            except (IndexError, ValueError):
+                logger.warning("Ignoring malformed lsb.acct record: %s", line[:100])
+                continue
+
+            if record:
+                records[record.lsfID] = record
+
+        return records, offset + end
+
+    def read(self):
+        """
+        Get the records of the jobs that finished since the last read.
+
+        Returns:
+            dict: a mapping of LSF job IDs to `LSFJobRecord`.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            logger.warning("LSF accounting file not found: %s", self.path)
+            return {}
+
+        records = {}
+
+        if self.offset is None:
+            self.offset = stat.st_size
+        elif self.inode != stat.st_ino:
+            rotated = self.path + ".1"
+
+            if os.path.isfile(rotated) and os.stat(rotated).st_ino == self.inode:
+                records, _ = self._read_from(rotated, self.offset)
+
+            logger.debug("LSF accounting file was rotated: %s", self.path)
+            self.offset = 0
+        elif stat.st_size < self.offset:
+            logger.debug("LSF accounting file was truncated: %s", self.path)
+            self.offset = 0
+
+        self.inode = stat.st_ino
+        new, self.offset = self._read_from(self.path, self.offset)
+        records.update(new)
+        self._save()
+        return records
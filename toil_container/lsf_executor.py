@@ -0,0 +1,138 @@
+"""
+Submit LSF jobs from a thread pool, backing off when LSF is full.
+
+Submitting from several threads hides the latency of `bsub`, which can take
+seconds on a busy cluster, while the pending job limits of LSF are honored by
+halving the number of concurrent submissions whenever they are hit.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import os
+import re
+import time
+
+from toil.batchSystems.lsf import logger
+
+from toil_container.exceptions import PendingLimitError
+
+try:
+    SUBMIT_THREADS = int(os.getenv("TOIL_CONTAINER_LSF_SUBMIT_THREADS", "1"))
+    BACKPRESSURE_WAIT = float(os.getenv("TOIL_CONTAINER_LSF_BACKPRESSURE_WAIT", "60"))
+except ValueError:  # pragma: no cover
+    SUBMIT_THREADS = 1
+    BACKPRESSURE_WAIT = 60.0
+    logger.error("Failed to parse default values for concurrent submission.")
+
+# bsub errors when the user, queue or job group pending job limit is reached
+PENDING_LIMIT_ERRORS = re.compile(r"pending job (?:threshold|limit)", re.I)
+
+
+class SubmissionExecutor:
+
+    """
+    Run up to `threads` submissions at once, backing off when LSF is full.
+
+    Submissions run on a thread pool and their results are collected by the
+    caller's thread. When a submission fails with `PendingLimitError`, the
+    number of concurrent submissions is halved and new ones are paused for
+    `backoff` seconds, then it grows back by one per successful submission.
+    The throughput is measured over the time submissions were in flight.
+    """
+
+    def __init__(self, threads=None, backoff=None):
+        """
+        Start the thread pool.
+
+        Arguments:
+            threads (int): maximum concurrent submissions, default is
+                SUBMIT_THREADS.
+            backoff (float): seconds to pause submissions when LSF reports its
+                pending job limit, default is BACKPRESSURE_WAIT.
+        """
+        self.threads = max(SUBMIT_THREADS if threads is None else threads, 1)
+        self.backoff = BACKPRESSURE_WAIT if backoff is None else backoff
+        self.limit = self.threads
+        self.paused_until = None
+        self.inflight = {}
+        self.submitted = 0
+        self.rejected = 0
+        self._busy = 0.0
+        self._busy_since = None
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="bsub")
+
+    def capacity(self):
+        """Get the number of submissions that can be started now."""
+        if self.paused_until is not None:
+            if time.monotonic() < self.paused_until:
+                return 0
+
+            self.paused_until = None
+
+        return max(self.limit - len(self.inflight), 0)
+
+    def submit(self, key, operation, *args, **kwargs):
+        """Start `operation` in the pool, its result is collected with `key`."""
+        if not self.inflight:
+            self._busy_since = time.monotonic()
+
+        self.inflight[self._pool.submit(operation, *args, **kwargs)] = key
+
+    def collect(self, block=False):
+        """
+        Get the results of the finished submissions.
+
+        Arguments:
+            block (bool): wait for all submissions in flight to finish.
+
+        Returns:
+            list: `(key, result)` tuples, where the result is the exception
+                raised by the operation if it failed.
+        """
+        if block:
+            wait(self.inflight)
+
+        results = []
+        throttled = False
+
+        for future in [i for i in self.inflight if i.done()]:
+            key = self.inflight.pop(future)
+            error = future.exception()
+
+            if isinstance(error, PendingLimitError):
+                throttled = True
+                self.rejected += 1
+                self.limit = max(self.limit // 2, 1)
+                self.paused_until = time.monotonic() + self.backoff
+            elif error is None:
+                self.submitted += 1
+                self.limit = min(self.limit + 1, self.threads)
+
+            results.append((key, error or future.result()))
+
+        if self._busy_since is not None and not self.inflight:
+            self._busy += time.monotonic() - self._busy_since
+            self._busy_since = None
+
+        if throttled:
+            logger.warning(
+                "LSF pending job limit reached, pausing submissions for %ds "
+                "with up to %d concurrent bsub calls.",
+                self.backoff,
+                self.limit,
+            )
+
+        return results
+
+    def throughput(self):
+        """Get the submitted jobs per second of submission time."""
+        busy = self._busy
+
+        if self._busy_since is not None:
+            busy += time.monotonic() - self._busy_since
+
+        return self.submitted / busy if busy else 0.0
+
+    def shutdown(self):
+        """Wait for the submissions in flight and stop the thread pool."""
+        self._pool.shutdown(wait=True)
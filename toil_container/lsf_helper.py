@@ -3,21 +3,58 @@ Adapted from toil.batchSystems.lsfHelper.
 
 https://github.com/DataBiosphere/toil/blob/master/src/toil/batchSystems/lsfHelper.py.
 """
+
+from collections import namedtuple
+from functools import lru_cache
 import base64
 import json
 import os
-import random
+import re
+import shlex
 import subprocess
 import time
 
+from slugify import slugify
 from toil.lib.conversions import convert_units
 from toil.batchSystems.lsf import logger
+from toil.batchSystems.lsfHelper import LSB_PARAMS_FILENAME
+from toil.batchSystems.lsfHelper import apply_conf_file
 from toil.batchSystems.lsfHelper import per_core_reservation
+from toil.batchSystems.lsfHelper import per_core_reserve_from_stream
 
+from toil_container.exceptions import ValidationError
+from toil_container.lsf_queues import parse_queues
+from toil_container.lsf_queues import route_queue
 
 _RESOURCES_START_TAG = "__rsrc"
 _RESOURCES_CLOSE_TAG = "rsrc__"
 
+# maximum number of job IDs passed to a single bjobs, bacct or bhist call
+STATUS_QUERY_CHUNK = 500
+
+ResourceSpec = namedtuple(
+    "ResourceSpec",
+    ["runtime", "queue", "host_type", "exclusive"],
+    defaults=[None, None, None, False],
+)
+
+ResourceSpec.__doc__ = """
+Custom LSF resources of a job, encoded in its `unitName`.
+
+Attributes:
+    runtime (int): estimated run time in minutes, None if not set.
+    queue (str): LSF queue, routed by `TOIL_CONTAINER_LSF_QUEUES` if not set.
+    host_type (str): LSF host type to select, None for any.
+    exclusive (bool): True to run the job exclusively on its host.
+"""
+
+# single letter keys of the compact resources encoding
+_SPEC_KEYS = {"runtime": "W", "queue": "q", "host_type": "H", "exclusive": "X"}
+_SPEC_NAMES = {v: k for k, v in _SPEC_KEYS.items()}
+_SPEC_VALUE = re.compile(r"^[A-Za-z0-9_-]+$")
+_EMPTY_SPEC = ResourceSpec()
+_SPEC_COMPACT = re.compile(r"^[WqHX][A-Za-z0-9_-]*(?:\.[WqHX][A-Za-z0-9_-]*)*$")
+
 try:
     MAX_MEMORY = int(os.getenv("TOIL_CONTAINER_RETRY_MEM", "60")) * 1e9
     MAX_RUNTIME = int(os.getenv("TOIL_CONTAINER_RETRY_RUNTIME", "40000"))
@@ -26,6 +63,151 @@ except ValueError:  # pragma: no cover
     MAX_RUNTIME = 40000
     logger.error("Failed to parse default values for resource retry.")
 
+try:
+    RETRY_FACTOR = float(os.getenv("TOIL_CONTAINER_RETRY_FACTOR", "1.5"))
+    RETRY_STEPS = int(os.getenv("TOIL_CONTAINER_RETRY_STEPS", "3"))
+except ValueError:  # pragma: no cover
+    RETRY_FACTOR = 1.5
+    RETRY_STEPS = 3
+    logger.error("Failed to parse default values for resource escalation.")
+
+try:
+    EXTEND_AT = float(os.getenv("TOIL_CONTAINER_LSF_EXTEND_AT", "0"))
+    EXTEND_STEPS = int(os.getenv("TOIL_CONTAINER_LSF_EXTEND_STEPS", "2"))
+    EXTEND_INTERVAL = float(os.getenv("TOIL_CONTAINER_LSF_EXTEND_INTERVAL", "300"))
+except ValueError:  # pragma: no cover
+    EXTEND_AT = 0.0
+    EXTEND_STEPS = 2
+    EXTEND_INTERVAL = 300.0
+    logger.error("Failed to parse default values for run limit extensions.")
+
+# unfinished states of jobs that may never progress, e.g. when a host dies
+STUCK_STATES = ("UNKWN", "ZOMBI", "PSUSP", "SSUSP", "USUSP")
+
+# "requeue" jobs stuck for STUCK_AFTER seconds with brequeue, "resubmit" to
+# kill and submit them again, "none" to only detect them, jobs may be suspended
+# on purpose by users or admins so reclaiming them is opt-in
+STUCK_POLICY = os.getenv("TOIL_CONTAINER_LSF_STUCK_POLICY", "none")
+
+try:
+    STUCK_AFTER = float(os.getenv("TOIL_CONTAINER_LSF_STUCK_AFTER", "3600"))
+    STUCK_RETRIES = int(os.getenv("TOIL_CONTAINER_LSF_STUCK_RETRIES", "2"))
+    STUCK_INTERVAL = float(os.getenv("TOIL_CONTAINER_LSF_STUCK_INTERVAL", "300"))
+except ValueError:  # pragma: no cover
+    STUCK_AFTER = 3600.0
+    STUCK_RETRIES = 2
+    STUCK_INTERVAL = 300.0
+    logger.error("Failed to parse default values for stuck jobs.")
+
+# "single" submits one bsub per job, "array" coalesces identical jobs in arrays
+# and "pack" submits batches of jobs with a single `bsub -pack` call, "pilot"
+# runs short jobs in pilot jobs, see `toil_container.lsf_pilot`
+SUBMIT_MODE = os.getenv("TOIL_CONTAINER_LSF_SUBMIT_MODE", "single")
+
+try:
+    FLUSH_INTERVAL = float(os.getenv("TOIL_CONTAINER_LSF_FLUSH_INTERVAL", "5"))
+    BATCH_SIZE = int(os.getenv("TOIL_CONTAINER_LSF_BATCH_SIZE", "1000"))
+except ValueError:  # pragma: no cover
+    FLUSH_INTERVAL = 5.0
+    BATCH_SIZE = 1000
+    logger.error("Failed to parse default values for batch submission.")
+
+# poll LSF from a background thread that keeps a snapshot of job states
+BACKGROUND_POLL = os.getenv("TOIL_CONTAINER_LSF_BACKGROUND_POLL", "N") == "Y"
+
+# the floor stops polls from being more frequent than it, by default a quarter
+# of toil's statePollingWait, and the ceiling stops them from being less
+# frequent than it, by default four times statePollingWait
+try:
+    POLL_FLOOR = os.getenv("TOIL_CONTAINER_LSF_POLL_FLOOR")
+    POLL_FLOOR = float(POLL_FLOOR) if POLL_FLOOR else None
+    POLL_CEILING = os.getenv("TOIL_CONTAINER_LSF_POLL_CEILING")
+    POLL_CEILING = float(POLL_CEILING) if POLL_CEILING else None
+except ValueError:  # pragma: no cover
+    POLL_FLOOR = None
+    POLL_CEILING = None
+    logger.error("Failed to parse default values for status polling.")
+
+
+class AdaptivePoller:
+
+    """
+    A status polling interval that adapts to how fast jobs are finishing.
+
+    The interval is halved when jobs finished since the last poll, doubled
+    when the scheduler was slow to answer and grown by half when the running
+    set didn't change. It always stays within `floor` and `ceiling`, and a
+    monotonic clock is used so that wall clock changes don't affect it.
+    """
+
+    def __init__(self, initial, floor=None, ceiling=None):
+        """
+        Set the initial interval and its limits.
+
+        Arguments:
+            initial (float): initial interval in seconds.
+            floor (float): minimum interval, default is POLL_FLOOR if set,
+                else a quarter of `initial`.
+            ceiling (float): maximum interval, default is POLL_CEILING if
+                set, else four times `initial`.
+        """
+        if floor is None:
+            floor = (initial or 0) / 4 if POLL_FLOOR is None else POLL_FLOOR
+
+        if ceiling is None:
+            ceiling = (initial or 0) * 4 if POLL_CEILING is None else POLL_CEILING
+
+        self.floor = floor
+        self.ceiling = max(self.floor, ceiling)
+        self.interval = self._clamp(initial or self.floor)
+        self.last = None
+
+    def _clamp(self, interval):
+        return min(max(interval, self.floor), self.ceiling)
+
+    def due(self):
+        """Return True if it's time to poll the scheduler again."""
+        return self.last is None or time.monotonic() - self.last >= self.interval
+
+    def update(self, finished, running, latency):
+        """
+        Record a poll and adapt the interval for the next one.
+
+        Arguments:
+            finished (int): number of jobs that finished since the last poll.
+            running (int): number of jobs running when polling.
+            latency (float): seconds the scheduler took to answer.
+
+        Returns:
+            float: the new interval in seconds.
+        """
+        self.last = time.monotonic()
+
+        if latency > self.interval / 2:
+            factor = 2.0
+            reason = f"scheduler took {latency:.1f}s to answer"
+        elif finished:
+            factor = 0.5
+            reason = f"{finished} of {running} jobs finished"
+        else:
+            factor = 1.5
+            reason = f"none of {running} jobs finished"
+
+        interval = self._clamp(self.interval * factor)
+
+        if interval != self.interval:
+            logger.info(
+                "Changing status polling interval from %.1fs to %.1fs, %s.",
+                self.interval,
+                interval,
+                reason,
+            )
+        else:
+            logger.debug("Status polling interval is %.1fs, %s.", interval, reason)
+
+        self.interval = interval
+        return interval
+
 
 def _parse_memory(mem: float) -> str:
     """Parse memory parameter."""
@@ -41,50 +223,398 @@ def _parse_memory(mem: float) -> str:
     return f"{megabytes_of_mem:.0f}MB"
 
 
-def encode_dict(dictionary):
-    """Encode `dictionary` in string."""
-    if dictionary:
-        return (
-            f"{_RESOURCES_START_TAG}"
-            f"{base64.b64encode(json.dumps(dictionary).encode()).decode()}"
-            f"{_RESOURCES_CLOSE_TAG}"
+class LSFJob:
+
+    """
+    Compact bookkeeping of what's needed to (re)submit a job to LSF.
+
+    Only the fields used by `prepareBsub` and `_customRetry` are kept, so
+    that the leader doesn't hold full `JobDescription`s for every issued job.
+    """
+
+    __slots__ = (
+        "cores",
+        "memory",
+        "runtime",
+        "jobName",
+        "command",
+        "memory_retries",
+        "runtime_retries",
+        "runtime_extensions",
+        "stuck_retries",
+        "job_type",
+        "size_bucket",
+        "declared",
+        "spec",
+    )
+
+    def __init__(self, cores, memory, runtime, jobName, command, disk=None, spec=None):
+        """
+        Store the job's resources.
+
+        Arguments:
+            cores (float): number of cores needed.
+            memory (float): number of bytes of memory needed.
+            runtime (int): decoded runtime in minutes, None if not set.
+            jobName (str): the job name.
+            command (str): the job command.
+            disk (float): number of bytes of disk needed, used as input size.
+            spec (ResourceSpec): the job's custom LSF resources.
+        """
+        self.cores = cores
+        self.memory = memory
+        self.runtime = runtime
+        self.jobName = jobName
+        self.command = command
+        self.memory_retries = 0
+        self.runtime_retries = 0
+        self.runtime_extensions = 0
+        self.stuck_retries = 0
+        self.job_type = get_job_type(jobName)
+        self.size_bucket = get_size_bucket(disk)
+        self.declared = None  # (memory, runtime) if resized from history
+        self.spec = spec or _EMPTY_SPEC
+
+    @classmethod
+    def from_job_description(cls, job_desc):
+        """Get the `LSFJob` of a `toil.job.JobDescription`."""
+        spec = decode_resources(job_desc.unitName)
+
+        return cls(
+            cores=job_desc.cores,
+            memory=job_desc.memory,
+            runtime=spec.runtime,
+            jobName=job_desc.jobName,
+            command=job_desc.command,
+            disk=job_desc.disk,
+            spec=spec,
         )
+
+
+def get_job_type(jobName):
+    """Get a slug of a job name that is stable across runs, e.g. `call_variants`."""
+    return slugify(jobName or "", separator="_") or "unnamed"
+
+
+def get_size_bucket(size):
+    """Get the power of two bucket of a size in bytes, 0 if not set."""
+    return int(size).bit_length() - 1 if size and size >= 1 else 0
+
+
+def escalate_resource(current, observed, limit):
+    """
+    Get the next step of a resource retry, based on the observed usage.
+
+    The larger of the requested and observed usage is multiplied by
+    `RETRY_FACTOR`, and capped at `limit`. When neither is known, the job
+    jumps straight to `limit`.
+
+    Arguments:
+        current (float): requested amount, None if not set.
+        observed (float): amount used by the killed job, None if unknown.
+        limit (float): maximum amount to request.
+
+    Returns:
+        float: the amount to request, None if `limit` was already requested.
+    """
+    if current and current >= limit:
+        return None
+
+    base = max(current or 0, observed or 0)
+    return min(base * RETRY_FACTOR, limit) if base else limit
+
+
+def validate_resources(resources):
+    """
+    Validate the custom LSF resources of a job.
+
+    Arguments:
+        resources (dict): any of the `ResourceSpec` fields.
+
+    Returns:
+        ResourceSpec: the validated resources.
+
+    Raises:
+        toil_container.ValidationError: if a key or a value is not valid.
+    """
+    unknown = set(resources) - set(ResourceSpec._fields)
+
+    if unknown:
+        raise ValidationError(f"Unknown LSF resources: {sorted(unknown)}")
+
+    runtime = resources.get("runtime")
+
+    if runtime is not None:
+        try:
+            runtime = int(runtime)
+        except (TypeError, ValueError):
+            runtime = 0
+
+        if runtime <= 0:
+            raise ValidationError(f"Invalid LSF runtime: {resources['runtime']!r}")
+
+    for key in ("queue", "host_type"):
+        value = resources.get(key)
+
+        if value is not None and not _SPEC_VALUE.match(str(value)):
+            raise ValidationError(f"Invalid LSF {key}: {value!r}")
+
+    return ResourceSpec(
+        runtime=runtime,
+        queue=resources.get("queue"),
+        host_type=resources.get("host_type"),
+        exclusive=bool(resources.get("exclusive")),
+    )
+
+
+def encode_dict(dictionary):
+    """
+    Encode custom LSF resources in a compact string.
+
+    Each resource is a `ResourceSpec` key letter followed by its value, e.g.
+    `__rsrcW60.qshort.Xrsrc__` for a 60 minutes exclusive job in `short`.
+
+    Raises:
+        toil_container.ValidationError: if a resource is not valid.
+    """
+    spec = validate_resources(dictionary or {})
+    fields = []
+
+    for name, value in spec._asdict().items():
+        if value is True:
+            fields.append(_SPEC_KEYS[name])
+        elif value:
+            fields.append(f"{_SPEC_KEYS[name]}{value}")
+
+    if fields:
+        return f"{_RESOURCES_START_TAG}{'.'.join(fields)}{_RESOURCES_CLOSE_TAG}"
     return ""
 
 
-def decode_dict(string):
-    """Get dictionary encoded in `string` by `encode_dict`."""
+def _resources_field(string):
+    """Get the resources encoded in a `unitName`, None if there are none."""
     if isinstance(string, str):
         split = string.split(_RESOURCES_START_TAG, 1)[-1]
         split = split.split(_RESOURCES_CLOSE_TAG, 1)
+
         if len(split) == 2:
-            return json.loads(base64.b64decode(split[0]))
-    return {}
+            return split[0]
+    return None
+
+
+def _decode_field(field):
+    """Decode the compact or base64 JSON resources of `_resources_field`."""
+    if not _SPEC_COMPACT.match(field):
+        return json.loads(base64.b64decode(field))
+
+    resources = {}
+
+    for i in field.split("."):
+        name, value = _SPEC_NAMES[i[0]], i[1:]
+        resources[name] = int(value) if name == "runtime" else value or True
+
+    return resources
+
+
+def decode_dict(string):
+    """
+    Get the resources encoded in `string` by `encode_dict`.
+
+    Resources encoded as base64 JSON by earlier versions are decoded too.
+    """
+    field = _resources_field(string)
+    return {} if field is None else _decode_field(field)
+
+
+@lru_cache(maxsize=4096)
+def _decode_spec(field):
+    """Get the `ResourceSpec` of an encoded field, memoized per field."""
+    try:
+        return validate_resources(_decode_field(field))
+    except (ValidationError, ValueError) as error:
+        logger.error("Ignoring invalid LSF resources %r: %s", field, error)
+        return _EMPTY_SPEC
+
+
+def decode_resources(string):
+    """
+    Get the `ResourceSpec` encoded in `string`, empty if not valid.
+
+    Jobs of the same kind share their encoded resources, so specs are kept
+    in a bounded LRU cache keyed by the encoded field and shared between
+    the jobs' `LSFJob` records.
+    """
+    field = _resources_field(string)
+    return _EMPTY_SPEC if field is None else _decode_spec(field)
+
+
+def get_job_group(workflow_id):
+    """
+    Get the LSF job group used for the jobs of a workflow.
+
+    Arguments:
+        workflow_id (str): the toil workflow ID.
+
+    Returns:
+        str: job group path, None if disabled with TOIL_CONTAINER_LSF_JOB_GROUP=N.
+    """
+    if os.getenv("TOIL_CONTAINER_LSF_JOB_GROUP", "Y") == "N" or not workflow_id:
+        return None
+    return f"/toil/{workflow_id}"
+
+
+def build_pack_line(bsubline, command):
+    """
+    Format a bsub args list and its command as a line of a `bsub -pack` file.
+
+    Arguments:
+        bsubline (list): bsub command as returned by `build_bsub_line`.
+        command (str): the job command.
+
+    Returns:
+        str: the job's options and command, without the leading `bsub`.
+    """
+    # job names are already quoted by build_bsub_line
+    args = [i if i.startswith("'") else shlex.quote(i) for i in bsubline[1:]]
+    return " ".join(args + [command])
+
+
+LSFSettings = namedtuple(
+    "LSFSettings", ["per_core", "runtime_flag", "extra_args", "queues"], defaults=[()]
+)
+
+LSFSettings.__doc__ = """
+Environment and cluster settings used to build bsub lines.
+
+Attributes:
+    per_core (bool): True if memory is reserved per core and not per job.
+    runtime_flag (str): bsub flag used to pass the runtime, e.g. `-W`.
+    extra_args (tuple): extra bsub arguments from `TOIL_LSF_ARGS`.
+    queues (tuple): `(queue, max runtime, max memory)` routing thresholds from
+        `TOIL_CONTAINER_LSF_QUEUES`, see `route_queue`.
+"""
+
+
+def get_per_core_reservation(call=None):
+    """
+    Check if LSF reserves resources per core rather than per job.
 
+    As toil's `per_core_reservation`, the setting is read from `bparams`,
+    then `lsadmin` and then `lsb.params`.
 
-def with_retries(operation, *args, **kwargs):
-    """Add a random sleep after each retry."""
-    latest_err = Exception
+    Arguments:
+        call (callable): runs an LSF command and returns its stdout, raising
+            `CalledProcessError` if it fails. The commands are run directly
+            by toil if not set.
 
-    for i in [2, 3, 5, 10]:
+    Returns:
+        bool: True if resources are reserved per core.
+    """
+    if call is None:
+        return per_core_reservation()
+
+    for command in (["bparams", "-a"], ["lsadmin", "showconf", "lim"]):
         try:
-            return operation(*args, **kwargs)
-        except subprocess.CalledProcessError as err:
-            time.sleep(i + random.uniform(-i, i))
-            latest_err = err
-            logger.error(
-                "Operation %s failed with code %d: %s",
-                operation,
-                err.returncode,
-                err.output,
-            )
-    raise latest_err  # pragma: no cover
+            value = per_core_reserve_from_stream(call(command).splitlines())
+        except (OSError, subprocess.CalledProcessError) as error:
+            logger.debug("Failed to read the LSF configuration: %s", error)
+            value = None
+
+        if value:
+            return value.upper() == "Y"
+
+    value = apply_conf_file(per_core_reserve_from_stream, LSB_PARAMS_FILENAME)
+    return bool(value) and value.upper() == "Y"
+
 
+def get_lsf_settings(call=None):
+    """
+    Resolve the `LSFSettings` from the environment and the LSF configuration.
+
+    The LSF configuration is read with `bparams`, `lsadmin` or `lsb.params`,
+    so the settings should be resolved once and passed to `build_bsub_line`.
 
-def build_bsub_line(cpu, mem, runtime, jobname, stdoutfile=None, stderrfile=None):
+    Arguments:
+        call (callable): runs LSF commands, see `get_per_core_reservation`.
+    """
+    per_core = os.getenv("TOIL_CONTAINER_LSF_PER_CORE")
+
+    try:
+        queues = parse_queues(os.getenv("TOIL_CONTAINER_LSF_QUEUES", ""))
+    except ValueError:
+        queues = ()
+        logger.error("Failed to parse TOIL_CONTAINER_LSF_QUEUES, not routing.")
+
+    return LSFSettings(
+        per_core=(per_core == "Y") or (not per_core and get_per_core_reservation(call)),
+        runtime_flag=os.getenv("TOIL_CONTAINER_RUNTIME_FLAG", "-W"),
+        extra_args=tuple(os.getenv("TOIL_LSF_ARGS", "").split()),
+        queues=queues,
+    )
+
+
+@lru_cache(maxsize=1024)
+def _bsub_resources(cpu, mem, runtime, settings, spec=_EMPTY_SPEC):
+    """Get the resource arguments of a bsub line, memoized per resources."""
+    resources = []
+    extra_args = settings.extra_args
+    cpu = int(cpu) or 1
+
+    if mem:
+        if settings.per_core:
+            mem = mem / cpu
+
+        mem_resource = _parse_memory(mem)
+        mem_limit = _parse_memory(mem)
+
+        resources += ["-R", f"select[mem>{mem_resource}]"]
+        resources += ["-R", f"rusage[mem={mem_resource}]"]
+        resources += ["-M", str(mem_limit)]
+
+    if cpu:
+        resources += ["-n", str(cpu)]
+
+    if runtime:
+        resources += [settings.runtime_flag, str(int(runtime))]
+
+    queue = spec.queue or route_queue(runtime, mem, settings.queues)
+
+    if queue:
+        resources += ["-q", queue]
+
+        # the job's queue replaces the one set in TOIL_LSF_ARGS
+        if "-q" in extra_args[:-1]:
+            i = extra_args.index("-q")
+            extra_args = extra_args[:i] + extra_args[i + 2 :]
+
+    if spec.host_type:
+        resources += ["-R", f"select[type=={spec.host_type}]"]
+
+    if spec.exclusive:
+        resources += ["-x"]
+
+    return tuple(resources) + extra_args
+
+
+def build_bsub_line(
+    cpu,
+    mem,
+    runtime,
+    jobname,
+    stdoutfile=None,
+    stderrfile=None,
+    jobgroup=None,
+    arraysize=None,
+    settings=None,
+    spec=None,
+):
     """
     Build an args list for a bsub submission.
 
+    Only the job specific arguments are built per call, the resource
+    arguments are memoized per resources and settings. Jobs without a queue
+    are routed with the `TOIL_CONTAINER_LSF_QUEUES` thresholds.
+
     Arguments:
         cpu (int): number of cores needed.
         mem (float): number of bytes of memory needed.
@@ -92,6 +622,11 @@ def build_bsub_line(cpu, mem, runtime, jobname, stdoutfile=None, stderrfile=None
         jobname (str): the job name.
         stdoutfile (str): filename to direct job stdout
         stderrfile (str): filename to direct job stderr
+        jobgroup (str): LSF job group to submit the job to.
+        arraysize (int): submit a job array of this size if set.
+        settings (LSFSettings): resolved with `get_lsf_settings` if not set.
+        spec (ResourceSpec): queue, host type and exclusivity of the job, its
+            runtime is taken from `runtime`.
 
     Returns:
         list: bsub command.
@@ -105,30 +640,18 @@ def build_bsub_line(cpu, mem, runtime, jobname, stdoutfile=None, stderrfile=None
         "-e",
         stderrfile or "/dev/null",
         "-J",
-        f"'{jobname}'",
+        f"'{jobname}'[1-{arraysize}]" if arraysize else f"'{jobname}'",
     ]
-    cpu = int(cpu) or 1
-    if mem:
-        per_core = os.getenv("TOIL_CONTAINER_LSF_PER_CORE")
-        if (per_core == "Y") or (not per_core and per_core_reservation()):
-            mem = mem / cpu
-
-        mem_resource = _parse_memory(mem)
-        mem_limit = _parse_memory(mem)
 
-        bsubline += ["-R", f"select[mem>{mem_resource}]"]
-        bsubline += ["-R", f"rusage[mem={mem_resource}]"]
-        bsubline += ["-M", str(mem_limit)]
+    if jobgroup:
+        bsubline += ["-g", jobgroup]
 
-    if cpu:
-        bsubline += ["-n", str(cpu)]
-
-    if runtime:
-        bsubline += [os.getenv("TOIL_CONTAINER_RUNTIME_FLAG", "-W"), str(int(runtime))]
-
-    if os.getenv("TOIL_LSF_ARGS"):
-        bsubline.extend(os.getenv("TOIL_LSF_ARGS").split())
+    bsubline += _bsub_resources(
+        cpu,
+        mem,
+        runtime,
+        settings or get_lsf_settings(),
+        (spec or _EMPTY_SPEC)._replace(runtime=None),
+    )
 
-    # log to lsf
-    logger.info("Submitting to LSF with: %s", " ".join(bsubline))
     return bsubline
@@ -0,0 +1,262 @@
+"""
+Resource usage history of LSF jobs, used to right-size bsub requests.
+
+The peak memory, cpu time and run time of finished jobs are stored in a local
+SQLite database, keyed by the job type (the slugified job name) and the power
+of two bucket of its input size. When sizing is enabled, jobs request a high
+percentile of their history instead of their declared resources.
+"""
+
+from threading import Lock
+import argparse
+import math
+import os
+import sqlite3
+import time
+
+from toil.batchSystems.lsf import logger
+
+from toil_container.lsf_helper import MAX_MEMORY, MAX_RUNTIME
+
+# path to the sqlite database, usage isn't recorded if not set
+HISTORY_PATH = os.getenv("TOIL_CONTAINER_LSF_HISTORY")
+
+# request the history percentile instead of the declared resources
+HISTORY_SIZING = os.getenv("TOIL_CONTAINER_LSF_HISTORY_SIZING", "N") == "Y"
+
+try:
+    HISTORY_PERCENTILE = float(os.getenv("TOIL_CONTAINER_LSF_HISTORY_PERCENTILE", "95"))
+    HISTORY_HEADROOM = float(os.getenv("TOIL_CONTAINER_LSF_HISTORY_HEADROOM", "1.2"))
+    HISTORY_MIN_SAMPLES = int(os.getenv("TOIL_CONTAINER_LSF_HISTORY_MIN_SAMPLES", "5"))
+except ValueError:  # pragma: no cover
+    HISTORY_PERCENTILE = 95.0
+    HISTORY_HEADROOM = 1.2
+    HISTORY_MIN_SAMPLES = 5
+    logger.error("Failed to parse default values for resource history.")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    job_type TEXT NOT NULL,
+    size_bucket INTEGER NOT NULL,
+    max_mem REAL,
+    cpu_time REAL,
+    run_time REAL,
+    requested_mem REAL,
+    requested_runtime REAL,
+    declared_mem REAL,
+    declared_runtime REAL,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_key ON usage (job_type, size_bucket);
+"""
+
+
+def percentile(values, pct):
+    """Get the nearest-rank `pct` percentile of `values`, None if empty."""
+    values = sorted(i for i in values if i is not None)
+
+    if not values:
+        return None
+
+    return values[max(math.ceil(pct / 100 * len(values)), 1) - 1]
+
+
+class ResourceHistory:
+
+    """
+    A SQLite store of the resources used by finished LSF jobs.
+
+    The connection is shared by the leader and the worker thread, so all
+    queries are serialized with a lock. Suggestions are cached per key until
+    a new usage is recorded for it.
+    """
+
+    def __init__(self, path, pct=None, headroom=None, min_samples=None):
+        """
+        Open the database, creating it if needed.
+
+        Arguments:
+            path (str): path to the sqlite database.
+            pct (float): percentile to request, default is HISTORY_PERCENTILE.
+            headroom (float): multiplier of the percentile, default is
+                HISTORY_HEADROOM.
+            min_samples (int): finished jobs needed before resizing a job
+                type, default is HISTORY_MIN_SAMPLES.
+        """
+        self.pct = HISTORY_PERCENTILE if pct is None else pct
+        self.headroom = HISTORY_HEADROOM if headroom is None else headroom
+        self.min_samples = HISTORY_MIN_SAMPLES if min_samples is None else min_samples
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+        self._lock = Lock()
+        self._cache = {}
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self.connection.close()
+
+    def record(self, job_node, record):
+        """
+        Store the usage of a finished job.
+
+        Arguments:
+            job_node (LSFJob): the job's bookkeeping record.
+            record (LSFJobRecord): the job's LSF status.
+        """
+        declared = job_node.declared or (job_node.memory, job_node.runtime)
+        key = (job_node.job_type, job_node.size_bucket)
+
+        with self._lock:
+            self._cache.pop(key, None)
+            self.connection.execute(
+                "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key
+                + (record.max_mem, record.cpu_time, record.run_time)
+                + (job_node.memory, job_node.runtime)
+                + declared
+                + (time.time(),),
+            )
+            self.connection.commit()
+
+    def suggest(self, job_type, size_bucket):
+        """
+        Get the memory and runtime to request for a job type.
+
+        Arguments:
+            job_type (str): slugified job name.
+            size_bucket (int): input size bucket.
+
+        Returns:
+            tuple: bytes of memory and runtime in minutes, each None if there
+                isn't enough history.
+        """
+        key = (job_type, size_bucket)
+
+        with self._lock:
+            if key not in self._cache:
+                rows = self.connection.execute(
+                    "SELECT max_mem, run_time FROM usage "
+                    "WHERE job_type = ? AND size_bucket = ?",
+                    key,
+                ).fetchall()
+
+                memory = runtime = None
+
+                if len(rows) >= self.min_samples:
+                    memory = percentile([i[0] for i in rows], self.pct)
+                    runtime = percentile([i[1] for i in rows], self.pct)
+
+                if memory:
+                    memory = min(memory * self.headroom, MAX_MEMORY)
+
+                if runtime:
+                    runtime = min(math.ceil(runtime * self.headroom / 60), MAX_RUNTIME)
+
+                self._cache[key] = (memory, runtime)
+
+            return self._cache[key]
+
+    def resize(self, job_node):
+        """
+        Replace a job's declared resources with its history suggestion.
+
+        Arguments:
+            job_node (LSFJob): the job's bookkeeping record, updated in place.
+
+        Returns:
+            bool: True if the job was resized.
+        """
+        memory, runtime = self.suggest(job_node.job_type, job_node.size_bucket)
+
+        if not memory and not runtime:
+            return False
+
+        job_node.declared = (job_node.memory, job_node.runtime)
+        job_node.memory = memory or job_node.memory
+        job_node.runtime = runtime or job_node.runtime
+        logger.debug(
+            "Resized %s from %s to %s",
+            job_node.job_type,
+            job_node.declared,
+            (job_node.memory, job_node.runtime),
+        )
+        return True
+
+    def report(self):
+        """
+        Summarize the reservation saved per job type.
+
+        Returns:
+            list: a dict per job type with the number of jobs, the mean
+                declared, requested and used memory in bytes and runtime in
+                minutes, and the total memory (GB hours) and runtime (hours)
+                saved by requesting less than declared.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT job_type, COUNT(*), "
+                "AVG(declared_mem), AVG(requested_mem), AVG(max_mem), "
+                "AVG(declared_runtime), AVG(requested_runtime), AVG(run_time) / 60, "
+                "SUM((declared_mem - requested_mem) * run_time) / 3.6e12, "
+                "SUM(declared_runtime - requested_runtime) / 60 "
+                "FROM usage GROUP BY job_type ORDER BY job_type"
+            ).fetchall()
+
+        keys = [
+            "job_type",
+            "jobs",
+            "declared_mem",
+            "requested_mem",
+            "used_mem",
+            "declared_runtime",
+            "requested_runtime",
+            "used_runtime",
+            "saved_mem_gb_hours",
+            "saved_runtime_hours",
+        ]
+
+        return [dict(zip(keys, i)) for i in rows]
+
+
+def format_report(report):
+    """Format a `ResourceHistory.report` as a tab separated table."""
+    columns = [
+        ("job_type", "job_type", 1),
+        ("jobs", "jobs", 1),
+        ("declared_mem", "declared_gb", 1e9),
+        ("requested_mem", "requested_gb", 1e9),
+        ("used_mem", "used_gb", 1e9),
+        ("saved_mem_gb_hours", "saved_gb_hours", 1),
+        ("saved_runtime_hours", "saved_hours", 1),
+    ]
+    lines = ["\t".join(i[1] for i in columns)]
+
+    for row in report:
+        values = []
+
+        for key, _, scale in columns:
+            value = row[key]
+            values.append(round(value / scale, 2) if scale != 1 and value else value)
+
+        lines.append("\t".join(map(str, values)))
+
+    return "\n".join(lines)
+
+
+def main(args=None):
+    """Print the reservation saved per job type of a resource history."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("path", nargs="?", default=HISTORY_PATH)
+    args = parser.parse_args(args)
+
+    if not args.path:
+        parser.error("pass a path or set TOIL_CONTAINER_LSF_HISTORY")
+
+    history = ResourceHistory(args.path)
+    print(format_report(history.report()))
+    history.close()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,288 @@
+"""
+Lifecycle timestamps of the jobs run by the custom LSF batch system.
+
+The time each job is issued by the leader, returned by `bsub`, first seen in
+LSF, started, finished and resolved is recorded as it goes through the batch
+system. When LSF reports the job's pending and run times, its start and end
+are derived from them instead of from when the leader happened to poll.
+
+At shutdown, the timestamps are exported as a Chrome trace, which can be
+opened in Perfetto or `chrome://tracing`, and as a per-job CSV. The summary
+gives percentiles of the pending time and of the scheduling overhead, the
+time a job spent in the workflow without running, per job type.
+"""
+
+from threading import Lock
+import argparse
+import csv
+import json
+import os
+import time
+
+from toil.batchSystems.lsf import logger
+
+from toil_container.lsf_history import percentile
+
+# prefix of the exported `<prefix>.json` trace and `<prefix>.csv` table
+LIFECYCLE_PATH = os.getenv("TOIL_CONTAINER_LSF_LIFECYCLE")
+
+EVENTS = ["issued", "submitted", "pending", "started", "finished", "resolved"]
+
+COLUMNS = ["job_id", "job_type", "lsf_id", "attempts", "exit_status"] + EVENTS
+
+# trace spans as (name, first event, last event)
+_SPANS = [
+    ("submit", "issued", "submitted"),
+    ("pending", "submitted", "started"),
+    ("running", "started", "finished"),
+    ("resolve", "finished", "resolved"),
+]
+
+_PERCENTILES = [50, 90, 99]
+
+
+def _duration(row, first, last):
+    if row.get(first) is None or row.get(last) is None:
+        return None
+
+    return max(row[last] - row[first], 0)
+
+
+def summarize(rows):
+    """
+    Get percentiles of the pending time and scheduling overhead per job type.
+
+    The overhead is the time from issue to resolution that the job didn't
+    spend running: submission, pending, dispatch and status polling.
+
+    Arguments:
+        rows (list): a dict of `COLUMNS` per job, times in epoch seconds.
+
+    Returns:
+        list: a dict per job type with its number of jobs and the `p50`,
+            `p90` and `p99` of `pending` and `overhead` in seconds.
+    """
+    types = {}
+
+    for row in rows:
+        types.setdefault(row["job_type"] or "", []).append(row)
+
+    summary = []
+
+    for job_type, jobs in sorted(types.items()):
+        pending = [_duration(i, "submitted", "started") for i in jobs]
+        overhead = []
+
+        for i in jobs:
+            total = _duration(i, "issued", "resolved")
+            running = _duration(i, "started", "finished")
+
+            if total is not None and running is not None:
+                overhead.append(max(total - running, 0))
+
+        entry = {"job_type": job_type, "jobs": len(jobs)}
+
+        for pct in _PERCENTILES:
+            entry[f"pending_p{pct}"] = percentile(pending, pct)
+            entry[f"overhead_p{pct}"] = percentile(overhead, pct)
+
+        summary.append(entry)
+
+    return summary
+
+
+def format_summary(summary):
+    """Format a `summarize` result as a tab separated table."""
+    keys = ["job_type", "jobs"]
+    keys += [f"pending_p{pct}" for pct in _PERCENTILES]
+    keys += [f"overhead_p{pct}" for pct in _PERCENTILES]
+    lines = ["\t".join(keys)]
+
+    for entry in summary:
+        values = [entry[i] for i in keys]
+        values = [round(i, 1) if isinstance(i, float) else i for i in values]
+        lines.append("\t".join("-" if i is None else str(i) for i in values))
+
+    return "\n".join(lines)
+
+
+def read_csv(path):
+    """Read the rows of a lifecycle CSV, with times as floats."""
+    rows = []
+
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            for key in EVENTS:
+                row[key] = float(row[key]) if row[key] else None
+
+            rows.append(row)
+
+    return rows
+
+
+class LifecycleRecorder:
+
+    """
+    Record the lifecycle timestamps of jobs, keyed by Toil job ID.
+
+    Jobs are issued by the leader thread and tracked by the worker thread, so
+    updates are serialized with a lock. A resubmission, e.g. a resource
+    retry, starts a new attempt: the events after the bsub return are reset.
+    """
+
+    def __init__(self, path):
+        """
+        Start an empty record.
+
+        Arguments:
+            path (str): prefix of the exported trace and CSV.
+        """
+        self.path = path
+        self.jobs = {}
+        self._lock = Lock()
+
+    def _job(self, job_id):
+        if job_id not in self.jobs:
+            self.jobs[job_id] = dict.fromkeys(COLUMNS)
+            self.jobs[job_id].update(job_id=job_id, attempts=0)
+
+        return self.jobs[job_id]
+
+    def issued(self, job_id, job_type):
+        """Record that the leader issued a job of type `job_type`."""
+        with self._lock:
+            self._job(job_id).update(issued=time.time(), job_type=job_type)
+
+    def submitted(self, job_id, lsf_id):
+        """Record that `bsub` returned `lsf_id`, starting a new attempt."""
+        with self._lock:
+            job = self._job(job_id)
+            job.update(pending=None, started=None, finished=None)
+            job.update(lsf_id=str(lsf_id), submitted=time.time())
+            job["attempts"] += 1
+
+    def pending(self, job_id):
+        """Record that a job was seen in LSF, if not seen before."""
+        with self._lock:
+            job = self._job(job_id)
+            job["pending"] = job["pending"] or time.time()
+
+    def observe(self, job_id, record):
+        """
+        Record the events of a job from its `LSFJobRecord`.
+
+        Finished jobs are dated with the pending and run times reported by
+        LSF, counted from the bsub return, when they are available.
+        """
+        now = time.time()
+
+        with self._lock:
+            job = self._job(job_id)
+
+            if record.state in ("PEND", "RUN", "DONE", "EXIT"):
+                job["pending"] = job["pending"] or now
+
+            if record.state == "RUN":
+                job["started"] = job["started"] or now
+
+            if record.state not in ("DONE", "EXIT"):
+                return
+
+            if job["submitted"] and record.pend_time is not None:
+                job["started"] = min(job["submitted"] + record.pend_time, now)
+
+            if job["started"] and record.run_time is not None:
+                job["finished"] = min(job["started"] + record.run_time, now)
+
+            job["started"] = job["started"] or now
+            job["finished"] = job["finished"] or now
+
+    def resolved(self, job_id, status):
+        """Record that the batch system reported a job's exit `status`."""
+        with self._lock:
+            self._job(job_id).update(resolved=time.time(), exit_status=status)
+
+    def rows(self):
+        """Get a dict of `COLUMNS` per job, ordered by job ID."""
+        with self._lock:
+            return [dict(self.jobs[i]) for i in sorted(self.jobs)]
+
+    def trace(self):
+        """
+        Get the jobs' lifecycles as a Chrome trace.
+
+        Each job is a thread of the trace, named after its type and ID, with
+        a complete event per span between consecutive timestamps.
+
+        Returns:
+            dict: the trace, with timestamps in microseconds.
+        """
+        rows = self.rows()
+        times = [i[j] for i in rows for j in EVENTS if i[j] is not None]
+        origin = min(times, default=0)
+        events = []
+
+        for tid, row in enumerate(rows, 1):
+            name = f"{row['job_type'] or 'job'} {row['job_id']}"
+            events.append(
+                {
+                    "ph": "M",
+                    "name": "thread_name",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+
+            for span, first, last in _SPANS:
+                duration = _duration(row, first, last)
+
+                if duration is None:
+                    continue
+
+                events.append(
+                    {
+                        "ph": "X",
+                        "name": span,
+                        "cat": row["job_type"] or "job",
+                        "pid": 1,
+                        "tid": tid,
+                        "ts": round((row[first] - origin) * 1e6),
+                        "dur": round(duration * 1e6),
+                        "args": {"lsf_id": row["lsf_id"], "job_id": row["job_id"]},
+                    }
+                )
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self):
+        """
+        Write the trace to `<path>.json` and the jobs to `<path>.csv`.
+
+        Returns:
+            list: the `summarize` result of the jobs.
+        """
+        with open(self.path + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.trace(), f)
+
+        rows = self.rows()
+
+        with open(self.path + ".csv", "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+        logger.info("Exported the lifecycle of %d jobs to %s", len(rows), self.path)
+        return summarize(rows)
+
+
+def main(args=None):
+    """Print the pending time and overhead percentiles of a lifecycle CSV."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("path", help="CSV exported with TOIL_CONTAINER_LSF_LIFECYCLE")
+    args = parser.parse_args(args)
+    print(format_summary(summarize(read_csv(args.path))))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,290 @@
+"""
+Aggregate the stdout and stderr of LSF jobs instead of writing two files each.
+
+By default every job writes its outputs to two files of the Toil work
+directory, which on a shared filesystem means two file creations per job. The
+job's command can instead be wrapped to write its outputs to node-local
+scratch, and then either copy them to the work directory only if they are not
+empty (`drop-empty`), or append them gzipped to one of a few segment files per
+workflow, with a JSON lines index of the offset and length of each output
+(`segments`). Empty outputs are never written.
+
+The outputs of failed jobs are extracted from the segments to their usual
+paths, where the Toil leader looks for them.
+"""
+
+from threading import Lock
+import argparse
+import fcntl
+import gzip
+import json
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+
+from toil.batchSystems.lsf import logger
+
+# "files" writes each job's outputs to the work directory, "drop-empty" skips
+# the empty ones and "segments" appends them to per-workflow segment files
+LOG_MODE = os.getenv("TOIL_CONTAINER_LSF_LOGS", "files")
+
+# directory of the segment files, default is in the toil work directory
+LOG_DIR = os.getenv("TOIL_CONTAINER_LSF_LOG_DIR")
+
+# node-local directory for the outputs of running jobs, default is TMPDIR
+LOG_SCRATCH = os.getenv("TOIL_CONTAINER_LSF_LOG_SCRATCH")
+
+try:
+    LOG_SEGMENTS = int(os.getenv("TOIL_CONTAINER_LSF_LOG_SEGMENTS", "16"))
+except ValueError:  # pragma: no cover
+    LOG_SEGMENTS = 16
+    logger.error("Failed to parse default values for log aggregation.")
+
+STREAMS = ("out", "err")
+
+
+def expand_path(template):
+    """Replace the `%J` and `%I` of a bsub output path as LSF would."""
+    path = template.replace("%J", os.getenv("LSB_JOBID", "0"))
+    return path.replace("%I", os.getenv("LSB_JOBINDEX", "0"))
+
+
+def index_path(segment):
+    """Get the path to the index of a segment file."""
+    return segment[: -len(".gz")] + ".idx" if segment.endswith(".gz") else segment
+
+
+def append_segment(segment, data, entry):
+    """
+    Append gzipped `data` to a segment and `entry` to its index.
+
+    The segment is locked with `fcntl`, which works across the nodes of
+    shared filesystems, so that concurrent jobs don't interleave. Each output
+    is a gzip member that can be decompressed on its own.
+
+    Arguments:
+        segment (str): path to the segment file.
+        data (bytes): the output to append.
+        entry (dict): index entry of the output, `offset`, `length` and `size`
+            are added to it.
+    """
+    blob = gzip.compress(data)
+
+    with open(segment, "ab") as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+
+        try:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(blob)
+            f.flush()
+            entry = dict(entry, offset=offset, length=len(blob), size=len(data))
+
+            with open(index_path(segment), "a", encoding="utf-8") as index:
+                index.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+def read_index(segment):
+    """Get the entries of a segment's index, ignoring a partial last line."""
+    entries = []
+
+    try:
+        with open(index_path(segment), encoding="utf-8") as f:
+            for line in f:
+                if line.endswith("\n"):
+                    entries.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+
+    return entries
+
+
+def read_entry(segment, entry):
+    """Get the decompressed output of an index `entry`."""
+    with open(segment, "rb") as f:
+        f.seek(entry["offset"])
+        return gzip.decompress(f.read(entry["length"]))
+
+
+def capture(command, out, err, segment=None, job=None, scratch=None):
+    """
+    Run a job's command with its outputs in scratch, then publish them.
+
+    SIGINT and SIGTERM, sent by LSF before killing a job, are forwarded to
+    the command so that the outputs of killed jobs are published too.
+
+    Arguments:
+        command (str): the job's shell command.
+        out (str): bsub stdout path, `%J` and `%I` are expanded.
+        err (str): bsub stderr path, `%J` and `%I` are expanded.
+        segment (str): append the outputs to this segment instead of
+            copying them to `out` and `err`.
+        job (str): the Toil job ID, stored in the segment's index.
+        scratch (str): node-local directory, default is LOG_SCRATCH or TMPDIR.
+
+    Returns:
+        int: the exit code of the command.
+    """
+    scratch = scratch or LOG_SCRATCH or tempfile.gettempdir()
+    outputs = [tempfile.TemporaryFile(dir=scratch) for _ in STREAMS]
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        command, shell=True, stdout=outputs[0], stderr=outputs[1]
+    )
+
+    def forward(signum, _):
+        process.send_signal(signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, forward)
+
+    returncode = process.wait()
+    lsf_id = os.getenv("LSB_JOBID", "0")
+
+    if os.getenv("LSB_JOBINDEX", "0") != "0":
+        lsf_id += f"[{os.environ['LSB_JOBINDEX']}]"
+
+    for stream, template, output in zip(STREAMS, (out, err), outputs):
+        with output:
+            if not output.seek(0, os.SEEK_END):
+                continue
+
+            output.seek(0)
+            path = expand_path(template)
+
+            if segment:
+                entry = {"job": job, "lsf_id": lsf_id, "std": stream, "path": path}
+                append_segment(segment, output.read(), entry)
+            else:
+                with open(path, "wb") as f:
+                    shutil.copyfileobj(output, f)
+
+    return returncode
+
+
+class LogAggregator:
+
+    """
+    Wrap job commands to aggregate their outputs, and extract failed jobs'.
+
+    Jobs are spread over `segments` segment files by Toil job ID, so that the
+    outputs of a job are found by reading a single index.
+    """
+
+    def __init__(self, directory, mode=None, segments=None):
+        """
+        Create the segments directory if needed.
+
+        Arguments:
+            directory (str): directory of the segment files.
+            mode (str): "drop-empty" or "segments", default is LOG_MODE.
+            segments (int): number of segment files, default is LOG_SEGMENTS.
+        """
+        self.directory = directory
+        self.mode = LOG_MODE if mode is None else mode
+        self.segments = max(LOG_SEGMENTS if segments is None else segments, 1)
+        self._lock = Lock()
+
+        if self.mode == "segments":
+            os.makedirs(directory, exist_ok=True)
+
+    def segment(self, job_id):
+        """Get the path to the segment of a job."""
+        return os.path.join(self.directory, f"segment_{int(job_id) % self.segments}.gz")
+
+    def wrap(self, job_id, command, out, err):
+        """
+        Wrap a job's command to aggregate its outputs.
+
+        Arguments:
+            job_id (int): the Toil job ID.
+            command (str): the job's shell command.
+            out (str): bsub stdout path of the job.
+            err (str): bsub stderr path of the job.
+
+        Returns:
+            str: the wrapped command.
+        """
+        args = [sys.executable, "-m", "toil_container.lsf_logs", "run"]
+        args += ["--out", out, "--err", err]
+
+        if self.mode == "segments":
+            args += ["--segment", self.segment(job_id), "--job", str(job_id)]
+
+        if LOG_SCRATCH:
+            args += ["--scratch", LOG_SCRATCH]
+
+        return " ".join(shlex.quote(i) for i in args + [command])
+
+    def entries(self, job_id):
+        """Get the index entries of a job's outputs."""
+        if self.mode != "segments":
+            return []
+
+        segment = self.segment(job_id)
+        return [i for i in read_index(segment) if i["job"] == str(job_id)]
+
+    def extract(self, job_id):
+        """
+        Write a job's outputs from its segment to their bsub paths.
+
+        Returns:
+            list: the paths written.
+        """
+        paths = []
+
+        with self._lock:
+            for entry in self.entries(job_id):
+                try:
+                    with open(entry["path"], "wb") as f:
+                        f.write(read_entry(self.segment(job_id), entry))
+                except OSError as error:
+                    logger.warning("Failed to extract %s: %s", entry["path"], error)
+                    continue
+
+                paths.append(entry["path"])
+
+        if paths:
+            logger.debug("Extracted the outputs of job %s: %s", job_id, paths)
+
+        return paths
+
+
+def main(args=None):
+    """Run a job with aggregated outputs, or print a job's outputs."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    run = subparsers.add_parser("run", help="run a job's command")
+    run.add_argument("--out", default=os.devnull, help="bsub stdout path")
+    run.add_argument("--err", default=os.devnull, help="bsub stderr path")
+    run.add_argument("--segment", help="append the outputs to this segment")
+    run.add_argument("--job", help="Toil job ID stored in the index")
+    run.add_argument("--scratch", help="node-local directory for the outputs")
+    run.add_argument("command", help="the job's shell command")
+    show = subparsers.add_parser("show", help="print the outputs of a job")
+    show.add_argument("directory", help="directory of the segment files")
+    show.add_argument("job", help="Toil job ID")
+    show.add_argument("--segments", type=int, default=LOG_SEGMENTS)
+    args = parser.parse_args(args)
+
+    if args.action == "run":
+        return capture(
+            args.command, args.out, args.err, args.segment, args.job, args.scratch
+        )
+
+    aggregator = LogAggregator(args.directory, "segments", args.segments)
+
+    for entry in aggregator.entries(args.job):
+        print(f"==> {entry['path']} <==")
+        data = read_entry(aggregator.segment(args.job), entry)
+        print(data.decode("utf-8", "replace"))
+
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""
+Monitor the running jobs of the custom LSF batch system.
+
+The `StatusPoller` queries LSF from a background thread, so that a slow
+scheduler never blocks submissions, while the `RunningJobsMixin` of the
+worker extends the run limit of jobs about to reach it and reclaims the jobs
+stuck in states that may never progress, e.g. after their host died.
+"""
+# pylint: disable=C0103
+
+from collections import namedtuple
+from threading import Event
+from threading import Thread
+from types import MappingProxyType
+import math
+import subprocess
+import time
+
+from toil.batchSystems.lsf import logger
+
+from toil_container import lsf_helper
+from toil_container import lsf_pilot
+from toil_container.lsf_helper import (
+    MAX_RUNTIME,
+    STATUS_QUERY_CHUNK,
+    STUCK_STATES,
+    AdaptivePoller,
+    escalate_resource,
+    get_lsf_settings,
+)
+from toil_container.lsf_output import BJOBS_FORMAT, get_lsf_id, parse_bjobs_output
+
+StatusSnapshot = namedtuple(
+    "StatusSnapshot", ["version", "started", "queried", "records"]
+)
+
+StatusSnapshot.__doc__ = """
+Immutable LSF status of the jobs of a worker.
+
+Attributes:
+    version (int): incremented for each new snapshot.
+    started (float): monotonic time at which the scheduler was queried.
+    queried (frozenset): LSF IDs of the worker's jobs when it was queried.
+    records (MappingProxyType): read-only mapping of LSF IDs to `LSFJobRecord`.
+"""
+
+
+class StatusPoller(Thread):
+
+    """
+    Poll LSF in the background and keep a snapshot of the worker's jobs.
+
+    The snapshot is replaced as a whole with a new immutable `StatusSnapshot`,
+    so the worker can read it at any time without locking, and a slow
+    scheduler never blocks submissions.
+    """
+
+    def __init__(self, worker):
+        """
+        Poll the status of the jobs of `worker`.
+
+        Arguments:
+            worker (CustomLSFBatchSystem.Worker): the worker whose jobs to poll.
+        """
+        super().__init__(daemon=True)
+        self.worker = worker
+        self.snapshot = None
+        self.stopped = Event()
+        self.poller = AdaptivePoller(worker.boss.config.statePollingWait)
+
+    def run(self):
+        """Refresh the snapshot until stopped, never dying on LSF errors."""
+        # a zero interval would spin, poll at most every tenth of a second
+        while not self.stopped.wait(max(0.1, min(1.0, self.poller.interval))):
+            if self.poller.due():
+                self.poll()
+
+    def poll(self):
+        """Query LSF and replace the snapshot."""
+        started = time.monotonic()
+        lsfIDs = [
+            get_lsf_id(*i)
+            for i in list(self.worker.batchJobIDs.values())
+            if not str(i[0]).startswith(("NOT_SUBMITTED", lsf_pilot.PILOT_PREFIX))
+        ]
+
+        try:
+            records = self.worker.boss.with_retries(self.query, lsfIDs)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Failed to poll LSF job statuses: %s", error)
+            self.poller.update(0, len(lsfIDs), time.monotonic() - started)
+            return
+
+        previous = self.snapshot.records if self.snapshot else {}
+        finished = sum(
+            1
+            for lsfID, record in records.items()
+            if record.state in ("DONE", "EXIT")
+            and getattr(previous.get(lsfID), "state", None) not in ("DONE", "EXIT")
+        )
+
+        version = self.snapshot.version + 1 if self.snapshot else 1
+        self.snapshot = StatusSnapshot(
+            version, started, frozenset(lsfIDs), MappingProxyType(records)
+        )
+        self.poller.update(finished, len(lsfIDs), time.monotonic() - started)
+
+    def query(self, lsfIDs):
+        """Get the `LSFJobRecord` of the workflow's jobs, including finished ones."""
+        # pylint: disable=protected-access
+        command = ["bjobs", "-a", "-noheader", "-o", BJOBS_FORMAT]
+        records = {}
+
+        if self.worker.boss.jobGroup:
+            command += ["-g", self.worker.boss.jobGroup]
+            return parse_bjobs_output(self.worker._callLSF(command))
+
+        for i in range(0, len(lsfIDs), STATUS_QUERY_CHUNK):
+            chunk = lsfIDs[i : i + STATUS_QUERY_CHUNK]
+            records.update(parse_bjobs_output(self.worker._callLSF(command + chunk)))
+
+        return records
+
+
+class MonitorState:
+
+    """
+    State of the checks on the running jobs of a worker.
+
+    Attributes:
+        snapshot_version (int): version of the last `StatusSnapshot` applied.
+        extended_at (float): monotonic time of the last run limit extensions.
+        reclaimed_at (float): monotonic time of the last stuck jobs check.
+        stuck_since (dict): Toil job IDs of the stuck jobs to their state and
+            the monotonic time they were first seen in it.
+    """
+
+    def __init__(self):
+        """Wait for a full interval before the first checks."""
+        self.snapshot_version = None
+        self.extended_at = time.monotonic()
+        self.reclaimed_at = time.monotonic()
+        self.stuck_since = {}
+
+
+class RunningJobsMixin:
+
+    """Extend the run limits of running jobs and reclaim the stuck ones."""
+
+    def _extendRunLimits(self, records=None):
+        """
+        Extend the run limit of running jobs with `bmod` before they hit it.
+
+        Every `EXTEND_INTERVAL` seconds, the limit of jobs past `EXTEND_AT`
+        of it is escalated as for a runlimit retry, up to `EXTEND_STEPS`
+        times per job and capped at `MAX_RUNTIME`. Jobs that still reach
+        their limit are resubmitted by `_customRetry`.
+
+        Arguments:
+            records (dict): `LSFJobRecord` of the running jobs, queried
+                with `bjobs -r` if not set.
+        """
+        if (
+            not lsf_helper.EXTEND_AT
+            or time.monotonic() - self._monitor.extended_at < lsf_helper.EXTEND_INTERVAL
+        ):
+            return
+
+        self._monitor.extended_at = time.monotonic()
+        candidates = {}
+
+        for jobID in list(self.runningJobs):
+            jobNode = self.boss.Id2Node.get(jobID)
+
+            if (
+                jobNode
+                and jobNode.runtime
+                and jobNode.runtime_extensions < lsf_helper.EXTEND_STEPS
+                and not self._isPilotJob(jobID)
+            ):
+                candidates[self.getBatchSystemID(jobID)] = jobNode
+
+        if not candidates:
+            return
+
+        if records is None:
+            records = self.boss.with_retries(self._getRunningRecords, candidates)
+
+        for lsfID, jobNode in candidates.items():
+            record = records.get(lsfID)
+            limit = int(jobNode.runtime)
+
+            if (
+                record is None
+                or record.state != "RUN"
+                or not record.run_time
+                or record.run_time < lsf_helper.EXTEND_AT * limit * 60
+            ):
+                continue
+
+            observed = -(-record.run_time // 60)  # minutes
+            runtime = escalate_resource(limit, observed, MAX_RUNTIME)
+
+            if runtime:
+                self._extendRunLimit(lsfID, jobNode, math.ceil(runtime))
+
+    def _extendRunLimit(self, lsfID, jobNode, runtime):
+        """Set the run limit of a running job to `runtime` minutes."""
+        settings = self.boss.settings or get_lsf_settings()
+        command = ["bmod", settings.runtime_flag, str(runtime), lsfID]
+        limit = jobNode.runtime
+
+        # failed attempts count too, so that denied jobs aren't retried
+        jobNode.runtime_extensions += 1
+
+        try:
+            self._callLSF(command, check=True)
+        except subprocess.CalledProcessError as error:
+            self.metrics["extension_failures"] += 1
+            logger.warning(
+                "Failed to extend the run limit of %s: %s",
+                lsfID,
+                (error.stderr or "").strip(),
+            )
+            return
+
+        jobNode.runtime = runtime
+        self.metrics["extensions"] += 1
+        logger.info(
+            "Extended the run limit of %s from %s to %s minutes",
+            lsfID,
+            limit,
+            runtime,
+        )
+
+    def _reclaimStuckJobs(self, records=None):
+        """
+        Detect jobs stuck in `STUCK_STATES` and apply `STUCK_POLICY`.
+
+        Every `STUCK_INTERVAL` seconds, the states of the unfinished jobs
+        are checked. Jobs found in the same stuck state for `STUCK_AFTER`
+        seconds, e.g. UNKWN or ZOMBI after their host died, are requeued
+        or killed and resubmitted, up to `STUCK_RETRIES` times per job.
+
+        Arguments:
+            records (dict): `LSFJobRecord` of the unfinished jobs,
+                queried with `bjobs` if not set.
+
+        Returns:
+            dict: a mapping of Toil job IDs to exit status, for the jobs
+                that couldn't be reclaimed again.
+        """
+        if time.monotonic() - self._monitor.reclaimed_at < lsf_helper.STUCK_INTERVAL:
+            return {}
+
+        self._monitor.reclaimed_at = time.monotonic()
+        lsfIDs = {
+            self.getBatchSystemID(i): i
+            for i in list(self.runningJobs)
+            if not self._isPilotJob(i)
+        }
+
+        if not lsfIDs:
+            return {}
+
+        if records is None:
+            records = self.boss.with_retries(self._getUnfinishedRecords, lsfIDs)
+
+        statuses = {}
+
+        for lsfID, jobID in lsfIDs.items():
+            record = records.get(lsfID)
+
+            if record is None or record.state not in STUCK_STATES:
+                self._monitor.stuck_since.pop(jobID, None)
+                continue
+
+            state, since = self._monitor.stuck_since.get(jobID, (None, None))
+
+            if state != record.state:
+                logger.warning("Detected job %s in state %s", lsfID, record.state)
+                self._monitor.stuck_since[jobID] = (record.state, time.monotonic())
+                self.metrics["stuck_detected"] += 1
+            elif (
+                time.monotonic() - since >= lsf_helper.STUCK_AFTER
+                and lsf_helper.STUCK_POLICY != "none"
+            ):
+                self._monitor.stuck_since.pop(jobID)
+                status = self._reclaimStuckJob(jobID, record)
+
+                if status is not None:
+                    statuses[jobID] = status
+
+        return statuses
+
+    def _reclaimStuckJob(self, jobID, record):
+        """
+        Requeue a stuck job, or kill it and submit it again.
+
+        A failed `brequeue`, e.g. for an UNKWN job, falls back to killing
+        and resubmitting the job.
+
+        Returns:
+            int: 1 if the job was reclaimed `STUCK_RETRIES` times
+                already and was killed, None if it was reclaimed.
+        """
+        jobNode = self.boss.Id2Node.get(jobID)
+        stuck = f"{record.lsfID} stuck in {record.state}"
+
+        if jobNode is None or jobNode.stuck_retries >= lsf_helper.STUCK_RETRIES:
+            logger.error("Failing job %s", stuck)
+            self.boss.with_retries(self._callLSF, ["bkill", "-r", record.lsfID])
+            self.metrics["stuck_failed"] += 1
+            return 1
+
+        jobNode.stuck_retries += 1
+
+        if lsf_helper.STUCK_POLICY == "requeue":
+            try:
+                self._callLSF(["brequeue", record.lsfID], check=True)
+            except subprocess.CalledProcessError as error:
+                self.metrics["stuck_requeue_failures"] += 1
+                logger.warning(
+                    "Failed to requeue job %s: %s",
+                    stuck,
+                    (error.stderr or "").strip(),
+                )
+            else:
+                logger.info("Requeued job %s", stuck)
+                self.metrics["stuck_requeued"] += 1
+                return None
+
+        self.boss.with_retries(self._callLSF, ["bkill", "-r", record.lsfID])
+        lsfID = self._resubmitJob(jobID, jobNode)
+        logger.info("Resubmitted job %s as %s", stuck, lsfID)
+        self.metrics["stuck_resubmitted"] += 1
+        return None
+
+    def _getUnfinishedRecords(self, lsfIDs, options=()):
+        """Get the `LSFJobRecord` of the unfinished jobs among `lsfIDs`."""
+        command = ["bjobs", *options, "-noheader", "-o", BJOBS_FORMAT]
+
+        if self.boss.jobGroup:
+            command += ["-g", self.boss.jobGroup]
+            return parse_bjobs_output(self._callLSF(command))
+
+        lsfIDs = list(lsfIDs)
+        records = {}
+
+        for i in range(0, len(lsfIDs), STATUS_QUERY_CHUNK):
+            chunk = lsfIDs[i : i + STATUS_QUERY_CHUNK]
+            records.update(parse_bjobs_output(self._callLSF(command + chunk)))
+
+        return records
+
+    def _getRunningRecords(self, lsfIDs):
+        """Get the `LSFJobRecord` of the running jobs among `lsfIDs`."""
+        return self._getUnfinishedRecords(lsfIDs, ["-r"])
@@ -0,0 +1,259 @@
+"""
+Parse the outputs of LSF commands into typed records.
+
+`bjobs -o` is parsed from its delimited fields, while the long formats of
+`bjobs -l`, `bacct -l` and `bhist -l` are parsed line by line, so that the
+status of jobs that left `bjobs` can be recovered from the accounting files.
+"""
+
+from collections import namedtuple
+import re
+
+from toil.batchSystems.lsf import logger
+
+# bjobs fields parsed by `parse_bjobs_output`, in order
+BJOBS_FIELDS = "jobid jobindex stat exit_code exit_reason max_mem run_time pend_time"
+BJOBS_DELIMITER = "|"
+BJOBS_FORMAT = f"{BJOBS_FIELDS} delimiter='{BJOBS_DELIMITER}'"
+
+_MEMORY_UNITS = {
+    "b": 1,
+    "k": 1e3,
+    "kb": 1e3,
+    "kbytes": 1e3,
+    "m": 1e6,
+    "mb": 1e6,
+    "mbytes": 1e6,
+    "g": 1e9,
+    "gb": 1e9,
+    "gbytes": 1e9,
+    "t": 1e12,
+    "tb": 1e12,
+    "tbytes": 1e12,
+}
+
+_LONG_RECORD_PATTERNS = [
+    # the order matters, each line is only matched against the first hit
+    ("job", re.compile(r"^Job <(\d+(?:\[\d+\])?)>")),
+    ("done", re.compile(r"Done successfully|Completed <done>|Status <DONE>")),
+    ("exit", re.compile(r"Exited with exit code (\d+)|Exited by|Completed <exit>")),
+    ("run", re.compile(r"Started (?:\d+ Task\(s\) )?on |Dispatched |Status <RUN>")),
+    ("pend", re.compile(r"PENDING REASONS|waiting for scheduling|Status <PEND>")),
+    ("maxmem", re.compile(r"MAX MEM: ([\d.]+ \w+)")),
+    ("summary", re.compile(r"^\s*(CPU_T\s+WAIT\s+TURNAROUND|PEND\s+PSUSP\s+RUN)")),
+]
+
+_TERM_REASON = re.compile(r"\b(TERM_[A-Z_]+)")
+
+LSFJobRecord = namedtuple(
+    "LSFJobRecord",
+    [
+        "lsfID",
+        "state",
+        "exit_code",
+        "exit_reason",
+        "max_mem",
+        "run_time",
+        "pend_time",
+        "cpu_time",
+    ],
+    defaults=[None],
+)
+
+LSFJobRecord.__doc__ = """
+Typed status of an LSF job.
+
+Attributes:
+    lsfID (str): LSF job ID.
+    state (str): LSF state, e.g. `PEND`, `RUN`, `DONE` or `EXIT`, None if unknown.
+    exit_code (int): exit code of the job, None if unknown.
+    exit_reason (str): LSF `TERM_*` termination reason, None if unknown.
+    max_mem (float): peak memory used in bytes, None if unknown.
+    run_time (int): run time in seconds, None if unknown.
+    pend_time (int): pending time in seconds, None if unknown.
+    cpu_time (float): cpu time in seconds, None if unknown.
+"""
+
+
+def parse_lsf_memory(string):
+    """Parse an LSF memory string such as `2.3 Gbytes` or `2M` to bytes."""
+    match = re.match(r"^([\d.]+)\s*([A-Za-z]*)$", string.strip())
+
+    if not match:
+        return None
+
+    unit = match.group(2).lower() or "m"
+    return float(match.group(1)) * _MEMORY_UNITS.get(unit, 1e6)
+
+
+def parse_lsf_int(string):
+    """Parse the leading integer of an LSF field such as `5 second(s)`."""
+    match = re.match(r"^\s*(\d+)", string)
+    return int(match.group(1)) if match else None
+
+
+def get_lsf_id(jobid, jobindex=None):
+    """Get the LSF ID of a job, `jobid[jobindex]` for job array elements."""
+    if jobindex and str(jobindex) != "0":
+        return f"{jobid}[{jobindex}]"
+    return str(jobid)
+
+
+def parse_bjobs_output(output):
+    """
+    Parse the output of `bjobs -noheader -o "BJOBS_FIELDS delimiter='|'"`.
+
+    Arguments:
+        output (str): the delimited bjobs output.
+
+    Returns:
+        dict: a mapping of LSF job IDs to `LSFJobRecord`, array elements are
+            keyed as `jobid[jobindex]`.
+    """
+    records = {}
+
+    for line in output.splitlines():
+        fields = line.strip().split(BJOBS_DELIMITER)
+
+        if len(fields) != 8:
+            continue
+
+        jobid, jobindex, state, exit_code, exit_reason, max_mem, run_time, pend_time = [
+            None if i in ("", "-") else i for i in fields
+        ]
+
+        lsfID = get_lsf_id(jobid, jobindex)
+
+        reason = _TERM_REASON.search(exit_reason or "")
+        records[lsfID] = LSFJobRecord(
+            lsfID=lsfID,
+            state=state,
+            exit_code=parse_lsf_int(exit_code) if exit_code else None,
+            exit_reason=reason.group(1) if reason else None,
+            max_mem=parse_lsf_memory(max_mem) if max_mem else None,
+            run_time=parse_lsf_int(run_time) if run_time else None,
+            pend_time=parse_lsf_int(pend_time) if pend_time else None,
+        )
+
+    return records
+
+
+def _apply_summary(record, values):
+    """Update a long format `record` from the values of its summary table."""
+    if not values:
+        return
+
+    record["pend_time"] = parse_lsf_int(values.get("WAIT") or values.get("PEND") or "")
+    record["run_time"] = parse_lsf_int(values.get("RUN") or "")
+    turnaround = parse_lsf_int(values.get("TURNAROUND") or "")
+
+    if turnaround is not None and record["pend_time"] is not None:
+        record["run_time"] = turnaround - record["pend_time"]
+
+    if values.get("CPU_T"):
+        record["cpu_time"] = float(values["CPU_T"])
+
+    if values.get("MEM") and record["max_mem"] is None:
+        record["max_mem"] = parse_lsf_memory(values["MEM"])
+
+
+def _apply_event(record, key, match):
+    """Update a long format `record` from a line matching `key`."""
+    if key == "done":
+        record["state"] = "DONE"
+        record["exit_code"] = 0
+
+    elif key == "exit":
+        record["state"] = "EXIT"
+
+        if match.group(1) or record["exit_code"] is None:
+            record["exit_code"] = int(match.group(1) or 1)
+
+    elif key in ("run", "pend") and record["state"] not in ("DONE", "EXIT"):
+        record["state"] = "RUN" if key == "run" else "PEND"
+
+    elif key == "maxmem":
+        record["max_mem"] = parse_lsf_memory(match.group(1))
+
+
+def parse_long_output(output):
+    """
+    Parse the long format output of `bjobs -l`, `bacct -l` or `bhist -l`.
+
+    The output is parsed in a single pass. Terminal events (done or exit)
+    take precedence over earlier running or pending events, so that the
+    history of a finished job doesn't classify it as still running. Lines
+    before the first `Job <id>` header, e.g. warnings, are skipped.
+
+    Arguments:
+        output (str): output of one of the long format LSF commands.
+
+    Returns:
+        dict: a mapping of LSF job IDs to `LSFJobRecord`.
+    """
+    records = {}
+    current = {}
+    summary = None
+
+    # lsf hard wraps long lines with a 21 spaces indentation
+    for line in output.replace("\n" + " " * 21, "").splitlines():
+        if summary:
+            if current:
+                _apply_summary(current, dict(zip(summary, line.split())))
+
+            summary = None
+            continue
+
+        for key, pattern in _LONG_RECORD_PATTERNS:
+            match = pattern.search(line)
+
+            if not match:
+                continue
+
+            if key == "job":
+                current = records.setdefault(
+                    match.group(1),
+                    dict.fromkeys(LSFJobRecord._fields, None),
+                )
+                current["lsfID"] = match.group(1)
+            elif key == "summary":
+                summary = line.split()
+            elif current:
+                # the lines before the first job header are skipped
+                _apply_event(current, key, match)
+
+            break
+
+        reason = _TERM_REASON.search(line)
+
+        if reason and current:
+            current["exit_reason"] = reason.group(1)
+
+    return {k: LSFJobRecord(**v) for k, v in records.items()}
+
+
+def parse_pack_output(output, size):
+    """
+    Get the LSF IDs of the jobs submitted by `bsub -pack`, in file order.
+
+    Arguments:
+        output (str): the bsub output.
+        size (int): the number of jobs in the pack file.
+
+    Returns:
+        list: LSF job IDs, None for the jobs that were not submitted.
+    """
+    lsfIDs = []
+
+    for line in output.splitlines():
+        match = re.search(r"Job <(\d+)> is submitted", line)
+
+        if match:
+            lsfIDs.append(int(match.group(1)))
+        elif "not submitted" in line.lower():
+            lsfIDs.append(None)
+
+    if len(lsfIDs) != size:
+        logger.error("Expected %d jobs in bsub -pack output: %s", size, output)
+
+    return (lsfIDs + [None] * size)[:size]
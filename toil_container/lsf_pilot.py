@@ -0,0 +1,493 @@
+"""
+Pilot jobs that run many short Toil jobs within long-lived LSF allocations.
+
+LSF dispatch latency can dominate jobs that run for less than a minute. In
+pilot mode, the leader submits pilot jobs with a fixed cores and memory
+envelope and hands them Toil job commands through a queue directory on a
+shared filesystem:
+
+    tasks/<task>                  jobs waiting for a pilot
+    claimed/<pilot>/<task>        jobs claimed by a pilot, moved atomically
+    done/<job_id>.json             exit status of a job, written by its pilot
+    kill/<job_id>                  jobs to be killed, removed by the pilot
+    pilots/<pilot>                heartbeat of a pilot, removed when it retires
+
+Task file names encode the job's resources, so that pilots can bin-pack the
+waiting jobs by cores, memory and runtime without reading them. Pilots retire
+after being idle for `PILOT_IDLE` seconds, or when the leader stops the pool.
+"""
+
+from datetime import timedelta
+import argparse
+import json
+import math
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+
+from toil.batchSystems.lsf import logger
+
+# prefix of the batch system IDs of jobs run by pilots
+PILOT_PREFIX = "PILOT_"
+
+# queue directory shared by the leader and the pilots
+PILOT_DIR = os.getenv("TOIL_CONTAINER_LSF_PILOT_DIR")
+
+try:
+    PILOT_CORES = int(os.getenv("TOIL_CONTAINER_LSF_PILOT_CORES", "8"))
+    PILOT_MEMORY = float(os.getenv("TOIL_CONTAINER_LSF_PILOT_MEM", "32")) * 1e9
+    PILOT_RUNTIME = int(os.getenv("TOIL_CONTAINER_LSF_PILOT_RUNTIME", "240"))
+    PILOT_JOB_RUNTIME = int(os.getenv("TOIL_CONTAINER_LSF_PILOT_JOB_RUNTIME", "10"))
+    PILOT_COUNT = int(os.getenv("TOIL_CONTAINER_LSF_PILOT_COUNT", "10"))
+    PILOT_IDLE = float(os.getenv("TOIL_CONTAINER_LSF_PILOT_IDLE", "120"))
+    PILOT_POLL = float(os.getenv("TOIL_CONTAINER_LSF_PILOT_POLL", "2"))
+except ValueError:  # pragma: no cover
+    PILOT_CORES = 8
+    PILOT_MEMORY = 32e9
+    PILOT_RUNTIME = 240
+    PILOT_JOB_RUNTIME = 10
+    PILOT_COUNT = 10
+    PILOT_IDLE = 120.0
+    PILOT_POLL = 2.0
+    logger.error("Failed to parse default values for LSF pilots.")
+
+# seconds between pilot heartbeats, pilots silent for 12 beats are lost
+HEARTBEAT = 10.0
+LOST_AFTER = 12 * HEARTBEAT
+
+_SUBDIRS = ("tasks", "claimed", "done", "kill", "pilots")
+
+
+def task_name(job_id, cores, memory, runtime):
+    """Get the file name of a task, encoding its resources."""
+    return f"{job_id}_{float(cores)}_{int(memory or 0)}_{int(runtime or 0)}.json"
+
+
+def parse_task_name(name):
+    """Get the job ID, cores, memory and runtime encoded in a task file name."""
+    job_id, cores, memory, runtime = name[: -len(".json")].split("_")
+    return int(job_id), float(cores), int(memory), int(runtime)
+
+
+def _write_json(path, data):
+    """Write `data` to `path` atomically, so that readers never see a partial file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    os.replace(tmp, path)
+
+
+def _listdir(path):
+    try:
+        return [i for i in os.listdir(path) if not i.endswith(".tmp")]
+    except FileNotFoundError:
+        return []
+
+
+class PilotPool:
+
+    """
+    The leader's side of the pilot queue.
+
+    Pilots are pending from their submission until their first heartbeat,
+    active while they beat, and lost if they stop beating without retiring,
+    in which case the jobs they claimed are reported as failed.
+    """
+
+    def __init__(
+        self,
+        directory,
+        cores=None,
+        memory=None,
+        runtime=None,
+        count=None,
+        idle=None,
+        job_runtime=None,
+    ):
+        """
+        Create the queue directory.
+
+        Arguments:
+            directory (str): queue directory on a filesystem shared with
+                the pilots.
+            cores (int): cores of a pilot, default is PILOT_CORES.
+            memory (float): bytes of memory of a pilot, default is
+                PILOT_MEMORY.
+            runtime (int): runtime of a pilot in minutes, default is
+                PILOT_RUNTIME.
+            count (int): maximum number of pilots, default is PILOT_COUNT.
+            idle (float): seconds before an idle pilot retires, default is
+                PILOT_IDLE.
+            job_runtime (int): maximum declared runtime in minutes of the jobs
+                run by pilots, default is PILOT_JOB_RUNTIME.
+        """
+        self.directory = directory
+        self.cores = PILOT_CORES if cores is None else cores
+        self.memory = PILOT_MEMORY if memory is None else memory
+        self.runtime = PILOT_RUNTIME if runtime is None else runtime
+        self.count = PILOT_COUNT if count is None else count
+        self.idle = PILOT_IDLE if idle is None else idle
+        self.job_runtime = PILOT_JOB_RUNTIME if job_runtime is None else job_runtime
+        self.pending = set()
+        self.active = set()
+        self.tasks = {}
+        self.exits = {}
+
+        for i in _SUBDIRS:
+            os.makedirs(os.path.join(directory, i), exist_ok=True)
+
+    def fits(self, cores, memory, runtime):
+        """
+        Check if a job can be run by a pilot.
+
+        Only jobs that declare a runtime of at most `job_runtime` minutes are
+        run by pilots, as longer jobs don't pay for the LSF dispatch latency.
+        """
+        return bool(
+            runtime
+            and int(runtime) <= self.job_runtime
+            and cores <= self.cores
+            and (memory or 0) <= self.memory
+        )
+
+    def submit(self, job_id, cores, memory, runtime, command, environment=None):
+        """Queue a job for the pilots."""
+        name = task_name(job_id, cores, memory, runtime)
+        path = os.path.join(self.directory, "tasks", name)
+        _write_json(path, {"command": command, "environment": environment or {}})
+        self.tasks[job_id] = name
+
+    def command(self):
+        """Get the command of a pilot job."""
+        return " ".join(
+            [
+                shlex.quote(sys.executable),
+                "-m",
+                "toil_container.lsf_pilot",
+                shlex.quote(self.directory),
+                f"--cores {self.cores}",
+                f"--memory {int(self.memory)}",
+                f"--runtime {self.runtime}",
+                f"--idle {self.idle}",
+            ]
+        )
+
+    def add(self, lsf_id):
+        """Track a submitted pilot until it starts beating."""
+        self.pending.add(str(lsf_id))
+
+    def drop(self, not_finished):
+        """Forget the pending pilots that LSF no longer knows about."""
+        gone = self.pending - set(not_finished)
+
+        if gone:
+            logger.warning("Pilots finished before starting: %s", sorted(gone))
+            self.pending -= gone
+
+    def needed(self):
+        """
+        Get the number of pilots to submit.
+
+        Enough pilots are requested to fit the cores and memory of the queued
+        jobs, counting the pending pilots and up to `count` pilots in total.
+        """
+        queued = [parse_task_name(i) for i in _listdir(self._path("tasks"))]
+
+        if not queued:
+            return 0
+
+        wanted = max(
+            math.ceil(sum(i[1] for i in queued) / self.cores),
+            math.ceil(sum(i[2] for i in queued) / self.memory),
+        )
+
+        free = self.count - len(self.pending) - len(self.active)
+        return max(min(wanted - len(self.pending), free), 0)
+
+    def collect(self):
+        """
+        Read the exit status of finished jobs and check on the pilots.
+
+        Returns:
+            dict: a mapping of Toil job IDs to exit status, including jobs
+                collected before, to be popped by the caller.
+        """
+        for name in _listdir(self._path("done")):
+            path = self._path("done", name)
+
+            with open(path, encoding="utf-8") as f:
+                self.exits[int(name.split(".")[0])] = json.load(f)["exit"]
+
+            os.remove(path)
+
+        now = time.time()
+
+        for name in _listdir(self._path("pilots")):
+            self.pending.discard(name)
+            self.active.add(name)
+
+            try:
+                silent = now - os.stat(self._path("pilots", name)).st_mtime
+            except FileNotFoundError:  # retired since listed
+                continue
+
+            if silent > LOST_AFTER:
+                self._lose(name)
+
+        self.active &= set(_listdir(self._path("pilots")))
+
+        for job_id in self.exits:
+            self.tasks.pop(job_id, None)
+
+        return self.exits
+
+    def _lose(self, pilot):
+        """Fail the jobs claimed by a pilot that stopped beating."""
+        claimed = self._path("claimed", pilot)
+        logger.error("Lost pilot %s, failing the jobs it claimed", pilot)
+
+        for name in _listdir(claimed):
+            self.exits.setdefault(parse_task_name(name)[0], 1)
+            os.remove(os.path.join(claimed, name))
+
+        # a pilot that comes back finds its heartbeat removed and exits
+        os.remove(self._path("pilots", pilot))
+        self.active.discard(pilot)
+
+    def kill(self, job_id):
+        """Remove a queued job, or ask its pilot to kill it."""
+        try:
+            os.remove(self._path("tasks", self.tasks[job_id]))
+            self.exits[job_id] = 1
+        except (KeyError, FileNotFoundError):
+            with open(self._path("kill", str(job_id)), "w", encoding="utf-8"):
+                pass
+
+    def running(self):
+        """Get a mapping of the jobs run by pilots to their time running."""
+        times = {}
+        now = time.time()
+
+        for pilot in _listdir(self._path("claimed")):
+            for name in _listdir(self._path("claimed", pilot)):
+                try:
+                    started = os.stat(self._path("claimed", pilot, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+
+                times[parse_task_name(name)[0]] = timedelta(seconds=now - started)
+
+        return times
+
+    def stop(self):
+        """Ask the pilots to kill their jobs and exit."""
+        with open(self._path("stop"), "w", encoding="utf-8"):
+            pass
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+
+class Pilot:
+
+    """
+    The pilot's side of the queue, running within an LSF allocation.
+
+    Waiting jobs are claimed largest first while they fit the free cores and
+    memory and the remaining runtime of the allocation. A claim is a rename,
+    so each job is run by a single pilot.
+    """
+
+    def __init__(self, directory, name, cores, memory, runtime, idle, interval=1.0):
+        """
+        Join the queue.
+
+        Arguments:
+            directory (str): queue directory shared with the leader.
+            name (str): pilot name, its LSF job ID.
+            cores (float): cores of the allocation.
+            memory (float): bytes of memory of the allocation.
+            runtime (int): runtime of the allocation in minutes.
+            idle (float): seconds without jobs before retiring.
+            interval (float): seconds between checks of the queue.
+        """
+        self.directory = directory
+        self.name = name
+        self.cores = cores
+        self.memory = memory
+        self.deadline = time.time() + runtime * 60
+        self.idle = idle
+        self.interval = interval
+        self.processes = {}  # job_id: (process, task name, cores, memory)
+        self.claimed = os.path.join(directory, "claimed", name)
+        self.heartbeat = os.path.join(directory, "pilots", name)
+        self._beat = 0
+        os.makedirs(self.claimed, exist_ok=True)
+
+    def run(self):
+        """Run jobs until idle, stopped or lost."""
+        with open(self.heartbeat, "w", encoding="utf-8"):
+            pass
+
+        lastActive = time.monotonic()
+
+        try:
+            while True:
+                self.reap()
+
+                if os.path.exists(os.path.join(self.directory, "stop")):
+                    break
+
+                if not self.beat():
+                    logger.error("Pilot %s was declared lost, exiting", self.name)
+                    break
+
+                if self.claim() or self.processes:
+                    lastActive = time.monotonic()
+                elif time.monotonic() - lastActive >= self.idle:
+                    break
+
+                time.sleep(self.interval)
+        finally:
+            self.retire()
+
+    def beat(self):
+        """Touch the heartbeat, False if the leader removed it."""
+        if time.monotonic() - self._beat < HEARTBEAT:
+            return True
+
+        self._beat = time.monotonic()
+
+        try:
+            os.utime(self.heartbeat)
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def claim(self):
+        """Start the waiting jobs that fit, returning True if any was started."""
+        cores = self.cores - sum(i[2] for i in self.processes.values())
+        memory = self.memory - sum(i[3] for i in self.processes.values())
+        minutes = (self.deadline - time.time()) / 60
+        tasks = os.path.join(self.directory, "tasks")
+        started = False
+
+        queued = [(parse_task_name(i), i) for i in _listdir(tasks)]
+
+        for (job_id, taskCores, taskMemory, taskRuntime), name in sorted(
+            queued, key=lambda i: (-i[0][1], -i[0][2], i[0][0])
+        ):
+
+            if taskCores > cores or taskMemory > memory or taskRuntime > minutes:
+                continue
+
+            path = os.path.join(self.claimed, name)
+
+            try:
+                os.rename(os.path.join(tasks, name), path)
+            except FileNotFoundError:  # claimed by another pilot
+                continue
+
+            with open(path, encoding="utf-8") as f:
+                task = json.load(f)
+
+            os.utime(path)  # the claim time is the job's start time
+            process = subprocess.Popen(  # pylint: disable=consider-using-with
+                task["command"],
+                shell=True,
+                env=dict(os.environ, **task["environment"]),
+                start_new_session=True,
+            )
+
+            self.processes[job_id] = (process, name, taskCores, taskMemory)
+            cores -= taskCores
+            memory -= taskMemory
+            started = True
+
+        return started
+
+    def reap(self):
+        """Report finished jobs and kill the jobs the leader asked to."""
+        for job_id, (process, name, _, _) in list(self.processes.items()):
+            kill = os.path.join(self.directory, "kill", str(job_id))
+
+            if process.poll() is None and os.path.exists(kill):
+                _killpg(process)
+                process.wait()
+
+            if process.poll() is not None:
+                self._report(job_id, process.returncode, name)
+
+                if os.path.exists(kill):
+                    os.remove(kill)
+
+    def _report(self, job_id, returncode, name):
+        # processes killed by a signal are reported like a shell would
+        returncode = 128 - returncode if returncode < 0 else returncode
+        del self.processes[job_id]
+
+        try:
+            os.remove(os.path.join(self.claimed, name))
+        except FileNotFoundError:  # already failed by the leader
+            return
+
+        path = os.path.join(self.directory, "done", f"{job_id}.json")
+        _write_json(path, {"exit": returncode, "pilot": self.name})
+
+    def retire(self):
+        """Kill the running jobs, report them as failed and leave the queue."""
+        for job_id, (process, name, _, _) in list(self.processes.items()):
+            if process.poll() is None:
+                _killpg(process)
+                process.wait()
+
+            self._report(job_id, process.returncode, name)
+
+        try:
+            os.remove(self.heartbeat)
+            os.rmdir(self.claimed)
+        except OSError:
+            pass
+
+
+def _killpg(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def main(args=None):
+    """Run Toil jobs from a pilot queue within an LSF allocation."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("directory", help="pilot queue directory")
+    parser.add_argument("--cores", type=float, default=PILOT_CORES)
+    parser.add_argument("--memory", type=float, default=PILOT_MEMORY)
+    parser.add_argument("--runtime", type=int, default=PILOT_RUNTIME)
+    parser.add_argument("--idle", type=float, default=PILOT_IDLE)
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args(args)
+    name = os.getenv("LSB_JOBID") or f"{os.uname().nodename}-{os.getpid()}"
+
+    # LSF sends SIGTERM before killing at the run limit, report the jobs
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+    pilot = Pilot(
+        args.directory,
+        name,
+        args.cores,
+        args.memory,
+        args.runtime,
+        args.idle,
+        args.interval,
+    )
+    pilot.run()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
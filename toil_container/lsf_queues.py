@@ -0,0 +1,275 @@
+"""
+Route LSF jobs to queues by their runtime and memory.
+
+Jobs are routed to the first `TOIL_CONTAINER_LSF_QUEUES` queue whose
+thresholds fit them or, when balancing is enabled, to the eligible queue
+with the shortest expected wait given the load reported by `bqueues`.
+"""
+
+from collections import namedtuple
+from threading import Lock
+import math
+import os
+import subprocess
+import time
+
+from toil.batchSystems.lsf import logger
+
+from toil_container.lsf_output import parse_lsf_int
+
+# route jobs to the eligible TOIL_CONTAINER_LSF_QUEUES queue with the shortest
+# expected wait, estimated from a `bqueues` snapshot, see `QueueBalancer`
+BALANCE_QUEUES = os.getenv("TOIL_CONTAINER_LSF_BALANCE_QUEUES", "N") == "Y"
+
+try:
+    BALANCE_INTERVAL = float(os.getenv("TOIL_CONTAINER_LSF_BALANCE_INTERVAL", "300"))
+except ValueError:  # pragma: no cover
+    BALANCE_INTERVAL = 300.0
+    logger.error("Failed to parse default values for queue balancing.")
+
+
+def parse_queues(string):
+    """
+    Parse queue routing thresholds such as `short:60:8,medium:480,long`.
+
+    Each queue is followed by its maximum runtime in minutes and memory in
+    GB, either of which can be empty or left out for no limit.
+
+    Returns:
+        tuple: `(queue, max runtime, max memory in bytes)` tuples.
+
+    Raises:
+        ValueError: if a threshold is not a number.
+    """
+    queues = []
+
+    for entry in filter(None, string.replace(" ", "").split(",")):
+        queue, runtime, memory = (entry.split(":") + ["", ""])[:3]
+        queues.append(
+            (
+                queue,
+                int(runtime) if runtime else None,
+                float(memory) * 1e9 if memory else None,
+            )
+        )
+
+    return tuple(queues)
+
+
+def eligible_queues(runtime, mem, queues):
+    """
+    Get the queues whose thresholds fit a job, in order.
+
+    Jobs without a runtime only fit queues without a runtime threshold.
+
+    Arguments:
+        runtime (int): the job's runtime in minutes.
+        mem (float): the job's memory in bytes.
+        queues (tuple): thresholds as returned by `parse_queues`.
+
+    Returns:
+        list: the `(queue, max runtime, max memory)` thresholds that fit.
+    """
+    eligible = []
+
+    for queue, max_runtime, max_memory in queues:
+        if max_runtime is not None and (not runtime or int(runtime) > max_runtime):
+            continue
+
+        if max_memory is not None and (mem or 0) > max_memory:
+            continue
+
+        eligible.append((queue, max_runtime, max_memory))
+
+    return eligible
+
+
+def route_queue(runtime, mem, queues):
+    """
+    Get the first queue whose thresholds fit a job.
+
+    Returns:
+        str: the queue, None if no queue fits, see `eligible_queues`.
+    """
+    eligible = eligible_queues(runtime, mem, queues)
+    return eligible[0][0] if eligible else None
+
+
+QueueLoad = namedtuple("QueueLoad", ["queue", "status", "max", "pend", "run", "susp"])
+
+QueueLoad.__doc__ = """
+Load of an LSF queue, in job slots, as reported by `bqueues`.
+
+Attributes:
+    queue (str): queue name.
+    status (str): e.g. `Open:Active`, only open and active queues dispatch.
+    max (int): maximum job slots of the queue, None if unlimited.
+    pend (int): pending job slots.
+    run (int): running job slots.
+    susp (int): suspended job slots.
+"""
+
+
+def parse_bqueues_output(output):
+    """
+    Parse the default output of `bqueues -w` into `QueueLoad` records.
+
+    Returns:
+        dict: `QueueLoad` records by queue name.
+    """
+    lines = [i.split() for i in output.splitlines() if i.strip()]
+    loads = {}
+
+    if not lines or lines[0][0] != "QUEUE_NAME":
+        return loads
+
+    header = lines[0]
+
+    for line in lines[1:]:
+        if len(line) != len(header):
+            logger.debug("Skipping unexpected bqueues line: %s", " ".join(line))
+            continue
+
+        row = dict(zip(header, line))
+        loads[row["QUEUE_NAME"]] = QueueLoad(
+            queue=row["QUEUE_NAME"],
+            status=row["STATUS"],
+            max=parse_lsf_int(row["MAX"]),
+            pend=parse_lsf_int(row["PEND"]) or 0,
+            run=parse_lsf_int(row["RUN"]) or 0,
+            susp=parse_lsf_int(row["SUSP"]) or 0,
+        )
+
+    return loads
+
+
+def expected_wait(load, cpu, runtime, max_runtime):
+    """
+    Estimate the minutes a job would pend in a queue.
+
+    A job starts right away on an open queue without pending jobs and with
+    enough free slots. Otherwise it waits for the pending slots ahead of it
+    to be dispatched, at the queue's slots per turnover, where the turnover
+    is the queue's runtime threshold, or the job's runtime for queues
+    without one as their jobs are assumed to be alike.
+
+    Arguments:
+        load (QueueLoad): the queue's load, None if unknown.
+        cpu (int): slots requested by the job.
+        runtime (int): the job's runtime in minutes.
+        max_runtime (int): the queue's runtime threshold in minutes.
+
+    Returns:
+        float: the expected wait, None if unknown and infinite if the queue
+            doesn't dispatch jobs.
+    """
+    if load is None:
+        return None
+
+    if load.status != "Open:Active":
+        return math.inf
+
+    cpu = int(cpu) or 1
+    free = math.inf if load.max is None else load.max - load.run - load.susp
+
+    if not load.pend and free >= cpu:
+        return 0.0
+
+    capacity = load.max or max(load.run, 1)
+    turnover = max_runtime or runtime or 60
+    return (load.pend + cpu) / capacity * turnover
+
+
+class QueueBalancer:
+
+    """
+    Route jobs to the eligible queue with the shortest expected wait.
+
+    The load of the queues is queried with `bqueues` at most once every
+    `interval` seconds. In between, the slots of the jobs routed to a queue
+    are added to its pending slots, so that a burst of submissions is spread
+    across the queues instead of following a stale snapshot. Every decision
+    is logged with its inputs for audit.
+    """
+
+    def __init__(self, query, interval=None):
+        """
+        Start without a snapshot.
+
+        Arguments:
+            query (callable): called with the queue names, returns the output
+                of `bqueues -w` for them.
+            interval (float): seconds between snapshots, default is
+                BALANCE_INTERVAL.
+        """
+        self.query = query
+        self.interval = BALANCE_INTERVAL if interval is None else interval
+        self.loads = {}
+        self.queried_at = None
+        self._lock = Lock()
+
+    def refresh(self, queues):
+        """Query the load of `queues` if the snapshot is older than `interval`."""
+        now = time.monotonic()
+
+        if self.queried_at is not None and now - self.queried_at < self.interval:
+            return
+
+        # failures are not retried until the next interval either
+        self.queried_at = now
+
+        try:
+            self.loads = parse_bqueues_output(self.query(sorted(queues)))
+        except (OSError, subprocess.SubprocessError) as error:
+            logger.warning(
+                "Failed to query the queues' load, using the last: %s", error
+            )
+
+    def route(self, job_id, cpu, mem, runtime, queues):
+        """
+        Get the eligible queue with the shortest expected wait for a job.
+
+        Ties and queues of unknown load are resolved by the configured order,
+        as with `route_queue`.
+
+        Arguments:
+            job_id (int): the Toil job ID, for the audit log.
+            cpu (int): slots requested by the job.
+            mem (float): the job's memory in bytes, compared to the thresholds.
+            runtime (int): the job's runtime in minutes.
+            queues (tuple): thresholds as returned by `parse_queues`.
+
+        Returns:
+            str: the queue, None if no queue fits.
+        """
+        eligible = eligible_queues(runtime, mem, queues)
+
+        if len(eligible) < 2:
+            return eligible[0][0] if eligible else None
+
+        with self._lock:
+            self.refresh(i[0] for i in eligible)
+            waits = {
+                queue: expected_wait(self.loads.get(queue), cpu, runtime, max_runtime)
+                for queue, max_runtime, _ in eligible
+            }
+            known = [i for i, _, _ in eligible if waits[i] is not None]
+            queue = min(known, key=waits.get) if known else eligible[0][0]
+
+            logger.info(
+                "Routed job %s (cpu=%s, mem=%s, runtime=%s) to queue %s, "
+                "expected waits in minutes: %s, snapshot: %s",
+                job_id,
+                cpu,
+                mem,
+                runtime,
+                queue,
+                {i: None if j is None else round(j, 1) for i, j in waits.items()},
+                {i: self.loads[i]._asdict() for i in waits if i in self.loads},
+            )
+
+            if queue in self.loads:
+                load = self.loads[queue]
+                self.loads[queue] = load._replace(pend=load.pend + (int(cpu) or 1))
+
+        return queue
@@ -0,0 +1,188 @@
+"""
+Retry failed LSF calls, and pause them all while the scheduler is failing.
+
+A single `RETRY_POLICY` is shared by the LSF calls of the process, so that
+its `CircuitBreaker` opens for all of them when mbatchd stops answering. Only
+`LSFDaemonError` counts toward the breaker, other errors are just retried.
+"""
+
+from collections import Counter
+from threading import Lock
+import os
+import random
+import subprocess
+import time
+
+from toil.batchSystems.lsf import logger
+
+from toil_container.exceptions import LSFDaemonError
+
+try:
+    RETRY_ATTEMPTS = int(os.getenv("TOIL_CONTAINER_LSF_RETRY_ATTEMPTS", "4"))
+    RETRY_BASE = float(os.getenv("TOIL_CONTAINER_LSF_RETRY_BASE", "2"))
+    RETRY_CAP = float(os.getenv("TOIL_CONTAINER_LSF_RETRY_CAP", "60"))
+    RETRY_MAX_DELAY = float(os.getenv("TOIL_CONTAINER_LSF_RETRY_MAX_DELAY", "300"))
+    BREAKER_THRESHOLD = int(os.getenv("TOIL_CONTAINER_LSF_BREAKER_THRESHOLD", "5"))
+    BREAKER_COOLDOWN = float(os.getenv("TOIL_CONTAINER_LSF_BREAKER_COOLDOWN", "60"))
+except ValueError:  # pragma: no cover
+    RETRY_ATTEMPTS = 4
+    RETRY_BASE = 2.0
+    RETRY_CAP = 60.0
+    RETRY_MAX_DELAY = 300.0
+    BREAKER_THRESHOLD = 5
+    BREAKER_COOLDOWN = 60.0
+    logger.error("Failed to parse default values for LSF retries.")
+
+
+class CircuitBreaker:
+
+    """
+    Pause all LSF calls of the process while the scheduler is failing.
+
+    The breaker opens after `threshold` consecutive failures, and callers
+    wait until `cooldown` seconds have passed since the last failure. The
+    next call is then let through, a success closes the breaker and a
+    failure opens it again.
+    """
+
+    def __init__(self, threshold=None, cooldown=None):
+        """
+        Set the breaker limits.
+
+        Arguments:
+            threshold (int): consecutive failures to open the breaker.
+            cooldown (float): seconds to pause calls once open.
+        """
+        self.threshold = BREAKER_THRESHOLD if threshold is None else threshold
+        self.cooldown = BREAKER_COOLDOWN if cooldown is None else cooldown
+        self.failures = 0
+        self.opened = None
+        self.lock = Lock()
+
+    def wait(self):
+        """Block while the breaker is open, return the seconds waited."""
+        with self.lock:
+            if self.opened is None:
+                return 0
+            remaining = self.opened + self.cooldown - time.monotonic()
+
+        if remaining <= 0:
+            return 0
+
+        logger.warning("LSF calls paused for %.1fs, scheduler is failing.", remaining)
+        time.sleep(remaining)
+        return remaining
+
+    def success(self):
+        """Record a successful call, closing the breaker."""
+        with self.lock:
+            if self.opened is not None:
+                logger.info("LSF calls resumed, scheduler is answering again.")
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        """Record a failed call, opening the breaker if over the threshold."""
+        with self.lock:
+            self.failures += 1
+
+            if self.failures >= self.threshold:
+                if self.opened is None:
+                    logger.error(
+                        "Pausing LSF calls after %d consecutive failures.",
+                        self.failures,
+                    )
+                self.opened = time.monotonic()
+
+
+class RetryPolicy:
+
+    """
+    Retry failed LSF operations with a decorrelated jitter exponential backoff.
+
+    Each sleep is drawn uniformly between `base` and three times the previous
+    sleep, capped at `cap`, so that concurrent callers don't retry in
+    lockstep. No more than `max_delay` seconds are spent sleeping per call.
+    Attempts, failures and sleeping time are counted in `metrics`.
+    """
+
+    def __init__(
+        self,
+        attempts=None,
+        base=None,
+        cap=None,
+        max_delay=None,
+        breaker=None,
+        errors=(subprocess.CalledProcessError,),
+    ):
+        """
+        Configure the policy, defaults are read from the environment.
+
+        Arguments:
+            attempts (int): maximum number of attempts.
+            base (float): minimum sleep between attempts in seconds.
+            cap (float): maximum sleep between attempts in seconds.
+            max_delay (float): maximum total sleep per call in seconds.
+            breaker (CircuitBreaker): breaker shared with other policies.
+            errors (tuple): exceptions that trigger a retry.
+        """
+        self.attempts = RETRY_ATTEMPTS if attempts is None else attempts
+        self.base = RETRY_BASE if base is None else base
+        self.cap = RETRY_CAP if cap is None else cap
+        self.max_delay = RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.errors = errors
+        self.metrics = Counter()
+        self.lock = Lock()
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.metrics[key] += value
+
+    def call(self, operation, *args, **kwargs):
+        """Call `operation` with `args` and `kwargs`, retrying on errors."""
+        delay = self.base
+        slept = 0
+
+        for attempt in range(1, self.attempts + 1):
+            self._count("breaker_seconds", self.breaker.wait())
+            self._count("attempts")
+
+            try:
+                result = operation(*args, **kwargs)
+            except self.errors as err:
+                self._count("failures")
+
+                if isinstance(err, LSFDaemonError):
+                    self.breaker.failure()
+                logger.error(
+                    "Operation %s failed with code %s (attempt %d/%d): %s",
+                    operation,
+                    getattr(err, "returncode", None),
+                    attempt,
+                    self.attempts,
+                    getattr(err, "stderr", None) or getattr(err, "output", None),
+                )
+
+                delay = min(self.cap, random.uniform(self.base, delay * 3))
+
+                if attempt == self.attempts or slept + delay > self.max_delay:
+                    raise
+
+                time.sleep(delay)
+                slept += delay
+                self._count("sleep_seconds", delay)
+            else:
+                self.breaker.success()
+                return result
+
+        raise RuntimeError("Retry policy must allow at least one attempt.")
+
+
+# shared by all the LSF calls of the process
+RETRY_POLICY = RetryPolicy(breaker=CircuitBreaker())
+
+
+def with_retries(operation, *args, **kwargs):
+    """Call `operation` with the process wide `RETRY_POLICY`."""
+    return RETRY_POLICY.call(operation, *args, **kwargs)
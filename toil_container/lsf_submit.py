@@ -0,0 +1,215 @@
+"""
+Submit the jobs of the custom LSF batch system concurrently or in batches.
+
+Besides one `bsub` call per job, the worker can submit jobs from the
+`SubmissionExecutor` thread pool, or coalesce batches of jobs into job
+arrays or `bsub -pack` files, see `SUBMIT_MODE`.
+"""
+# pylint: disable=C0103
+
+from collections import defaultdict
+from random import randint
+import os
+import re
+import shlex
+import subprocess
+
+from toil.batchSystems.lsf import logger
+from toil.common import Toil
+
+from toil_container import exceptions
+from toil_container import lsf_helper
+from toil_container.lsf_executor import PENDING_LIMIT_ERRORS
+from toil_container.lsf_helper import build_pack_line
+from toil_container.lsf_output import parse_pack_output
+
+
+class BatchSubmissionMixin:
+
+    """Submit the worker's waiting jobs concurrently, as arrays or as packs."""
+
+    def _createConcurrentJobs(self, newJob):
+        """
+        Submit waiting jobs on the submission executor.
+
+        The results of earlier submissions are collected first, then as
+        many jobs are started as the executor and `maxLocalJobs` allow,
+        counting the submissions in flight as running jobs.
+        """
+        if newJob is not None:
+            self.waitingJobs.append(newJob)
+
+        activity = self._collectSubmissions()
+        capacity = min(
+            self._components.submitter.capacity(),
+            int(self.boss.config.maxLocalJobs)
+            - len(self.runningJobs)
+            - len(self._components.submitter.inflight),
+        )
+
+        for _ in range(min(capacity, len(self.waitingJobs))):
+            newJob = self.waitingJobs.pop(0)
+            jobID, cpu, memory, command, jobName, environment = newJob
+            subLine = self.prepareSubmission(
+                cpu, memory, jobID, command, jobName, environment
+            )
+            self._components.submitter.submit(
+                newJob, self.boss.with_retries, self._submitThrottled, subLine
+            )
+            activity = True
+
+        return activity
+
+    def _submitThrottled(self, subLine):
+        """
+        Submit a job from the submission executor.
+
+        Raises:
+            PendingLimitError: if LSF's pending job limit was reached,
+                so that the executor backs off instead of `with_retries`.
+        """
+        try:
+            return self.submitJob(subLine)
+        except subprocess.CalledProcessError as error:
+            if PENDING_LIMIT_ERRORS.search(error.stderr or ""):
+                raise exceptions.PendingLimitError(error.stderr.strip()) from error
+            raise
+
+    def _collectSubmissions(self, block=False):
+        """
+        Map the finished concurrent submissions into `batchJobIDs`.
+
+        Jobs rejected over the pending job limit are put back at the
+        front of the waiting jobs, to be submitted once the executor
+        resumes.
+
+        Arguments:
+            block (bool): wait for all the submissions in flight.
+
+        Returns:
+            bool: True if jobs were submitted.
+        """
+        activity = False
+        rejected = []
+
+        for newJob, result in self._components.submitter.collect(block):
+            if isinstance(result, exceptions.PendingLimitError):
+                rejected.append(newJob)
+                continue
+
+            if isinstance(result, Exception):
+                raise result
+
+            logger.debug("Submitted job %s", result)
+            self._addBatchJobIDs([newJob[0]], result)
+            activity = True
+
+        self.waitingJobs[:0] = rejected
+        self.metrics["submit_rate"] = self._components.submitter.throughput()
+        return activity
+
+    def _submitBatch(self, batch):
+        """Coalesce jobs with identical resources into job arrays or packs."""
+        groups = defaultdict(list)
+
+        if lsf_helper.SUBMIT_MODE == "pack":
+            for newJob in batch:
+                environment = tuple(sorted((newJob[5] or {}).items()))
+                groups[environment].append(newJob)
+
+            for newJobs in groups.values():
+                self._submitPack(newJobs)
+
+            return
+
+        for newJob in batch:
+            jobID, cpu, memory, _, _, environment = newJob
+            jobNode = self.boss.Id2Node.get(jobID)
+            runtime = jobNode and jobNode.runtime
+            memory = jobNode.memory if jobNode else memory
+            spec = jobNode and jobNode.spec
+            environment = tuple(sorted((environment or {}).items()))
+            groups[(cpu, memory, runtime, spec, environment)].append(newJob)
+
+        for (cpu, memory, runtime, _, _), newJobs in groups.items():
+            if len(newJobs) == 1:
+                jobID, cpu, memory, command, jobName, environment = newJobs[0]
+                subLine = self.prepareSubmission(
+                    cpu, memory, jobID, command, jobName, environment
+                )
+                self._addBatchJobIDs(
+                    [jobID], self.boss.with_retries(self.submitJob, subLine)
+                )
+            else:
+                self._submitArray(cpu, memory, runtime, newJobs)
+
+    def _submitArray(self, cpu, memory, runtime, newJobs):
+        """Submit `newJobs` as one job array, dispatching commands by index."""
+        jobIDs = [i[0] for i in newJobs]
+        path = os.path.join(
+            Toil.getToilWorkDir(self.boss.config.workDir),
+            f"toil_{self.boss.config.workflowID}.{jobIDs[0]}.array.sh",
+        )
+
+        with open(path, "w", encoding="utf-8") as f:
+            for jobID, _, _, command, _, _ in newJobs:
+                f.write(self._wrapCommand(jobID, command, array=True) + "\n")
+
+        command = f'eval "$(sed -n "${{LSB_JOBINDEX}}p" {shlex.quote(path)})"'
+        bsubline = self.prepareBsub(cpu, memory, jobIDs[0], runtime, len(jobIDs))
+        subLine = (bsubline + [command], newJobs[0][5])
+        lsfID = self.boss.with_retries(self.submitJob, subLine)
+        self._arrayFiles[path] = set(jobIDs)
+        self._addBatchJobIDs(jobIDs, lsfID, array=True)
+        logger.debug("Submitted %d jobs as LSF array %s", len(jobIDs), lsfID)
+
+    def _submitPack(self, newJobs):
+        """Submit `newJobs` with a single `bsub -pack` call."""
+        jobIDs = [i[0] for i in newJobs]
+        path = os.path.join(
+            Toil.getToilWorkDir(self.boss.config.workDir),
+            f"toil_{self.boss.config.workflowID}.{jobIDs[0]}.pack",
+        )
+
+        with open(path, "w", encoding="utf-8") as f:
+            for jobID, cpu, memory, command, _, _ in newJobs:
+                bsubline = self.prepareBsub(cpu, memory, jobID)
+                command = self._wrapCommand(jobID, command)
+                f.write(build_pack_line(bsubline, command) + "\n")
+
+        environment = dict(self.boss.environment)
+        environment.update(os.environ)
+        environment.update(newJobs[0][5] or {})
+
+        try:
+            output = self.boss.with_retries(self._callPack, path, environment)
+        finally:
+            os.remove(path)
+
+        for jobID, lsfID in zip(jobIDs, parse_pack_output(output, len(jobIDs))):
+            if lsfID is None:
+                logger.error("Could not submit job %s with bsub -pack", jobID)
+                lsfID = f"NOT_SUBMITTED_{randint(10000000, 99999999)}"
+
+            self._addBatchJobIDs([jobID], lsfID)
+
+        logger.debug("Submitted %d jobs with bsub -pack", len(jobIDs))
+
+    def _callPack(self, path, environment):
+        """
+        Call `bsub -pack` for a pack file.
+
+        bsub exits with an error if any line of the file was rejected,
+        in which case the other lines were submitted and must not be
+        submitted again: the output is returned to be parsed per line.
+
+        Raises:
+            subprocess.CalledProcessError: if no job was submitted, so
+                that transient failures are retried.
+        """
+        try:
+            return self._callLSF(["bsub", "-pack", path], check=True, env=environment)
+        except subprocess.CalledProcessError as error:
+            if re.search(r"Job <\d+> is submitted", error.stdout or ""):
+                return error.stdout
+            raise
@@ -0,0 +1,263 @@
+"""
+Record and replay the LSF command traffic of the custom LSF batch system.
+
+A trace is a gzipped file of JSON lines, one per LSF call, with its start
+time relative to the first call, command, exit code, outputs and latency.
+Traces recorded on a cluster can be replayed offline to test and benchmark
+the polling and retry logic, and scrubbed of host and user names first.
+"""
+
+from collections import defaultdict
+from collections import deque
+from threading import Lock
+import argparse
+import gzip
+import json
+import os
+import re
+import subprocess
+import time
+
+from toil.batchSystems.lsf import logger
+
+# record every LSF call to this trace file
+TRACE_PATH = os.getenv("TOIL_CONTAINER_LSF_TRACE")
+
+# serve LSF calls from this trace file instead of running them
+REPLAY_PATH = os.getenv("TOIL_CONTAINER_LSF_REPLAY")
+
+try:
+    REPLAY_SPEED = float(os.getenv("TOIL_CONTAINER_LSF_REPLAY_SPEED", "0"))
+except ValueError:  # pragma: no cover
+    REPLAY_SPEED = 0.0
+    logger.error("Failed to parse default values for LSF replay.")
+
+_HOST_PATTERN = re.compile(r"(?:[Hh]ost(?:\(s\))?|HOST)\s+<([^>]+)>")
+_USER_PATTERN = re.compile(r"User <([^>]+)>|/home/([^/>\s]+)")
+
+
+class TraceRecorder:
+
+    """Append LSF calls to a trace, shared by the worker and poller threads."""
+
+    def __init__(self, path):
+        """
+        Open the trace for writing.
+
+        Arguments:
+            path (str): path to the gzipped trace.
+        """
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = Lock()
+        self._started = None
+
+    def record(self, command, process, started, latency):
+        """
+        Append an LSF call to the trace.
+
+        Arguments:
+            command (list): the LSF command.
+            process (subprocess.CompletedProcess): the result of the call.
+            started (float): `time.monotonic` when the call started.
+            latency (float): seconds the call took.
+        """
+        with self._lock:
+            self._started = self._started or started
+            line = json.dumps(
+                {
+                    "t": round(started - self._started, 3),
+                    "cmd": list(command),
+                    "rc": process.returncode,
+                    "out": process.stdout,
+                    "err": process.stderr,
+                    "lat": round(latency, 3),
+                },
+                separators=(",", ":"),
+            )
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        """Close the trace."""
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    """Get the calls of a trace, ignoring a truncated end."""
+    calls = []
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                calls.append(json.loads(line))
+        except (EOFError, ValueError):
+            logger.warning("Ignoring the truncated end of trace %s", path)
+
+    return calls
+
+
+def write_trace(path, calls):
+    """Write `calls` as a trace."""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for call in calls:
+            f.write(json.dumps(call, separators=(",", ":")) + "\n")
+
+
+def _program(command):
+    """Get the program and options of a command, without job IDs or paths."""
+    return tuple(i for i in command if not re.match(r"^(\d|/)", i))
+
+
+class TraceReplayer:
+
+    """
+    Serve LSF calls from a trace instead of running them.
+
+    A call is answered with the next recorded call of the same command. When
+    there's none left, the last answer to that command is repeated, and
+    commands never recorded are answered with the next recorded call of the
+    same program and options, e.g. `bjobs` with another chunk of job IDs.
+
+    Calls are paced on the recorded timeline divided by `speed`, so that a
+    speed of 1 replays in real time and 10 replays ten times faster. A speed
+    of 0 replays as fast as possible.
+    """
+
+    def __init__(self, path, speed=None):
+        """
+        Load the trace.
+
+        Arguments:
+            path (str): path to the gzipped trace.
+            speed (float): replay speed, default is REPLAY_SPEED.
+        """
+        self.speed = REPLAY_SPEED if speed is None else speed
+        self.exact = defaultdict(deque)
+        self.similar = defaultdict(deque)
+        self.last = {}
+        self.served = 0
+        self.missed = 0
+        self._lock = Lock()
+        self._started = None
+
+        for call in read_trace(path):
+            self.exact[tuple(call["cmd"])].append(call)
+            self.similar[_program(call["cmd"])].append(call)
+
+    def _pop(self, command):
+        key = tuple(command)
+
+        if self.exact[key]:
+            call = self.exact[key].popleft()
+            self.similar[_program(command)].remove(call)
+        elif key in self.last:
+            call = self.last[key]
+        elif self.similar[_program(command)]:
+            call = self.similar[_program(command)].popleft()
+            self.exact[tuple(call["cmd"])].remove(call)
+        else:
+            return None
+
+        self.last[key] = call
+        return call
+
+    def run(self, command):
+        """
+        Get the recorded result of an LSF call.
+
+        Arguments:
+            command (list): the LSF command.
+
+        Returns:
+            subprocess.CompletedProcess: the recorded exit code and outputs,
+                a failed process if the command was never recorded.
+        """
+        with self._lock:
+            self._started = self._started or time.monotonic()
+            call = self._pop(command)
+
+            if call is None:
+                self.missed += 1
+                logger.error("No recorded call for: %s", " ".join(command))
+                return subprocess.CompletedProcess(command, 1, "", "not recorded")
+
+            self.served += 1
+            due = (
+                self._started + (call["t"] + call["lat"]) / self.speed
+                if self.speed
+                else 0
+            )
+
+        delay = due - time.monotonic()
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return subprocess.CompletedProcess(
+            command, call["rc"], call["out"], call["err"]
+        )
+
+
+def scrub(calls, names=()):
+    """
+    Replace host and user names in a trace's calls.
+
+    Host names are found in `Host <name>` fields and user names in
+    `User <name>` fields and `/home/<name>` paths. Each is replaced
+    everywhere, including in paths and commands, by `host<N>` or `user<N>`.
+
+    Arguments:
+        calls (list): calls as returned by `read_trace`.
+        names (list): extra names to replace, e.g. the cluster's domain.
+
+    Returns:
+        list: the scrubbed calls.
+    """
+    text = "\n".join(i["out"] + "\n" + i["err"] for i in calls)
+    found = {}
+
+    for pattern, prefix in [(_HOST_PATTERN, "host"), (_USER_PATTERN, "user")]:
+        for match in pattern.finditer(text):
+            for name in filter(None, match.groups()):
+                for i in re.split(r"[\s,]+", name):
+                    if i and not i.startswith("$") and i not in found:
+                        count = sum(j.startswith(prefix) for j in found.values())
+                        found[i] = f"{prefix}{count + 1}"
+
+    for i, name in enumerate(names):
+        found.setdefault(name, f"name{i + 1}")
+
+    if not found:
+        return calls
+
+    # replace longer names first, so that `lt01` doesn't clobber `lt010`
+    pattern = re.compile(
+        "|".join(rf"\b{re.escape(i)}\b" for i in sorted(found, key=len, reverse=True))
+    )
+
+    def _scrub(value):
+        if isinstance(value, str):
+            return pattern.sub(lambda match: found[match.group(0)], value)
+        if isinstance(value, list):
+            return [_scrub(i) for i in value]
+        return value
+
+    return [{k: _scrub(v) for k, v in i.items()} for i in calls]
+
+
+def main(args=None):
+    """Scrub host and user names from an LSF trace."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("trace", help="trace recorded with TOIL_CONTAINER_LSF_TRACE")
+    parser.add_argument("output", help="path to the scrubbed trace")
+    parser.add_argument(
+        "--name", action="append", default=[], help="extra name to scrub"
+    )
+    args = parser.parse_args(args)
+    write_trace(args.output, scrub(read_trace(args.trace), args.name))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()